@@ -0,0 +1,1430 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+热路径基准测试脚本 - 不需要音频硬件
+"""
+
+import os
+import sys
+import time
+import asyncio
+import types
+import argparse
+import threading
+import tempfile
+import subprocess
+import tracemalloc
+
+import numpy as np
+
+
+class SyntheticStatus:
+    input_overflow = False
+
+
+# 合成设备对 "low"/"high" 建议延迟给出的主机缓冲时长（秒）
+SYNTHETIC_LATENCY = {"low": 0.01, "high": 0.1}
+
+
+class SyntheticInputStream:
+    """代替 sounddevice.RawInputStream 的合成信号源
+
+    realtime=True 时由后台线程按真实时间节奏调用回调；
+    否则由调用方通过 pump() 手动推进，便于做确定性的测量。
+    回调比预定时间晚到超过主机缓冲时长时，与PortAudio一样报告 input_overflow。
+    """
+
+    # 打开流的耗时（秒），模拟真实驱动打开设备的延迟
+    open_delay = 0.0
+
+    def __init__(
+        self, device=None, blocksize=960, callback=None, samplerate=48000, channels=2, realtime=True, amplitude=8000,
+        latency=None, **kwargs
+    ):
+        self.device = device
+        self.blocksize = blocksize
+        self.callback = callback
+        self.samplerate = samplerate
+        self.channels = channels
+        self.realtime = realtime
+        self.active = False
+        self.running = False
+        self.thread = None
+
+        # 预先生成一秒的正弦信号，回调只传递其中的切片
+        t = np.arange(samplerate) / samplerate
+        tone = (np.sin(2 * np.pi * 440 * t) * amplitude).astype(np.int16)
+        self.signal = memoryview(np.repeat(tone, channels).tobytes())
+        self.position = 0
+        self.status = SyntheticStatus()
+        self.latency = max(blocksize / samplerate, SYNTHETIC_LATENCY.get(latency, 0.0))
+        self.blocks = 0
+
+        # hang() 之后不再调用回调，模拟驱动卡住
+        self.hung = False
+        self.time_info = types.SimpleNamespace(inputBufferAdcTime=0.0, currentTime=0.0)
+
+        if self.open_delay:
+            time.sleep(self.open_delay)
+
+    def pump(self):
+        size = self.blocksize * self.channels * 2
+        if self.position + size > len(self.signal):
+            self.position = 0
+
+        # 时间戳按一个块的缓冲延迟给出，供延迟探测使用
+        now = time.perf_counter()
+        self.time_info.currentTime = now
+        self.time_info.inputBufferAdcTime = now - self.latency
+
+        self.callback(self.signal[self.position : self.position + size], self.blocksize, self.time_info, self.status)
+        self.position += size
+
+    def _run(self):
+        interval = self.blocksize / self.samplerate
+        start = time.perf_counter()
+        blocks = 0
+
+        while self.running:
+            # 主机缓冲区在回调被调度之前已经写满
+            self.status.input_overflow = time.perf_counter() - (start + interval * blocks) > self.latency
+            if not self.hung:
+                self.pump()
+            blocks += 1
+            self.blocks = blocks
+            delay = start + interval * blocks - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def start(self):
+        self.active = True
+        self.running = self.realtime
+        if self.realtime:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.active = False
+        self.manual()
+
+    def manual(self):
+        """停掉实时线程，流仍处于打开状态，由调用方 pump() 推进"""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    abort = stop
+
+    def close(self):
+        pass
+
+    def hang(self):
+        self.hung = True
+
+    def fail(self):
+        """模拟回调出错：PortAudio 会停止这个流"""
+        self.active = self.running = False
+
+
+class FakeVoiceClient(threading.Thread):
+    """按discord播放线程的20ms节奏消费帧的本地替身，记录每帧 read() 的耗时"""
+
+    DELAY = 0.02
+
+    def __init__(self, source, duration=60.0):
+        super().__init__(daemon=True)
+        self.source = source
+        self.active = True
+        self.bytes_sent = 0
+
+        # 预分配统计数组，避免测量本身产生逐帧分配
+        capacity = int(duration / self.DELAY) * 2 + 100
+        self.read_times = np.zeros(capacity)
+        self.intervals = np.zeros(capacity)
+        self.frames = 0
+
+    def is_playing(self):
+        return self.active
+
+    def run(self):
+        # 与 discord.player.AudioPlayer 同名的计时属性，sound.resync_player() 会重置它们
+        self.loops = 0
+        self._start = time.perf_counter()
+        last = None
+
+        while self.active and self.frames < len(self.read_times):
+            begin = time.perf_counter()
+            data = self.source.read()
+            self.read_times[self.frames] = time.perf_counter() - begin
+
+            if not data:
+                break
+
+            if last is not None:
+                self.intervals[self.frames] = begin - last
+            last = begin
+            self.frames += 1
+            self.bytes_sent += len(data)
+
+            # 与 discord.player.AudioPlayer 相同的节奏计算
+            self.loops += 1
+            next_time = self._start + self.DELAY * self.loops
+            time.sleep(max(0, self.DELAY + (next_time - time.perf_counter())))
+
+    def stop(self):
+        self.active = False
+        self.join()
+
+
+def install_synthetic_device(realtime=True, amplitude=8000, devices=32, samplerate=48000, channels=2):
+    """用合成信号源替换 sounddevice 模块，必须在导入 sound 之前调用"""
+    module = types.ModuleType("sounddevice")
+    module.default = types.SimpleNamespace(channels=2, dtype="int16", latency="low", samplerate=48000, device=None)
+
+    infos = [
+        {
+            "name": f"Synthetic {index}",
+            "hostapi": 0,
+            "max_input_channels": channels,
+            "default_samplerate": float(samplerate),
+            "default_low_input_latency": 0.01,
+        }
+        for index in range(devices)
+    ]
+
+    # 实际插着的设备；与PortAudio一样，query_devices() 只在重新初始化之后才看到变化
+    module.hardware = list(infos)
+
+    def open_stream(*args, device=None, **kwargs):
+        if infos[device] not in module.hardware:
+            raise RuntimeError(f"Device unavailable [PaErrorCode -9985]: {infos[device]['name']}")
+        return SyntheticInputStream(*args, device=device, realtime=realtime, amplitude=amplitude, **kwargs)
+
+    def initialize():
+        infos[:] = module.hardware
+
+    def query_devices(device=None, kind=None):
+        return infos if device is None else infos[device]
+
+    module.RawInputStream = open_stream
+    module._initialize = initialize
+    module._terminate = lambda: None
+    module.query_devices = query_devices
+    module.query_hostapis = lambda *args, **kwargs: [{"name": "Synthetic", "devices": list(range(devices))}]
+    sys.modules["sounddevice"] = module
+
+
+def opus_available():
+    import sound
+
+    try:
+        sound.OpusEncoder()
+        return True
+    except Exception:
+        return False
+
+
+def check_allocations(frames=1000):
+    """验证稳态下 read_view() 不分配新的缓冲区"""
+    import sound
+
+    stream = sound.PCMStream()
+    stream.change_device(0)
+
+    # 停掉实时线程，改为手动推进
+    source = stream.capture.stream
+    source.manual()
+
+    # 在跟踪状态下预热，让惰性初始化和计数器对象都计入基线
+    tracemalloc.start()
+    for _ in range(50):
+        source.pump()
+        stream.read_view()
+
+    before = tracemalloc.take_snapshot()
+    baseline = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+
+    for _ in range(frames):
+        source.pump()
+        stream.read_view()
+
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    # 计数器的整数对象每帧都会被替换，允许个位数的差异；逐帧分配会表现为上千个新增对象
+    retained = sum(
+        stat.count_diff
+        for stat in after.compare_to(before, "filename")
+        if stat.traceback[0].filename == sound.__file__
+    )
+
+    print("🧪 read_view() 内存分配检查:")
+    print(f"   帧数: {frames}")
+    print(f"   新增常驻对象: {retained}")
+    print(f"   峰值临时分配: {peak} bytes (一帧为 {stream.view.nbytes} bytes)")
+
+    # 只允许少量临时对象（切片视图、标量），不允许出现帧大小的缓冲区
+    ok = retained < 10 and peak < stream.view.nbytes
+    print("   ✅ 通过" if ok else "   ❌ 失败")
+    stream.close()
+    return ok
+
+
+def open_routes(count, opus, shared):
+    import sound
+    import metrics
+
+    streams = []
+    for index in range(count):
+        stream = sound.OpusStream() if opus else sound.PCMStream()
+        stream.change_device(0 if shared else index)
+        metrics.registry.track(f"bench-{index}", stream)
+        streams.append(stream)
+
+    return streams
+
+
+def run_routes(count, duration, opus=False, shared=False):
+    """同时运行 count 条线路，返回延迟、抖动和CPU统计"""
+    streams = open_routes(count, opus, shared)
+    clients = [FakeVoiceClient(stream, duration) for stream in streams]
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+
+    for client in clients:
+        client.start()
+    time.sleep(duration)
+    for client in clients:
+        client.stop()
+
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+
+    read_times = np.concatenate([client.read_times[: client.frames] for client in clients]) * 1000
+    intervals = np.concatenate([client.intervals[1 : client.frames] for client in clients]) * 1000
+
+    result = {
+        "routes": count,
+        "frames": len(read_times),
+        "p50": np.percentile(read_times, 50),
+        "p95": np.percentile(read_times, 95),
+        "p99": np.percentile(read_times, 99),
+        "max": read_times.max(),
+        "jitter": np.std(intervals - FakeVoiceClient.DELAY * 1000),
+        "late": int(np.count_nonzero(intervals > FakeVoiceClient.DELAY * 1000 * 1.5)),
+        "cpu": cpu / wall / count * 100,
+        "underruns": sum(stream.underruns for stream in streams),
+        "overruns": sum(stream.overruns for stream in streams),
+    }
+
+    for stream in streams:
+        stream.close()
+
+    return result
+
+
+def measure_route_allocations(count, duration, opus=False, shared=False):
+    """在 tracemalloc 下运行一小段时间，返回每条线路的常驻增长和峰值（KB）"""
+    streams = open_routes(count, opus, shared)
+    clients = [FakeVoiceClient(stream, duration + 1) for stream in streams]
+
+    for client in clients:
+        client.start()
+
+    # 跳过启动阶段，只测量稳态
+    time.sleep(0.5)
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    time.sleep(duration)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for client in clients:
+        client.stop()
+    for stream in streams:
+        stream.close()
+
+    return (current - baseline) / 1024 / count, (peak - baseline) / 1024 / count
+
+
+def measure_metrics_overhead(frames=100000):
+    """测量每帧指标记录的开销，与20ms的帧预算比较"""
+    import sound
+    import metrics
+
+    stream = sound.PCMStream()
+    stream.change_device(0)
+    route = metrics.RouteMetrics("overhead")
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        begin = time.perf_counter()
+        route.observe(begin, time.perf_counter(), stream.latency())
+    cost = (time.perf_counter() - start) / frames
+    stream.close()
+
+    print("⏱️ 指标记录开销:")
+    print(f"   每帧: {cost * 1e6:.2f} µs ({cost / sound.FRAME_LENGTH * 100:.3f}% 帧预算)")
+    ok = cost < sound.FRAME_LENGTH * 0.01
+    print("   ✅ 通过" if ok else "   ❌ 超过1%帧预算")
+    return ok
+
+
+def measure_resampler(frames=500):
+    """测量常见设备格式转换为48kHz立体声的每帧开销"""
+    import dsp
+
+    print("🎚️ 重采样/混音开销 (每20ms帧):")
+    ok = True
+
+    for samplerate, channels in ((44100, 2), (44100, 1), (48000, 1), (96000, 2), (32000, 1)):
+        converter = dsp.FormatConverter(samplerate, channels)
+        size = round(samplerate * 0.02)
+        block = (np.random.default_rng(0).standard_normal((size, channels)) * 3000).astype(np.int16)
+
+        converter.process(block)
+        start = time.perf_counter()
+        for _ in range(frames):
+            converter.process(block)
+        cost = (time.perf_counter() - start) / frames
+
+        ok = ok and cost < 0.001
+        print(f"   {samplerate:>6} Hz {channels}ch: {cost * 1e6:8.1f} µs")
+
+    print("   ✅ 通过" if ok else "   ❌ 超过1ms")
+    return ok
+
+
+def measure_dsp_chain(frames=500):
+    """测量处理链各级和整条链路在48kHz立体声下的每帧开销"""
+    import dsp
+    import sound
+
+    print("🎛️ 处理链开销 (每20ms帧, 48kHz立体声):")
+    ok = True
+
+    config = [
+        {"type": "gain", "db": 6},
+        {"type": "gate", "threshold": -50},
+        {"type": "highpass", "cutoff": 80},
+        {"type": "limiter", "ceiling": -1},
+    ]
+    frame = (np.random.default_rng(0).standard_normal((sound.FRAME_SAMPLES, 2)) * 8000).astype(np.int16)
+
+    for name, stages in [(stage["type"], [stage]) for stage in config] + [("全部", config)]:
+        chain = dsp.DSPChain(stages, sound.FRAME_SAMPLES, 2, 48000)
+        block = frame.copy()
+
+        chain.process(block)
+        start = time.perf_counter()
+        for _ in range(frames):
+            block[:] = frame
+            chain.process(block)
+        cost = (time.perf_counter() - start) / frames
+
+        ok = ok and cost < 0.0005
+        print(f"   {name:>8}: {cost * 1e6:8.1f} µs")
+
+    print("   ✅ 通过" if ok else "   ❌ 超过0.5ms")
+    return ok
+
+
+def measure_concealment(frames=500):
+    """测量欠载掩盖和恢复交叉淡入的每帧开销，并检查掩盖后的波形没有跳变"""
+    import dsp
+    import sound
+
+    print("🩹 欠载掩盖 (每20ms帧, 48kHz立体声):")
+
+    t = np.arange(sound.FRAME_SAMPLES * 4) / 48000
+    tone = (np.sin(2 * np.pi * 440 * t) * 8000).astype(np.int16)
+    signal = np.repeat(tone[:, None], 2, axis=1)
+    frame = np.empty((sound.FRAME_SAMPLES, 2), dtype=np.int16)
+    concealer = dsp.Concealer(sound.FRAME_SAMPLES, 2, sound.CONCEAL_FRAMES)
+
+    conceal = resume = 0.0
+    for _ in range(frames):
+        frame[:] = signal[: sound.FRAME_SAMPLES]
+        start = time.perf_counter()
+        concealer.conceal(frame)
+        conceal += time.perf_counter() - start
+
+        frame[:] = signal[sound.FRAME_SAMPLES : 2 * sound.FRAME_SAMPLES]
+        start = time.perf_counter()
+        concealer.resume(frame)
+        resume += time.perf_counter() - start
+    conceal /= frames
+    resume /= frames
+
+    # 一帧正常数据、两帧欠载、再恢复：相邻采样的最大跳变不应超过正弦波本身的斜率太多
+    output = []
+    for index, missing in enumerate([False, True, True, False]):
+        if missing:
+            # 欠载时 frame 中仍是上一次输出的帧
+            concealer.conceal(frame)
+        else:
+            frame[:] = signal[index * sound.FRAME_SAMPLES : (index + 1) * sound.FRAME_SAMPLES]
+            if concealer.missing:
+                concealer.resume(frame)
+        output.append(frame.copy())
+    output = np.concatenate(output).astype(np.float32)
+    step = float(np.abs(np.diff(output[:, 0])).max())
+    slope = float(np.abs(np.diff(signal[:, 0].astype(np.float32))).max())
+
+    # 直接补静音时的跳变
+    gap = float(abs(signal[sound.FRAME_SAMPLES - 1, 0]))
+
+    ok = conceal < 0.0005 and resume < 0.0005 and step <= slope * 1.5
+    print(f"   掩盖: {conceal * 1e6:.1f} µs, 恢复: {resume * 1e6:.1f} µs")
+    print(f"   最大相邻采样跳变: {step:.0f} (正弦本身 {slope:.0f}, 补静音 {gap:.0f})")
+    print("   ✅ 通过" if ok else "   ❌ 开销超过0.5ms或波形有跳变")
+    return ok
+
+
+def measure_device_lookup(lookups=100000):
+    """测量缓存的设备注册表按标识查找设备的开销"""
+    import sound
+
+    print("🔎 设备查找开销:")
+    identity = str(sound.device_registry.identity(len(sound.device_registry.query()) - 1))
+    sound.device_registry.resolve(identity)
+
+    start = time.perf_counter()
+    for _ in range(lookups):
+        sound.device_registry.resolve(identity)
+    cost = (time.perf_counter() - start) / lookups
+
+    start = time.perf_counter()
+    for _ in range(lookups // 100):
+        sound.query_devices()
+    listing = (time.perf_counter() - start) / (lookups // 100)
+
+    ok = cost < 0.0001
+    print(f"   按标识解析: {cost * 1e6:8.2f} µs")
+    print(f"   列出设备:   {listing * 1e6:8.2f} µs")
+    print("   ✅ 通过" if ok else "   ❌ 超过100µs")
+    return ok
+
+
+def measure_recorder(frames=5000):
+    """写入线程卡住（模拟磁盘停顿）时，录音分接 feed() 的耗时和丢弃的录音帧数"""
+    import tempfile
+    import recorder
+
+    print("💾 录音分接 (写入线程卡住):")
+    stall = threading.Event()
+    packet = b"\x00" * 320
+    costs = np.zeros(frames)
+
+    with tempfile.TemporaryDirectory() as directory:
+        tap = recorder.Recorder(directory, "bench")
+        tap.write = lambda timestamp, data: stall.wait()
+
+        for index in range(frames):
+            start = time.perf_counter()
+            tap.feed(packet)
+            costs[index] = time.perf_counter() - start
+
+        stall.set()
+        tap.close()
+
+    # 单次调用可能赶上一次GIL切换（默认5ms），最大值只用来确认没有阻塞在写入线程上
+    ok = np.percentile(costs, 99) < 0.0001 and costs.max() < 4 * sys.getswitchinterval() and tap.dropped > 0
+    print(f"   feed() p99: {np.percentile(costs, 99) * 1e6:.1f} µs, max: {costs.max() * 1e6:.1f} µs")
+    print(f"   丢弃录音帧: {tap.dropped} / {frames} (队列容量 {recorder.RECORD_QUEUE})")
+    print("   ✅ 通过" if ok else "   ❌ feed() 被阻塞或没有丢帧")
+    return ok
+
+
+# 启动测量用的 sounddevice 替身：只提供设备查询，子进程通过 PYTHONPATH 加载它
+STUB_SOUNDDEVICE = """
+import types
+default = types.SimpleNamespace(channels=2, dtype="int16", latency="low", samplerate=48000, device=None)
+_infos = [
+    {"name": f"Synthetic {index}", "hostapi": 0, "max_input_channels": 2,
+     "default_samplerate": 48000.0, "default_low_input_latency": 0.01}
+    for index in range(4)
+]
+def query_devices(device=None, kind=None):
+    return _infos if device is None else _infos[device]
+def query_hostapis(*args, **kwargs):
+    return [{"name": "Synthetic", "devices": list(range(4))}]
+"""
+
+
+def measure_startup(runs=5):
+    """在子进程中用 python -X importtime 测量 --help、-D 和完整导入的启动时间
+
+    完整导入对应原来 main.pyw 在处理参数之前加载的模块。sounddevice 用只能查询设备的
+    替身代替（这里没有PortAudio），它本身的导入开销不计入任何一项。
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    commands = {
+        "--help": ["main.pyw", "--help"],
+        "-D": ["main.pyw", "-D"],
+        "完整导入": ["-c", "import cli, sound, metrics, discord; from discord.ext import commands"],
+    }
+
+    print("🚀 启动时间 (子进程, 中位数):")
+    results = {}
+    with tempfile.TemporaryDirectory() as stub:
+        with open(os.path.join(stub, "sounddevice.py"), "w") as file:
+            file.write(STUB_SOUNDDEVICE)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([stub, root]))
+
+        for name, command in commands.items():
+            walls = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                process = subprocess.run(
+                    [sys.executable, "-X", "importtime"] + command, cwd=root, env=env, capture_output=True, text=True
+                )
+                walls.append(time.perf_counter() - start)
+
+            # importtime 的每一行为 "import time: self | cumulative | package"，顶层模块没有缩进
+            imported = set()
+            total = 0
+            for line in process.stderr.splitlines():
+                if not line.startswith("import time:") or "|" not in line:
+                    continue
+                fields = line.split("|")
+                if not fields[1].strip().isdigit():
+                    continue
+                package = fields[2].rstrip()
+                imported.add(package.strip())
+                if package.startswith(" ") and not package.startswith("  "):
+                    total += int(fields[1])
+
+            results[name] = (process.returncode, float(np.median(walls)), imported)
+            heavy = [module for module in ("discord", "numpy", "PyQt5", "sound") if module in imported]
+            print(
+                f"   {name:>6}: {np.median(walls) * 1000:7.1f} ms (导入 {total / 1000:6.1f} ms)"
+                f"  加载: {', '.join(heavy) or '-'}"
+            )
+
+    full = results["完整导入"][1]
+    ok = all(code == 0 for code, _, _ in results.values()) and all(
+        results[name][1] < full / 2 and "discord" not in results[name][2] for name in ("--help", "-D")
+    )
+    print("   ✅ 通过" if ok else "   ❌ 查询命令仍在加载完整依赖")
+    return ok
+
+
+def start_discord_standin(guilds, delay, limit_every):
+    """本地的discord REST替身：用户、分页的服务器列表和频道列表
+
+    每个请求延迟 delay 秒模拟网络往返，每 limit_every 个频道请求返回一次429。
+    """
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlparse, parse_qs
+
+    ids = [1000 + index for index in range(guilds)]
+    counter = {"channels": 0, "limited": 0, "requests": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, status, payload, headers=()):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            time.sleep(delay)
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            parts = url.path.split("/")[3:]
+            with lock:
+                counter["requests"] += 1
+
+            if parts == ["users", "@me"]:
+                self.reply(200, {"id": "1", "username": "bench", "discriminator": "0", "avatar": None})
+
+            elif parts == ["oauth2", "applications", "@me"]:
+                self.reply(
+                    200,
+                    {"id": "1", "name": "bench", "description": "", "icon": None, "verify_key": "",
+                     "bot_public": True, "bot_require_code_grant": False, "flags": 0,
+                     "owner": {"id": "2", "username": "owner", "discriminator": "0", "avatar": None}},
+                )
+
+            elif parts == ["users", "@me", "guilds"]:
+                after = int(query.get("after", ["0"])[0])
+                limit = int(query.get("limit", ["200"])[0])
+                page = [guild for guild in ids if guild > after][:limit]
+                self.reply(200, [{"id": str(guild), "name": f"Guild {guild}", "features": []} for guild in page])
+
+            elif len(parts) == 3 and parts[0] == "guilds" and parts[2] == "channels":
+                with lock:
+                    counter["channels"] += 1
+                    limited = counter["channels"] % limit_every == 0
+                    counter["limited"] += limited
+                if limited:
+                    self.reply(
+                        429,
+                        {"message": "You are being rate limited.", "retry_after": 0.05, "global": False},
+                        (("Via", "1.1 standin"), ("Retry-After", "1"), ("X-RateLimit-Scope", "user")),
+                    )
+                    return
+
+                guild = parts[1]
+                self.reply(
+                    200,
+                    [
+                        {"id": f"{guild}{index}", "type": 2, "name": f"Voice {index}", "guild_id": guild,
+                         "position": index, "permission_overwrites": [], "bitrate": 64000, "user_limit": 0}
+                        for index in range(3)
+                    ],
+                )
+
+            else:
+                self.reply(404, {"message": "Unknown", "code": 0})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, counter
+
+
+def measure_discovery(guilds=400, delay=0.02, limit_every=40):
+    """对比原来逐个服务器串行获取频道（限150个）和 discovery 的并发分页获取、磁盘缓存"""
+    import logging
+    import discord
+    import discord.http
+    import discovery
+
+    server, counter = start_discord_standin(guilds, delay, limit_every)
+    base = discord.http.Route.BASE
+    discord.http.Route.BASE = f"http://127.0.0.1:{server.server_address[1]}/api/v10"
+    logging.getLogger("discord").setLevel(logging.ERROR)
+
+    async def serial():
+        # 原来 cli.query 的实现
+        client = discord.Client(intents=discord.Intents.none())
+        await client.login("token")
+        count = 0
+        async for guild in client.fetch_guilds(limit=150):
+            await guild.fetch_channels()
+            count += 1
+        await client.close()
+        return count
+
+    async def concurrent(path):
+        client = discord.Client(intents=discord.Intents.none())
+        return await discovery.discover(client, "token", path=path)
+
+    print(f"🌐 频道发现 ({guilds} 个服务器, 本地替身每请求 {delay * 1000:.0f} ms, 每 {limit_every} 个请求一次429):")
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "channels_cache.json")
+
+            start = time.perf_counter()
+            serial_count = asyncio.run(serial())
+            serial_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            fetched, _ = asyncio.run(concurrent(path))
+            concurrent_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            cached, hit = asyncio.run(concurrent(path))
+            cached_time = time.perf_counter() - start
+    finally:
+        discord.http.Route.BASE = base
+        server.shutdown()
+
+    complete = len(fetched) == guilds and all(len(guild["channels"]) == 3 for guild in fetched)
+    print(f"   串行 (原实现): {serial_time * 1000:8.1f} ms, {serial_count} 个服务器")
+    print(f"   并发:          {concurrent_time * 1000:8.1f} ms, {len(fetched)} 个服务器, 429重试 {counter['limited']} 次")
+    print(f"   缓存:          {cached_time * 1000:8.1f} ms, {len(cached)} 个服务器")
+
+    ok = complete and hit and cached == fetched and concurrent_time < serial_time and cached_time < 0.05
+    print("   ✅ 通过" if ok else "   ❌ 结果不完整、比串行慢或缓存未命中")
+    return ok
+
+
+def measure_event_loop(duration=3.0, interval=0.05):
+    """对比原来轮询式的 run_Qt 和 qasync 集成事件循环的空闲CPU与事件延迟
+
+    空闲时每隔 interval 秒从其它线程投递一个asyncio回调（模拟discord网关事件），
+    并从协程中投递一个Qt定时器事件（模拟界面事件），记录它们被执行时的延迟。
+    """
+    try:
+        import qasync
+        from PyQt5 import QtCore
+    except ImportError:
+        print("🔁 事件循环: 未安装 PyQt5/qasync，跳过")
+        return True
+
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+    async def poll_qt(poll=0.01):
+        # gui.GUI.run_Qt 原来的实现
+        while True:
+            QtCore.QCoreApplication.processEvents(QtCore.QEventLoop.AllEvents, int(poll * 1000))
+            await asyncio.sleep(poll)
+
+    async def idle(loop):
+        async_delays = []
+        qt_delays = []
+        stop = threading.Event()
+
+        def post():
+            while not stop.wait(interval):
+                sent = time.perf_counter()
+                loop.call_soon_threadsafe(lambda: async_delays.append(time.perf_counter() - sent))
+
+        thread = threading.Thread(target=post, daemon=True)
+        start = time.process_time()
+        thread.start()
+
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            sent = time.perf_counter()
+            QtCore.QTimer.singleShot(0, lambda sent=sent: qt_delays.append(time.perf_counter() - sent))
+            await asyncio.sleep(interval)
+
+        stop.set()
+        thread.join()
+        return (time.process_time() - start) / duration, async_delays, qt_delays
+
+    loop = asyncio.new_event_loop()
+    poller = loop.create_task(poll_qt())
+    polling = loop.run_until_complete(idle(loop))
+    poller.cancel()
+    loop.run_until_complete(asyncio.gather(poller, return_exceptions=True))
+    loop.close()
+
+    loop = qasync.QEventLoop(app)
+    with loop:
+        integrated = loop.run_until_complete(idle(loop))
+    asyncio.set_event_loop(None)
+
+    print("🔁 事件循环 (空闲):")
+    print(f"   {'模式':>6} {'CPU':>8} {'asyncio p50':>12} {'asyncio max':>12} {'Qt p50':>9} {'Qt max':>9}")
+    for name, (cpu, async_delays, qt_delays) in (("轮询", polling), ("集成", integrated)):
+        print(
+            f"   {name:>6} {cpu * 100:>7.2f}% {np.median(async_delays) * 1000:>12.3f} {max(async_delays) * 1000:>12.3f} "
+            f"{np.median(qt_delays) * 1000:>9.3f} {max(qt_delays) * 1000:>9.3f}"
+        )
+    print("   (延迟单位为毫秒)")
+
+    ok = integrated[0] <= polling[0]
+    print("   ✅ 通过" if ok else "   ❌ 集成循环的空闲CPU高于轮询")
+    return ok
+
+
+def measure_stall_recovery(duration=1.5):
+    """设备卡住、流出错时播放线程是否一直拿到帧，以及看门狗恢复设备所用的时间"""
+    import sound
+    import metrics
+
+    print("🐕 采集看门狗 (设备卡住 / 流出错):")
+    stream = open_routes(1, False, False)[0]
+    client = FakeVoiceClient(stream, duration * 3 + 1)
+    device = metrics.registry.device(sound.device_registry.identity(stream.capture.device))
+    outages = device.outages
+
+    client.start()
+    time.sleep(0.5)
+    stream.capture.stream.hang()
+    time.sleep(duration)
+    stream.capture.stream.fail()
+    time.sleep(duration)
+    client.stop()
+
+    intervals = client.intervals[5 : client.frames] * 1000
+    read_times = client.read_times[: client.frames] * 1000
+    expected = (0.5 + duration * 2) / FakeVoiceClient.DELAY
+    recovered = device.outages - outages
+    stream.close()
+
+    print(f"   帧数: {client.frames} / {expected:.0f}, 欠载(静音补位): {stream.underruns}")
+    print(f"   read() 最大: {read_times.max():.2f} ms, 间隔最大: {intervals.max():.2f} ms")
+    if device.outage_seconds.count:
+        print(
+            f"   恢复次数: {recovered}, 平均中断: {device.outage_seconds.sum / device.outage_seconds.count * 1000:.0f} ms, "
+            f"平均恢复: {device.recovery_seconds.sum / device.recovery_seconds.count * 1000:.0f} ms"
+        )
+
+    # 读取方最多等待一帧，之后用静音补位；discord的播放线程拿到 None 就会停止
+    ok = recovered == 2 and client.frames >= expected * 0.9 and read_times.max() < FakeVoiceClient.DELAY * 1000 * 2
+    print("   ✅ 通过" if ok else "   ❌ 播放线程被中断或设备没有恢复")
+    return ok
+
+
+def measure_device_switch(switches=6, open_delay=0.15):
+    """播放中切换设备：热切换的丢帧数和帧间隔，对比停止播放、重新打开再播放的间断"""
+    import sound
+
+    print(f"🔀 设备热切换 (打开设备耗时 {open_delay * 1000:.0f}ms):")
+    SyntheticInputStream.open_delay = open_delay
+    devices = (6, 7)
+
+    try:
+        stream = sound.PCMStream()
+        stream.change_device(devices[0])
+        client = FakeVoiceClient(stream, switches * 0.5 + 2)
+        client.start()
+        time.sleep(0.3)
+
+        underruns = stream.underruns
+        durations = []
+        for index in range(switches):
+            start = time.perf_counter()
+            stream.switch_device(devices[(index + 1) % 2])
+            durations.append(time.perf_counter() - start)
+            time.sleep(0.2)
+
+        client.stop()
+        dropped = stream.underruns - underruns
+        intervals = client.intervals[5 : client.frames] * 1000
+        reads = client.read_times[5 : client.frames] * 1000
+
+        # 原来的做法：停止播放，同步换设备，再重新开始播放
+        gaps = []
+        for index in range(switches):
+            client = FakeVoiceClient(stream, 2)
+            client.start()
+            time.sleep(0.1)
+
+            start = time.perf_counter()
+            client.stop()
+            stream.change_device(devices[index % 2])
+            client = FakeVoiceClient(stream, 2)
+            client.start()
+            while not client.frames:
+                time.sleep(0.001)
+            gaps.append(time.perf_counter() - start)
+            client.stop()
+
+        stream.close()
+    finally:
+        SyntheticInputStream.open_delay = 0.0
+
+    legacy = max(gaps) * 1000
+    print(f"   热切换: {stream.switches} 次, 丢帧 {dropped}, 帧间隔最大 {intervals.max():.1f}ms, "
+          f"read() 最大 {reads.max():.2f}ms, 后台打开+预热 {np.median(durations) * 1000:.0f}ms")
+    print(f"   停止重开: 间断最长 {legacy:.0f}ms (约 {legacy / 20:.0f} 帧)")
+
+    ok = dropped == 0 and intervals.max() < 40
+    print("   ✅ 通过" if ok else "   ❌ 热切换有丢帧或间断")
+    return ok
+
+
+def measure_restage(device=5):
+    """播放中替换处理链：独占的链路原地换，共享的链路在包边界换到新链路，都不应丢帧或出现间断"""
+    import sound
+
+    print("🎛️ 热替换处理链:")
+    if not opus_available():
+        print("   Opus 不可用，跳过")
+        return True
+
+    stream = sound.OpusStream()
+    stream.change_device(device)
+    client = FakeVoiceClient(stream, 10)
+    client.start()
+    time.sleep(0.3)
+
+    # 独占链路：原地换上新的处理链
+    broadcast = stream.broadcast
+    stream.set_stages([{"type": "gain", "db": -1}])
+    in_place = stream.broadcast is broadcast and broadcast.pcm.chain.config == [{"type": "gain", "db": -1}]
+    time.sleep(0.3)
+
+    # 另一个连接共享同一条链路后，换处理链要换到新链路，另一个连接不受影响
+    other = sound.OpusStream(stages=[{"type": "gain", "db": -1}])
+    other.change_device(device)
+    shared = other.broadcast is stream.broadcast
+    stream.set_stages([{"type": "gain", "db": -2}])
+    swapped = stream.broadcast is not other.broadcast and other.broadcast.stages == [{"type": "gain", "db": -1}]
+    time.sleep(0.3)
+
+    client.stop()
+    intervals = client.intervals[5 : client.frames] * 1000
+    underruns = stream.underruns
+    stream.close()
+    other.close()
+
+    print(f"   原地替换: {'是' if in_place else '否'}, 共享时换链路: {'是' if shared and swapped else '否'}")
+    print(f"   帧间隔最长 {intervals.max():.1f}ms, 欠载 {underruns}")
+
+    ok = in_place and shared and swapped and intervals.max() < 40 and underruns == 0
+    print("   ✅ 通过" if ok else "   ❌ 替换处理链时有间断或没有换到正确的链路")
+    return ok
+
+
+def check_counters():
+    """换设备、热切换、换处理链和线路重建音频源之后，导出的丢帧和欠载计数都不减少"""
+    import sound
+    import metrics
+
+    opus = opus_available()
+    print(f"🔢 丢帧/欠载计数 ({'OpusStream' if opus else 'PCMStream'}):")
+
+    def make(device, route="counters"):
+        stream = sound.OpusStream() if opus else sound.PCMStream()
+        stream.change_device(device)
+        metrics.registry.track(route, stream)
+        return stream
+
+    def counters():
+        values = {}
+        for line in metrics.registry.render().splitlines():
+            name = line.split("{")[0]
+            if name in ("dap_dropped_frames_total", "dap_underruns_total") and 'route="counters"' in line:
+                values[name] = int(line.split()[-1])
+        return values["dap_dropped_frames_total"], values["dap_underruns_total"]
+
+    stream = make(0)
+    client = FakeVoiceClient(stream, 10)
+    client.start()
+
+    # 共享链路：热切换到这个设备时走换链路、包边界切换的路径
+    other = make(3, "counters-other") if opus else None
+
+    steps = [
+        ("change_device", lambda: stream.change_device(1)),
+        ("switch_device", lambda: stream.switch_device(2).join() if opus else stream.switch_device(2)),
+    ]
+    if opus:
+        steps.append(("shared switch", lambda: stream.switch_device(3).join()))
+        steps.append(("set_stages", lambda: stream.set_stages([{"type": "gain", "db": -1}])))
+
+    history = [counters()]
+    injected = 0
+    for name, action in steps:
+        # 在当前游标上制造丢帧和欠载，切换之后它们仍应计入
+        stream.reader.overruns += 2
+        stream.underruns += 1
+        injected += 1
+        action()
+        history.append(counters())
+        print(f"   {name}: 丢帧 {history[-1][0]}, 欠载 {history[-1][1]}")
+
+    client.stop()
+    stream.reader.overruns += 2
+    stream.underruns += 1
+    injected += 1
+    previous = stream
+    stream = make(4)
+    previous.close()
+    history.append(counters())
+    print(f"   重建音频源: 丢帧 {history[-1][0]}, 欠载 {history[-1][1]}")
+
+    stream.close()
+    if other is not None:
+        other.close()
+
+    dropped = [value[0] for value in history]
+    underruns = [value[1] for value in history]
+    monotonic = all(b >= a for a, b in zip(dropped, dropped[1:])) and all(b >= a for a, b in zip(underruns, underruns[1:]))
+    ok = monotonic and dropped[-1] >= injected * 2 and underruns[-1] >= injected
+    print("   ✅ 通过" if ok else "   ❌ 计数在切换后减少")
+    return ok
+
+
+def measure_mute(count=4, duration=2.0):
+    """手动静音：静音期间的CPU和发出的帧数，取消静音到第一帧的时间，以及第一帧是否是积压的旧数据"""
+    import sound
+
+    opus = opus_available()
+    print(f"🔇 手动静音 ({count} 条线路, {'OpusStream' if opus else 'PCMStream'}):")
+    streams = open_routes(count, opus, False)
+    clients = [FakeVoiceClient(stream, duration * 3 + 2) for stream in streams]
+    for client in clients:
+        client.start()
+    time.sleep(0.3)
+
+    def cpu(seconds):
+        start = time.process_time()
+        time.sleep(seconds)
+        return (time.process_time() - start) / seconds
+
+    playing = cpu(duration)
+    encoded = [stream.broadcast.encoded for stream in streams] if opus else None
+
+    sent = [client.frames for client in clients]
+    for stream in streams:
+        stream.set_muted(True)
+    time.sleep(0.1)
+    muted = cpu(duration)
+    sent = sum(client.frames - frames for client, frames in zip(clients, sent))
+    if opus:
+        encoded = sum(stream.broadcast.encoded - frames for stream, frames in zip(streams, encoded))
+
+    delays = []
+    lags = []
+    resumed = []
+    for stream, client in zip(streams, clients):
+        frames = client.frames
+        start = time.perf_counter()
+        stream.set_muted(False)
+        while client.frames == frames:
+            time.sleep(0.0005)
+        delays.append(time.perf_counter() - start)
+        lags.append(stream.latency())
+        resumed.append(frames)
+
+    time.sleep(0.5)
+    for client in clients:
+        client.stop()
+    for stream in streams:
+        stream.close()
+
+    # 取消静音后的发送间隔，停住的那次 read() 从静音前开始，跳过它之后的一个间隔。
+    # 播放线程的计时没有重置时，它会连续发包追赶静音的时长
+    intervals = np.concatenate(
+        [client.intervals[frames + 2 : client.frames] for client, frames in zip(clients, resumed)]
+    ) * 1000
+
+    underruns = sum(stream.underruns for stream in streams)
+    print(f"   CPU: 播放 {playing * 100:.1f}%, 静音 {muted * 100:.1f}%")
+    # 静音不足 PARK_LIMIT 时不会有保活帧，之前的帧可能还在发出
+    print(f"   静音期间发出 {sent} 帧" + (f", 编码 {encoded} 帧" if opus else ""))
+    print(f"   取消静音到第一帧: 最长 {max(delays) * 1000:.1f}ms, 第一帧延迟最长 {max(lags) * 1000:.1f}ms, 欠载 {underruns}")
+    print(
+        f"   取消静音后发送间隔: 最短 {intervals.min():.1f}ms, 最长 {intervals.max():.1f}ms, 标准差 {intervals.std():.2f}ms"
+    )
+
+    ok = sent <= count and (not opus or encoded <= count) and max(delays) < 0.04 and max(lags) < 0.04
+    ok = ok and intervals.min() > 10 and intervals.max() < 40 and intervals.std() < 5
+    ok = ok and muted < playing
+    print("   ✅ 通过" if ok else "   ❌ 静音仍有开销、恢复太慢或恢复后发包不均匀")
+    return ok
+
+
+def measure_gate_park(count=2, duration=1.5, profile="robust"):
+    """静音门限关闭时播放线程停在 read() 里，门限重新打开后的发送间隔是否均匀
+
+    用大块采集的延迟配置：数据成批到达，播放线程的计时没有重置时会跟着每批连续发包。
+    """
+    import sound
+
+    opus = opus_available()
+    print(f"🚪 静音门限停住 ({count} 条线路, {'OpusStream' if opus else 'PCMStream'}, {profile}):")
+    sound.set_latency_profile(profile)
+    silence = {"threshold": 10, "hang": 0.1}
+    streams = []
+    for index in range(count):
+        stream = sound.OpusStream(silence=silence) if opus else sound.PCMStream(silence=silence)
+        stream.change_device(index)
+        streams.append(stream)
+    gates = [stream.broadcast.pcm.gate if opus else stream.gate for stream in streams]
+
+    clients = [FakeVoiceClient(stream, duration + 2) for stream in streams]
+    for client in clients:
+        client.start()
+    time.sleep(0.3)
+
+    # 调高阈值让门限关闭，停住一段时间后恢复
+    for gate in gates:
+        gate.threshold = 1e9
+    time.sleep(duration)
+    resumed = [client.frames for client in clients]
+    for gate in gates:
+        gate.threshold = 10
+    time.sleep(0.5)
+
+    for client in clients:
+        client.stop()
+    for stream in streams:
+        stream.close()
+    sound.set_latency_profile("balanced")
+
+    # 跳过停住的那次 read() 之后的一个间隔，其余应当保持20ms一帧
+    intervals = np.concatenate(
+        [client.intervals[frames + 2 : client.frames] for client, frames in zip(clients, resumed)]
+    ) * 1000
+    print(f"   停住 {duration:.1f}s 后发出 {len(intervals)} 个间隔")
+    print(f"   发送间隔: 最短 {intervals.min():.1f}ms, 最长 {intervals.max():.1f}ms, 标准差 {intervals.std():.2f}ms")
+
+    ok = len(intervals) > 0 and intervals.min() > 5 and intervals.max() < 40 and intervals.std() < 5
+    print("   ✅ 通过" if ok else "   ❌ 门限打开后播放线程连续发包追赶")
+    return ok
+
+
+def measure_hotplug(device=7, timeout=8.0):
+    """设备拔出后以新的索引重新插入：看门狗重新扫描PortAudio，按稳定标识找回设备继续采集"""
+    import sound
+    import sounddevice as sd
+
+    print("🔌 设备热插拔 (重新插入后索引变化):")
+    stream = sound.PCMStream()
+    stream.change_device(device)
+    capture = stream.capture
+    client = FakeVoiceClient(stream, timeout + 3)
+    client.start()
+    time.sleep(0.3)
+
+    # 拔出：流出错停止，设备从硬件列表消失
+    info = sd.hardware.pop(device)
+    capture.stream.fail()
+    time.sleep(1.0)
+
+    # 插回：前面先插入了另一个设备，索引变了
+    sd.hardware.append({**info, "name": "Synthetic hub"})
+    sd.hardware.append(info)
+    start = time.perf_counter()
+    written = capture.ring.written
+    while time.perf_counter() - start < timeout and capture.ring.written <= written:
+        time.sleep(0.05)
+    recovered = capture.ring.written > written
+    elapsed = time.perf_counter() - start
+    moved = capture.device
+
+    client.stop()
+    stream.close()
+
+    # 恢复原来的设备列表，不影响后面的测量
+    sd.hardware[:] = sd.hardware[:device] + [info] + sd.hardware[device:-2]
+    sound.device_registry.refresh(rescan=True)
+
+    print(f"   设备索引 {device} -> {moved}, 插回后 {elapsed:.2f}s 恢复采集, 播放线程收到 {client.frames} 帧")
+    ok = recovered and moved != device
+    print("   ✅ 通过" if ok else "   ❌ 没有找回重新插入的设备")
+    return ok
+
+
+def measure_latency_profiles(count=4, duration=2.0, load=2):
+    """对比各延迟配置的每秒唤醒次数、CPU占用，以及在GIL争用下的溢出/欠载率
+
+    空闲时测唤醒和CPU；再启动 load 个纯Python忙循环线程，模拟繁忙主机上回调被推迟。
+    """
+    import sound
+
+    def burn(stop):
+        while not stop.is_set():
+            sum(range(1000))
+
+    def run(profile, loaded):
+        sound.set_latency_profile(profile)
+        streams = open_routes(count, False, False)
+        clients = [FakeVoiceClient(stream, duration) for stream in streams]
+
+        stop = threading.Event()
+        burners = [threading.Thread(target=burn, args=(stop,), daemon=True) for _ in range(load if loaded else 0)]
+        for thread in burners:
+            thread.start()
+
+        blocks = [stream.capture.stream.blocks for stream in streams]
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        for client in clients:
+            client.start()
+        time.sleep(duration)
+        for client in clients:
+            client.stop()
+        cpu = time.process_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+
+        stop.set()
+        for thread in burners:
+            thread.join()
+
+        wakeups = sum(stream.capture.stream.blocks - start for stream, start in zip(streams, blocks)) / wall / count
+        overruns = sum(stream.overruns for stream in streams) / wall / count * 60
+        underruns = sum(stream.underruns for stream in streams) / wall / count * 60
+        for stream in streams:
+            stream.close()
+
+        return wakeups, cpu / wall / count * 100, overruns, underruns
+
+    print(f"⏲️ 延迟配置 ({count} 条线路, 负载时 {load} 个忙循环线程):")
+    print(f"   {'配置':>9} {'块长ms':>6} {'唤醒/秒':>7} {'CPU/线路':>9} {'溢出/分':>8} {'欠载/分':>8}")
+
+    results = {}
+    for name, profile in sound.LATENCY_PROFILES.items():
+        wakeups, cpu, _, _ = run(name, False)
+        _, _, overruns, underruns = run(name, True)
+        results[name] = (wakeups, overruns)
+        print(
+            f"   {name:>9} {profile.block * 1000:>6.0f} {wakeups:>7.1f} {cpu:>8.2f}% {overruns:>8.1f} {underruns:>8.1f}"
+        )
+
+    sound.set_latency_profile("balanced")
+
+    ok = (
+        results["robust"][0] < results["balanced"][0] < results["ultra-low"][0]
+        and results["robust"][1] <= results["ultra-low"][1]
+    )
+    print("   ✅ 通过" if ok else "   ❌ 唤醒次数或溢出率没有随配置变化")
+    return ok
+
+
+def measure_logging(duration=2.0, count=4):
+    """日志写入卡住（模拟控制台或磁盘停顿）时，音频线程每帧记日志是否会延误取帧
+
+    每条线路的播放线程在每次 read() 之后都记一条日志，比实际热路径频繁得多。
+    """
+    import logging
+    import logs
+
+    class StalledHandler(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.stalled = threading.Event()
+
+        def emit(self, record):
+            self.stalled.wait()
+
+    class LoggingSource:
+        def __init__(self, stream):
+            self.stream = stream
+            self.logger = logging.getLogger("sound")
+            self.costs = np.zeros(int(duration / FakeVoiceClient.DELAY) * 2 + 100)
+            self.frames = 0
+
+        @property
+        def underruns(self):
+            return self.stream.underruns
+
+        def read(self):
+            data = self.stream.read()
+            start = time.perf_counter()
+            # 内容相同的日志被限速去重，带帧号的日志各不相同，会把队列填满
+            self.logger.warning("读取采集数据失败")
+            self.logger.warning("线路 %s 帧 %d", id(self), self.frames)
+            if self.frames < len(self.costs):
+                self.costs[self.frames] = time.perf_counter() - start
+            self.frames += 1
+            return data
+
+    print(f"📝 日志写入卡住时的取帧 ({count} 条线路, 每帧一条日志):")
+    sink = StalledHandler()
+    handler = logs.install([sink], size=200)
+    rate_limit = logs.rate_limit
+
+    sources = [LoggingSource(stream) for stream in open_routes(count, False, False)]
+    clients = [FakeVoiceClient(source, duration) for source in sources]
+    for client in clients:
+        client.start()
+    time.sleep(duration)
+    for client in clients:
+        client.stop()
+
+    sink.stalled.set()
+    logs.stop()
+
+    # 跳过刚打开设备时等待第一块数据的几帧
+    intervals = np.concatenate([client.intervals[5 : client.frames] for client in clients]) * 1000
+    costs = np.concatenate([source.costs[: source.frames] for source in sources]) * 1e6
+    frames = sum(client.frames for client in clients)
+    late = int(np.count_nonzero(intervals > FakeVoiceClient.DELAY * 1000 * 1.5))
+    suppressed = rate_limit.suppressed
+    for source in sources:
+        source.stream.close()
+
+    print(f"   帧数: {frames}, 迟到: {late}, 间隔最大: {intervals.max():.2f} ms")
+    print(
+        f"   记日志 p50: {np.percentile(costs, 50):.1f} µs, p99: {np.percentile(costs, 99):.1f} µs, "
+        f"max: {costs.max():.1f} µs"
+    )
+    print(f"   去重省略: {suppressed}, 队列满丢弃: {handler.dropped}")
+
+    # 同步写入时第一条日志就会让播放线程永远卡住；这里要求记日志从不超过一帧的时间，
+    # 偶发的毫秒级耗时来自与其它播放/采集线程争用GIL
+    ok = (
+        frames >= count * duration / FakeVoiceClient.DELAY * 0.9
+        and np.percentile(costs, 50) < 500
+        and costs.max() < FakeVoiceClient.DELAY * 1e6
+    )
+    print("   ✅ 通过" if ok else "   ❌ 日志写入卡住拖慢了播放线程")
+    return ok
+
+
+def report(results):
+    print(
+        f"   {'线路':>4} {'帧数':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7} "
+        f"{'抖动':>7} {'迟到':>5} {'CPU/线路':>9} {'欠载':>5} {'溢出':>5} {'常驻KB':>7} {'峰值KB':>7}"
+    )
+    for r in results:
+        print(
+            f"   {r['routes']:>4} {r['frames']:>7} {r['p50']:>7.3f} {r['p95']:>7.3f} {r['p99']:>7.3f} {r['max']:>7.3f} "
+            f"{r['jitter']:>7.3f} {r['late']:>5} {r['cpu']:>8.2f}% {r['underruns']:>5} {r['overruns']:>5} "
+            f"{r['retained']:>7.1f} {r['peak']:>7.1f}"
+        )
+    print("   (延迟与抖动单位为毫秒)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Discord Audio Pipe benchmark")
+    parser.add_argument("--routes", type=int, nargs="+", default=[1, 8, 32], help="Concurrent route counts to run")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to run each route count")
+    parser.add_argument("--shared", action="store_true", help="Route every connection from the same device")
+    parser.add_argument("--pcm", action="store_true", help="Benchmark PCMStream even if Opus is available")
+    parser.add_argument("--samplerate", type=int, default=48000, help="Native sample rate of the synthetic devices")
+    parser.add_argument("--channels", type=int, default=2, help="Native channel count of the synthetic devices")
+    args = parser.parse_args()
+
+    print("🔧 Discord音频管道热路径基准测试\n")
+
+    # 信号幅度低于"检测到声音"的日志阈值，每秒一次的日志输出不属于逐帧路径
+    install_synthetic_device(
+        amplitude=50, devices=max(args.routes + [8]), samplerate=args.samplerate, channels=args.channels
+    )
+    ok = check_allocations()
+    print()
+    ok = measure_metrics_overhead() and ok
+    print()
+    ok = measure_resampler() and ok
+    print()
+    ok = measure_dsp_chain() and ok
+    print()
+    ok = measure_concealment() and ok
+    print()
+    ok = measure_device_lookup() and ok
+    print()
+    ok = measure_recorder() and ok
+    print()
+    ok = measure_logging() and ok
+    print()
+    ok = measure_event_loop() and ok
+    print()
+    ok = measure_startup() and ok
+    print()
+    ok = measure_discovery() and ok
+    print()
+    ok = measure_latency_profiles() and ok
+    print()
+    ok = measure_stall_recovery() and ok
+    print()
+    ok = measure_device_switch() and ok
+    print()
+    ok = check_counters() and ok
+    print()
+    ok = measure_restage() and ok
+    print()
+    ok = measure_mute() and ok
+    print()
+    ok = measure_gate_park() and ok
+    print()
+    ok = measure_hotplug() and ok
+    print()
+
+    opus = not args.pcm and opus_available()
+    print(f"📊 线路基准 ({'OpusStream' if opus else 'PCMStream'}, {'共享设备' if args.shared else '独立设备'}):")
+
+    results = []
+    for count in args.routes:
+        result = run_routes(count, args.duration, opus, args.shared)
+        result["retained"], result["peak"] = measure_route_allocations(count, 2.0, opus, args.shared)
+        results.append(result)
+
+    report(results)
+
+    sys.exit(0 if ok else 1)
@@ -9,7 +9,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[(os.path.join(DATAPATH, 'assets'), './assets')],
-    hiddenimports=['PyQt5', 'discord', 'sounddevice'],
+    hiddenimports=['PyQt5', 'qasync', 'discord', 'sounddevice'],
     hookspath=['./build'],
     runtime_hooks=None,
     excludes=['numpy', 'tkinter', 'tcl'],
@@ -1,7 +1,14 @@
 import sys
 import sound
+import metrics
+import recorder
+import discovery
 import logging
 import asyncio
+import datetime
+import random
+import json
+import time
 import os
 
 # Windows编码兼容性修复
@@ -17,107 +24,216 @@ if sys.platform.startswith('win'):
     os.environ['PYTHONIOENCODING'] = 'utf-8'
 
 
-audio_stream = None
+# 每条线路（按频道ID）的音频流和连接状态
+audio_streams = {}
+route_status = {}
 
-def get_audio_stream(device_id):
-    global audio_stream
-    if not audio_stream:
-        audio_stream = sound.PCMStream()
-        audio_stream.change_device(device_id)
-    return audio_stream
+# 每条线路的唤醒事件，语音状态变化时由 try_reconnect 触发
+reconnect_events = {}
+
+# 线路表中每条线路可以覆盖的音频流参数
+ROUTE_OPTIONS = ("bitrate", "complexity", "fec", "expected_packet_loss", "silence", "isolated", "record", "stages")
+
+# 线路表文件的检查间隔（秒），运行中修改线路的 stages 会热替换处理链
+ROUTES_POLL = 2.0
+
+# 重连参数（秒）
+CONNECT_TIMEOUT = 30
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+MONITOR_INTERVAL = 0.5
+STATUS_INTERVAL = 60
+# discord 的语音客户端自己会尝试恢复连接，在这段时间内不介入
+RESUME_GRACE = 3.0
+
+def get_audio_stream(device_id, stream_options=None, channel_id=None):
+    """每条线路一个音频流；相同设备的线路通过 sound.hub 共享采集，参数也相同时共享编码"""
+    stream = audio_streams.get(channel_id)
+    if stream is None:
+        options = dict(stream_options or {})
+        record = options.pop("record", None)
+
+        stream = audio_streams[channel_id] = sound.OpusStream(**options)
+        stream.change_device(device_id)
+
+        # 录音分接直接复用发出的Opus包，不再单独打开设备
+        if record:
+            stream.tap = recorder.Recorder(route=channel_id, opus=stream.is_opus(), **record)
+    return stream
+
+def close_audio_stream(channel_id):
+    """线路结束时关闭录音分接（写完剩余的帧和结束页）并释放采集"""
+    stream = audio_streams.pop(channel_id, None)
+    if stream is None:
+        return
+
+    tap = stream.tap
+    stream.tap = None
+    if tap is not None:
+        tap.close()
+    stream.close()
+
+
+def close_audio_streams():
+    """退出前关闭所有线路的音频流，录音文件不会被截断"""
+    for channel_id in list(audio_streams):
+        try:
+            close_audio_stream(channel_id)
+        except Exception:
+            logging.exception(f"Error closing route {channel_id}")
+
+
+async def ensure_voice(channel):
+    """返回连接到 channel 的语音客户端，必要时新建连接或移动频道"""
+    voice = channel.guild.voice_client
+
+    if voice is not None and voice.is_connected():
+        if voice.channel is None or voice.channel.id != channel.id:
+            await voice.move_to(channel)
+        return voice
+
+    if voice is not None:
+        # 残留的半断开连接会阻止新的连接
+        try:
+            await voice.disconnect(force=True)
+        except Exception:
+            pass
+
+    return await channel.connect(reconnect=True, self_deaf=False, self_mute=False, timeout=CONNECT_TIMEOUT)
+
+
+def backoff_delay(attempt):
+    """带抖动的指数退避：在 [d/2, d] 之间随机取值，d 按尝试次数翻倍直到上限"""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+async def wait_for_drop(voice, wakeup, stream, started):
+    """监控语音连接，连接断开且 discord 自身的重连在宽限期内没有恢复时返回
+
+    被 try_reconnect 唤醒说明机器人已经离开频道，此时不再等待宽限期。
+    """
+    last_status_time = time.monotonic()
+    lost_since = None
+
+    while True:
+        try:
+            await asyncio.wait_for(wakeup.wait(), MONITOR_INTERVAL)
+            woken = True
+        except asyncio.TimeoutError:
+            woken = False
+        wakeup.clear()
+
+        now = time.monotonic()
+        if now - last_status_time >= STATUS_INTERVAL:
+            uptime = datetime.datetime.now() - started
+            members = len(voice.channel.members) if voice.channel and voice.channel.members else 0
+            name = voice.channel.name if voice.channel else None
+            print(f"[状态检查] {name} 连接时间: {uptime}, 频道人数: {members}, 延迟: {round(voice.client.latency * 1000)}ms")
+            last_status_time = now
+
+        if voice.is_connected():
+            lost_since = None
+            if not voice.is_playing():
+                try:
+                    # 播放线程意外结束，立即用同一个音频流重新开始
+                    voice.play(stream, **stream.play_options())
+                    print("🔄 音频流已重新启动")
+                except Exception as e:
+                    print(f"⚠️ 音频流重启失败: {e}")
+            continue
+
+        if lost_since is None:
+            lost_since = now
+        if woken or now - lost_since >= RESUME_GRACE:
+            return lost_since
+
+
+async def run_route(bot, device_id, channel_id, stream_options=None):
+    """一条线路的重连状态机：连接 -> 播放 -> 监控 -> 退避 -> 连接
+
+    采集和编码在整个生命周期中保持运行，语音连接恢复后立即有音频可发。
+    意外错误直接抛给调用方。
+    """
+    voice = None
+    status = route_status[channel_id] = {
+        "device": device_id,
+        "voice": None,
+        "channel": None,
+        "started": None,
+    }
 
-async def connect(bot, device_id, channel_id):
-    import datetime
-    
+    try:
+        await bot.wait_until_ready()
+
+        stream = get_audio_stream(device_id, stream_options, channel_id)
+        route_metrics = metrics.registry.track(channel_id, stream)
+        wakeup = reconnect_events.setdefault(channel_id, asyncio.Event())
+
+        attempt = 0
+        dropped_at = None
+
+        while True:
+            # 网关重连后频道对象会被替换，每轮都重新获取
+            channel = status["channel"] = bot.get_channel(channel_id)
+            if not channel:
+                print(f"错误: 找不到频道ID {channel_id}")
+                close_audio_stream(channel_id)
+                return
+
+            try:
+                print(f"正在连接到语音频道: {channel.name} (服务器: {channel.guild.name})")
+                voice = status["voice"] = await ensure_voice(channel)
+
+                if not voice.is_playing():
+                    voice.play(stream, **stream.play_options())
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as e:
+                attempt += 1
+                delay = backoff_delay(attempt)
+                print(f"[{channel.name}] 连接失败: {e}，{delay:.1f}秒后重试 (第 {attempt} 次)")
+                await asyncio.sleep(delay)
+                continue
+
+            attempt = 0
+            started = status["started"] = datetime.datetime.now()
+
+            if dropped_at is None:
+                print(f"✅ 成功连接到语音频道: {channel.name}, 监听设备: {device_id}")
+            else:
+                outage = time.monotonic() - dropped_at
+                route_metrics.time_to_audio_seconds.observe(outage)
+                print(f"✅ 已恢复语音连接: {channel.name}, 中断 {outage:.2f}s")
+
+            dropped_at = await wait_for_drop(voice, wakeup, stream, started)
+            route_metrics.reconnects += 1
+            print(f"⚠️ [{channel.name}] 语音连接已断开，正在重新连接...")
+
+    except asyncio.CancelledError:
+        if voice and voice.is_connected():
+            voice.stop()
+            await voice.disconnect()
+            print("✅ 已断开语音连接")
+        close_audio_stream(channel_id)
+        raise
+
+
+async def connect(bot, device_id, channel_id, stream_options=None):
+    """单条线路的命令行模式，意外错误时退出进程"""
     try:
         print(f"设备ID: {device_id}, 频道ID: {channel_id}")
         print("正在连接到Discord...")
-        
+
         await bot.wait_until_ready()
         print(f"已登录为: {bot.user.name}")
 
-        current_channel = bot.get_channel(channel_id)
-        if not current_channel:
-            print(f"错误: 找不到频道ID {channel_id}")
-            return
-            
-        print(f"找到频道: {current_channel.name} (服务器: {current_channel.guild.name})")
-
-        stream = get_audio_stream(device_id)
-        max_retries = 30
-        retry_count = 0
-        
-        while retry_count < max_retries:
-            try:
-                print(f"正在连接到语音频道... (尝试 {retry_count + 1}/{max_retries})")
-                voice_connection = await current_channel.connect(reconnect=True, self_deaf=False, self_mute=False)
-                break
-            except Exception as e:
-                retry_count += 1
-                print(f"连接失败: {e}")
-                if retry_count < max_retries:
-                    print(f"等待5秒后重试...")
-                    await asyncio.sleep(5)
-                else:
-                    print("达到最大重试次数，连接失败")
-                    raise
-        
-        if not voice_connection:
-            print("无法建立语音连接")
-            return
-            
-        
-        connection_start_time = datetime.datetime.now()
-        
-        voice_connection.play(stream)
-        print(f"✅ 成功连接到语音频道: {current_channel.name}, 监听设备: {device_id}")
-
-        # 连接状态监控循环
-        connection_check_interval = 5  # 每5秒检查一次
-        last_status_time = datetime.datetime.now()
-        status_interval = 60  # 每60秒显示一次状态
-        
-        try:
-            while voice_connection.is_connected():
-               
-                await asyncio.sleep(connection_check_interval)
-                # 定期显示连接状态
-                current_time = datetime.datetime.now()
-                if (current_time - last_status_time).seconds >= status_interval:
-                    uptime = current_time - connection_start_time
-                    member_count = len(current_channel.members) if current_channel.members else 0
-                    print(f"[状态检查] 连接时间: {uptime}, 频道人数: {member_count}, 延迟: {round(bot.latency * 1000)}ms")
-                    last_status_time = current_time
-                
-                # 检查语音连接健康状态
-                if not voice_connection.is_playing() and audio_stream:
-                    try:
-                        # 重新启动音频流
-                        voice_connection.play(audio_stream)
-                        print("🔄 音频流已重新启动")
-                    except Exception as e:
-                        print(f"⚠️ 音频流重启失败: {e}")
-                        
-        except KeyboardInterrupt:
-            print("\n🛑 用户中断，正在停止...")
-        except Exception as e:
-            print(f"⚠️ 连接监控异常: {e}")
-        finally:
-            # 清理工作
-            try:
-                if voice_connection and voice_connection.is_connected():
-                    voice_connection.stop()
-                    await voice_connection.disconnect()
-                    print("✅ 已断开语音连接")
-
-                await asyncio.sleep(2)
-                
-                print("重新连接音频...")
-                await connect(bot, device_id, channel_id)
-                
-                
-            except Exception as e:
-                print(f"⚠️ 清理资源时出错: {e}")
+        await run_route(bot, device_id, channel_id, stream_options)
+
+    except asyncio.CancelledError:
+        raise
 
     except Exception as e:
         logging.exception("Error on cli connect")
@@ -125,77 +241,180 @@ async def connect(bot, device_id, channel_id):
         sys.exit(1)
 
 
-async def query(bot, token):
-    await bot.login(token)
+def load_routes(path, stream_options=None):
+    """读取线路表，返回 (设备, 频道ID, 音频流参数) 列表
 
-    async for guild in bot.fetch_guilds(limit=150):
-        print(guild.id, guild.name)
-        channels = await guild.fetch_channels()
+    线路表为JSON：
+        {
+            "defaults": {"bitrate": 96},
+            "routes": [
+                {"device": "ALSA/USB Audio/2", "channel": 123456789012345678},
+                {"device": 3, "channel": 223456789012345678, "silence": {"threshold": 200}}
+            ]
+        }
+    每条线路的参数依次由命令行参数、defaults 和线路自身的字段覆盖。
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        table = json.load(file)
 
-        for channel in channels:
-            print("\t", channel.id, channel.name)
+    defaults = dict(stream_options or {})
+    for key, value in table.get("defaults", {}).items():
+        if key not in ROUTE_OPTIONS:
+            raise ValueError(f"线路表 defaults 中有未知的参数: {key}")
+        defaults[key] = value
 
-    await bot.logout()
+    routes = []
+    channels = set()
+    for number, entry in enumerate(table.get("routes", []), 1):
+        if "device" not in entry or "channel" not in entry:
+            raise ValueError(f"第 {number} 条线路缺少 device 或 channel")
 
-async def try_reconnect(bot,    channel_id):
-    return 
-    """尝试重新连接到语音频道"""
-    import datetime
-    
-    try:
-        global voice_connection, current_channel, connection_start_time
-        
-        channel = bot.get_channel(channel_id)
-        if not channel:
-            print(f"错误: 找不到频道ID {channel_id}")
+        options = dict(defaults)
+        for key, value in entry.items():
+            if key in ("device", "channel"):
+                continue
+            if key not in ROUTE_OPTIONS:
+                raise ValueError(f"第 {number} 条线路中有未知的参数: {key}")
+            options[key] = value
+
+        channel_id = int(entry["channel"])
+        if channel_id in channels:
+            raise ValueError(f"频道 {channel_id} 在线路表中出现了多次")
+        channels.add(channel_id)
+
+        routes.append((entry["device"], channel_id, options))
+
+    if not routes:
+        raise ValueError("线路表中没有线路")
+
+    return routes
+
+
+async def supervise_route(bot, device_id, channel_id, stream_options):
+    """线路出现意外错误时按退避时间重启，不影响其它线路"""
+    attempt = 0
+    while True:
+        try:
+            await run_route(bot, device_id, channel_id, stream_options)
             return
-        
-        
-        # 清理旧连接
-        if voice_connection and voice_connection.is_connected():
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception as e:
+            attempt += 1
+            delay = backoff_delay(attempt)
+            logging.exception(f"Error on route {channel_id}")
+            print(f"❌ 线路 {channel_id} 发生错误: {e}，{delay:.1f}秒后重启")
+            await asyncio.sleep(delay)
+
+
+async def watch_routes(path, stream_options, routes):
+    """线路表文件变化时热替换运行中线路的处理链（stages），其他参数的修改需要重启才生效"""
+    stages = {channel_id: options.get("stages") for _, channel_id, options in routes}
+    modified = os.path.getmtime(path)
+
+    while True:
+        await asyncio.sleep(ROUTES_POLL)
+        try:
+            current = os.path.getmtime(path)
+            if current == modified:
+                continue
+            modified = current
+            updated = load_routes(path, stream_options)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 重新读取线路表失败: {e}")
+            continue
+
+        for _, channel_id, options in updated:
+            stream = audio_streams.get(channel_id)
+            if stream is None or channel_id not in stages or options.get("stages") == stages[channel_id]:
+                continue
+
             try:
-                voice_connection.stop()
-                await voice_connection.disconnect()
-            except:
-                pass
-        
-        # 重新连接
-        voice_connection = await channel.connect(reconnect=True, self_deaf=False, self_mute=False)
-        connection_start_time = datetime.datetime.now()
-        
-        # 如果有音频流，重新开始播放
-        if audio_stream:
-            voice_connection.play(audio_stream)
-            print(f"✅ 成功重新连接到 {channel.name}，音频流已恢复")
-        else:
-            print(f"✅ 成功重新连接到 {channel.name}")
-        
-        return True
-        
-    except Exception as e:
-        print(f"❌ 重连失败: {str(e)}")
-        return False
+                # 链路共享时要等新链路产出第一个包，不在事件循环中阻塞
+                await asyncio.get_running_loop().run_in_executor(None, stream.set_stages, options.get("stages"))
+            except Exception as e:
+                logging.exception(f"Error updating stages on route {channel_id}")
+                print(f"⚠️ 线路 {channel_id} 的处理链更新失败: {e}")
+                continue
 
+            stages[channel_id] = options.get("stages")
+            print(f"🎛️ 线路 {channel_id} 的处理链已更新")
 
-def get_connection_status():
-    """获取当前连接状态"""
-    import datetime
-    
-    global voice_connection, current_channel, connection_start_time, audio_stream
-    
-    if not voice_connection or not current_channel:
+
+async def run_routes(bot, routes, path=None, stream_options=None):
+    """在同一个机器人连接中运行线路表中的所有线路，每条线路是独立的任务
+
+    给出 path 时监视线路表文件，修改线路的 stages 会在不中断播放的情况下生效。
+    """
+    await bot.wait_until_ready()
+    print(f"已登录为: {bot.user.name}，共 {len(routes)} 条线路")
+
+    # 每个服务器只能有一个语音连接
+    guilds = {}
+    tasks = []
+    for device_id, channel_id, options in routes:
+        channel = bot.get_channel(channel_id)
+        if channel is not None:
+            other = guilds.setdefault(channel.guild.id, channel_id)
+            if other != channel_id:
+                print(f"❌ 频道 {channel_id} 与频道 {other} 在同一个服务器中，跳过该线路")
+                continue
+
+        print(f"线路: 设备 {device_id} -> 频道 {channel_id}")
+        tasks.append(asyncio.ensure_future(supervise_route(bot, device_id, channel_id, options)))
+
+    if path is not None:
+        tasks.append(asyncio.ensure_future(watch_routes(path, stream_options, routes)))
+
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def query(bot, token, ttl=discovery.CACHE_TTL):
+    guilds, cached = await discovery.discover(bot, token, ttl)
+    if cached:
+        print(f"📋 使用缓存的频道列表（{discovery.CACHE_FILE}，--cache-ttl 0 重新获取）")
+
+    for guild in guilds:
+        print(guild["id"], guild["name"])
+
+        for channel in guild["channels"]:
+            print("\t", channel["id"], channel["name"])
+
+async def try_reconnect(bot, channel_id):
+    """唤醒对应线路的重连状态机，让它立即检查连接而不是等到下一次轮询"""
+    event = reconnect_events.get(channel_id)
+    if event is not None:
+        event.set()
+
+
+def get_connection_status(channel_id=None):
+    """获取线路的连接状态，channel_id 为空时返回第一条线路"""
+    if channel_id is None and route_status:
+        channel_id = next(iter(route_status))
+
+    status = route_status.get(channel_id)
+    voice = status["voice"] if status else None
+    channel = status["channel"] if status else None
+
+    if not voice or not channel:
         return {
             'connected': False,
             'playing': False,
             'channel': None,
             'uptime': None,
-            'has_stream': audio_stream is not None
+            'has_stream': channel_id in audio_streams
         }
-    
+
     return {
-        'connected': voice_connection.is_connected(),
-        'playing': voice_connection.is_playing(),
-        'channel': current_channel.name,
-        'uptime': datetime.datetime.now() - connection_start_time if connection_start_time else None,
-        'has_stream': audio_stream is not None
-    }
\ No newline at end of file
+        'connected': voice.is_connected(),
+        'playing': voice.is_playing(),
+        'channel': channel.name,
+        'uptime': datetime.datetime.now() - status["started"] if status["started"] else None,
+        'has_stream': channel_id in audio_streams
+    }
@@ -0,0 +1,181 @@
+import sys
+import math
+import threading
+from collections import namedtuple
+from pprint import pformat
+
+import sounddevice as sd
+
+# 设备枚举只依赖 sounddevice，查询设备时不需要加载 discord 和 numpy
+
+DEFAULT = 0
+
+
+def capturing():
+    """是否有打开的采集流；sound 未加载时肯定没有，正在重新打开的采集旧流已关闭，不算在内"""
+    sound = sys.modules.get("sound")
+    return sound is not None and any(entry[0].stream_open for entry in list(sound.hub.captures.values()))
+
+
+class DeviceIdentity(namedtuple("DeviceIdentity", "hostapi name channels")):
+    """不随设备插拔顺序变化的设备标识：主机API名、设备名和输入声道数
+
+    字符串形式为 "hostapi/name/channels"，可以直接用作 -d 参数。
+    """
+
+    def __str__(self):
+        return f"{self.hostapi}/{self.name}/{self.channels}"
+
+    @classmethod
+    def parse(cls, text):
+        """解析 "hostapi/name/channels"、"hostapi/name" 或 "name"，缺省的部分为 None"""
+        hostapi, name, channels = None, text, None
+
+        head, sep, tail = text.rpartition("/")
+        if sep and tail.isdigit():
+            name, channels = head, int(tail)
+
+        head, sep, tail = name.partition("/")
+        if sep and head in device_registry.hostapi_names():
+            hostapi, name = head, tail
+
+        return cls(hostapi, name, channels)
+
+    def matches(self, other):
+        return (
+            (self.hostapi is None or self.hostapi == other.hostapi)
+            and self.name == other.name
+            and (self.channels is None or self.channels == other.channels)
+        )
+
+
+class DeviceRegistry:
+    """缓存的设备列表，索引和稳定标识之间的双向查找
+
+    PortAudio 只在重新初始化时才会发现新插入的设备，refresh(rescan=True)
+    会重新初始化 PortAudio，因此只在没有打开的采集流时进行。
+    采集看门狗在所有设备都重新打开失败时通过 sound.hub.rescan() 调用它。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices = None
+        self.hostapis = None
+        self.identities = []
+        self.indices = {}
+
+    def load(self):
+        devices = sd.query_devices()
+        hostapis = sd.query_hostapis()
+
+        identities = []
+        indices = {}
+        for index, device in enumerate(devices):
+            hostapi = hostapis[device.get("hostapi")]["name"] if device.get("hostapi") < len(hostapis) else None
+            identity = DeviceIdentity(hostapi, device.get("name"), device.get("max_input_channels"))
+            identities.append(identity)
+            indices.setdefault(identity, index)
+
+        self.devices = devices
+        self.hostapis = hostapis
+        self.identities = identities
+        self.indices = indices
+
+    def ensure(self):
+        if self.devices is None:
+            with self.lock:
+                if self.devices is None:
+                    self.load()
+
+    def invalidate(self):
+        """丢弃缓存，下次查询时重新枚举"""
+        with self.lock:
+            self.devices = None
+
+    def refresh(self, rescan=False):
+        """重新枚举设备；rescan=True 时重新初始化 PortAudio 以发现热插拔的设备"""
+        with self.lock:
+            if rescan and not capturing():
+                sd._terminate()
+                sd._initialize()
+            self.load()
+
+    def query(self):
+        self.ensure()
+        return self.devices
+
+    def query_hostapis(self):
+        self.ensure()
+        return self.hostapis
+
+    def hostapi_names(self):
+        self.ensure()
+        return {hostapi["name"] for hostapi in self.hostapis}
+
+    def identity(self, index):
+        self.ensure()
+        return self.identities[index]
+
+    def resolve(self, device):
+        """把索引、DeviceIdentity 或标识字符串解析为当前的设备索引"""
+        if device is None or isinstance(device, int):
+            return device
+
+        if isinstance(device, str):
+            if device.isdigit():
+                return int(device)
+            device = DeviceIdentity.parse(device)
+
+        self.ensure()
+        index = self.indices.get(device)
+        if index is not None:
+            return index
+
+        # 部分标识：优先默认主机API上的输入设备
+        candidates = [
+            (identity.hostapi != self.hostapis[DEFAULT]["name"], index)
+            for index, identity in enumerate(self.identities)
+            if identity.channels > 0 and device.matches(identity)
+        ]
+        if not candidates:
+            raise ValueError(f"找不到音频设备: {device}")
+
+        return min(candidates)[1]
+
+
+device_registry = DeviceRegistry()
+
+
+class DeviceNotFoundError(Exception):
+    def __init__(self):
+        self.devices = device_registry.query()
+        self.host_apis = device_registry.query_hostapis()
+        super().__init__("No Devices Found")
+
+    def __str__(self):
+        return (
+            f"Devices \n"
+            f"{self.devices} \n "
+            f"Host APIs \n"
+            f"{pformat(self.host_apis)}"
+        )
+
+
+def query_devices():
+    """所有主机API上的输入设备，默认主机API之外的设备名后附主机API名"""
+    options = {}
+    for index, device in enumerate(device_registry.query()):
+        if device.get("max_input_channels") > 0:
+            name = device.get("name")
+            if device.get("hostapi") != DEFAULT:
+                name = f"{name} ({device_registry.identity(index).hostapi})"
+            options[name] = index
+
+    if not options:
+        raise DeviceNotFoundError()
+
+    return options
+
+
+def reported_latency(device):
+    return float(device.get("default_low_input_latency") or math.inf)
@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 服务器和频道列表的磁盘缓存，与 token.txt 放在同一目录
+CACHE_FILE = "channels_cache.json"
+
+# 缓存有效期（秒），0 表示每次都重新获取
+CACHE_TTL = 3600
+
+# 同时进行的频道列表请求数；discord.py 按路由桶处理限流，收到429时自动等待重试
+CONCURRENCY = 8
+
+
+def cache_key(token):
+    """按token区分缓存，文件中不保存token本身"""
+    return hashlib.sha256(token.strip().encode("utf-8")).hexdigest()[:16]
+
+
+def load_cache(token, ttl=CACHE_TTL, path=CACHE_FILE):
+    """读取未过期的缓存，没有或已过期时返回 None"""
+    if not ttl:
+        return None
+
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            entry = json.load(file).get(cache_key(token))
+    except (OSError, ValueError):
+        return None
+
+    if not entry or time.time() - entry.get("saved", 0) > ttl:
+        return None
+    return entry["guilds"]
+
+
+def save_cache(token, guilds, path=CACHE_FILE):
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        cache = {}
+
+    cache[cache_key(token)] = {"saved": time.time(), "guilds": guilds}
+
+    # 先写临时文件再替换，中途退出不会留下损坏的缓存
+    temporary = f"{path}.tmp"
+    try:
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(cache, file, ensure_ascii=False)
+        os.replace(temporary, path)
+    except OSError:
+        logger.exception("写入频道缓存失败")
+
+
+async def fetch_guilds(bot, concurrency=CONCURRENCY):
+    """分页获取所有服务器，并发获取各服务器的频道列表
+
+    返回可以直接写入缓存的列表：[{"id", "name", "channels": [{"id", "name", "type"}]}]。
+    单个服务器获取失败（例如没有权限）时记录警告，频道列表为空。
+    """
+    guilds = [guild async for guild in bot.fetch_guilds(limit=None)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_channels(guild):
+        async with semaphore:
+            try:
+                channels = await guild.fetch_channels()
+            except Exception as e:
+                logger.warning(f"获取服务器 {guild.name} ({guild.id}) 的频道失败: {e}")
+                channels = []
+
+        return {
+            "id": guild.id,
+            "name": guild.name,
+            "channels": [{"id": channel.id, "name": channel.name, "type": str(channel.type)} for channel in channels],
+        }
+
+    return await asyncio.gather(*(fetch_channels(guild) for guild in guilds))
+
+
+async def discover(bot, token, ttl=CACHE_TTL, path=CACHE_FILE, concurrency=CONCURRENCY):
+    """返回 (服务器列表, 是否来自缓存)；缓存未命中时登录获取并写入缓存"""
+    guilds = load_cache(token, ttl, path)
+    if guilds is not None:
+        return guilds, True
+
+    await bot.login(token)
+    try:
+        guilds = await fetch_guilds(bot, concurrency)
+    finally:
+        await bot.close()
+
+    save_cache(token, guilds, path)
+    return guilds, False
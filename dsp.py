@@ -0,0 +1,426 @@
+import math
+
+import numpy as np
+
+
+def kaiser_lowpass(taps, cutoff, beta=8.0):
+    """Kaiser窗的低通FIR，cutoff 为相对采样率的截止频率（0-0.5）"""
+    n = np.arange(taps) - (taps - 1) / 2
+    return 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(taps, beta)
+
+
+class ChannelMixer:
+    """声道上/下混矩阵，输出固定为 channels_out 个声道"""
+
+    def __init__(self, channels_in, channels_out=2):
+        self.channels_in = channels_in
+        self.channels_out = channels_out
+
+        matrix = np.zeros((channels_in, channels_out), dtype=np.float32)
+        if channels_in == 1:
+            matrix[0, :] = 1.0
+        elif channels_in <= channels_out:
+            matrix[np.arange(channels_in), np.arange(channels_in)] = 1.0
+        else:
+            # 多余的声道交替分配到各输出声道，再按参与的声道数归一化
+            for index in range(channels_in):
+                matrix[index, index % channels_out] = 1.0
+            matrix /= matrix.sum(axis=0, keepdims=True)
+
+        self.matrix = matrix
+
+    def process(self, block):
+        return block @ self.matrix
+
+
+class Resampler:
+    """NumPy向量化的多相重采样器，跨20ms块保留滤波器状态
+
+    输出第 n 个采样对应输入位置 n * down / up，分解为整数下标和多相滤波器的相位，
+    每个块的下标和相位表按 (起始相位, 块长度) 缓存，稳态下不需要重新计算。
+    """
+
+    def __init__(self, rate_in, rate_out, channels, taps_per_phase=16):
+        divisor = math.gcd(int(rate_in), int(rate_out))
+        self.up = int(rate_out) // divisor
+        self.down = int(rate_in) // divisor
+        self.taps = taps_per_phase
+        self.channels = channels
+
+        # 在 up 倍采样率上设计原型滤波器，截止频率取两个采样率中较低者的奈奎斯特频率
+        prototype = kaiser_lowpass(self.taps * self.up, 0.5 / max(self.up, self.down)) * self.up
+        phases = prototype.reshape(self.taps, self.up).T
+
+        # 反转每个相位的系数，使其与按时间顺序排列的输入窗口直接相乘
+        self.phases = np.ascontiguousarray(phases[:, ::-1], dtype=np.float32)
+        self.offsets = np.arange(self.taps)
+
+        # 内部按声道优先存放，每个声道的窗口收集和点积都在连续内存上进行
+        self.history = np.zeros((channels, self.taps - 1), dtype=np.float32)
+        self.position = 0
+        self.cache = {}
+
+    def plan(self, position, total):
+        key = (position, total)
+        plan = self.cache.get(key)
+        if plan is not None:
+            return plan
+
+        # 窗口末端 (taps - 1 + pos // up) 必须落在已有的输入之内
+        span = (total - self.taps + 1) * self.up - position
+        count = max(0, -(-span // self.down))
+        positions = position + np.arange(count) * self.down
+        starts = positions // self.up
+        windows = starts[:, None] + self.offsets[None, :]
+        coefficients = self.phases[positions % self.up]
+        remainder = position + count * self.down - (total - self.taps + 1) * self.up
+
+        if len(self.cache) > 64:
+            self.cache.clear()
+
+        plan = self.cache[key] = (windows, coefficients, remainder)
+        return plan
+
+    def process(self, block):
+        buffer = np.concatenate((self.history, block.T.astype(np.float32, copy=False)), axis=1)
+        total = buffer.shape[1]
+        windows, coefficients, self.position = self.plan(self.position, total)
+
+        output = np.empty((len(windows), self.channels), dtype=np.float32)
+        for channel in range(self.channels):
+            output[:, channel] = np.einsum("nk,nk->n", coefficients, buffer[channel][windows])
+
+        self.history = buffer[:, total - self.taps + 1 :]
+        return output
+
+
+class FormatConverter:
+    """把设备的原生格式转换为 Discord 需要的 48kHz 立体声 int16"""
+
+    def __init__(self, rate_in, channels_in, rate_out=48000, channels_out=2):
+        self.rate_in = rate_in
+        self.channels_in = channels_in
+
+        # 下混放在重采样之前、上混放在之后，让重采样处理的声道数最少
+        resample_channels = min(channels_in, channels_out)
+        self.mixer = ChannelMixer(channels_in, channels_out) if channels_in != channels_out else None
+        self.premix = self.mixer is not None and channels_in > channels_out
+        self.resampler = (
+            Resampler(rate_in, rate_out, resample_channels) if int(rate_in) != int(rate_out) else None
+        )
+
+    def process(self, block):
+        data = block.astype(np.float32)
+
+        if self.premix:
+            data = self.mixer.process(data)
+        if self.resampler is not None:
+            data = self.resampler.process(data)
+        if self.mixer is not None and not self.premix:
+            data = self.mixer.process(data)
+
+        return np.clip(np.rint(data), -32768, 32767).astype(np.int16)
+
+
+def db_to_gain(db):
+    return 10 ** (db / 20)
+
+
+# 以 int16 满幅为 0 dBFS
+FULL_SCALE = 32768.0
+
+
+class Gain:
+    """固定增益（dB）"""
+
+    def __init__(self, frames, channels, rate, db=0.0):
+        self.factor = np.float32(db_to_gain(db))
+
+    def process(self, block):
+        block *= self.factor
+
+
+class NoiseGate:
+    """按块RMS开关的噪声门，块内增益线性过渡，避免咔嗒声
+
+    threshold: 开门阈值（dBFS）
+    attack / release: 开门 / 关门的时间常数（秒）
+    floor: 关门时的衰减（dB）
+    """
+
+    def __init__(self, frames, channels, rate, threshold=-50.0, attack=0.005, release=0.15, floor=-60.0):
+        self.threshold = db_to_gain(threshold) * FULL_SCALE
+        block_time = frames / rate
+        self.attack = math.exp(-block_time / attack) if attack > 0 else 0.0
+        self.release = math.exp(-block_time / release) if release > 0 else 0.0
+        self.floor = db_to_gain(floor)
+        self.gain = 1.0
+
+        self.ramp = np.linspace(1.0 / frames, 1.0, frames, dtype=np.float32)
+        self.envelope = np.zeros(frames, dtype=np.float32)
+
+    def process(self, block):
+        rms = math.sqrt(float(np.vdot(block, block)) / block.size)
+        target, coefficient = (1.0, self.attack) if rms >= self.threshold else (self.floor, self.release)
+
+        start = self.gain
+        self.gain = target + (start - target) * coefficient
+        if start == self.gain == 1.0:
+            return
+
+        np.multiply(self.ramp, self.gain - start, out=self.envelope)
+        self.envelope += start
+        block *= self.envelope[:, None]
+
+
+class HighPass:
+    """级联的一阶高通滤波器，每级 6 dB/倍频程
+
+    一阶递推 y[n] = a*(y[n-1] + x[n] - x[n-1]) 展开为
+    y[n] = a^n * (a*y[-1] + sum(a^-k * u[k]))，用累加和在整块上向量化计算，
+    跨块只保留上一块最后的输入和输出。
+    """
+
+    # 截止频率过高时 a^-frames 会溢出
+    MAX_CUTOFF = 2000.0
+
+    def __init__(self, frames, channels, rate, cutoff=80.0, order=2):
+        if not 0 < cutoff <= self.MAX_CUTOFF:
+            raise ValueError(f"高通截止频率需要在 0-{self.MAX_CUTOFF:.0f} Hz 之间")
+
+        rc = 1 / (2 * math.pi * cutoff)
+        self.alpha = rc / (rc + 1 / rate)
+        n = np.arange(frames, dtype=np.float64)
+        self.powers = self.alpha ** n
+        self.inverse = self.alpha ** (1 - n)
+
+        # 内部按声道优先存放，逐声道的运算都在连续内存上进行
+        self.last_input = np.zeros((order, channels))
+        self.last_output = np.zeros((order, channels))
+        self.work = np.zeros((channels, frames))
+        self.data = np.zeros((channels, frames))
+
+    def process(self, block):
+        data = self.data
+        work = self.work
+        np.copyto(data, block.T)
+
+        for section in range(len(self.last_input)):
+            # u[k] = a * (x[k] - x[k-1])，a 已合并进 inverse
+            work[:, 0] = data[:, 0] - self.last_input[section]
+            np.subtract(data[:, 1:], data[:, :-1], out=work[:, 1:])
+            self.last_input[section] = data[:, -1]
+
+            work *= self.inverse
+            np.cumsum(work, axis=1, out=work)
+            work += (self.alpha * self.last_output[section])[:, None]
+            np.multiply(work, self.powers, out=data)
+            self.last_output[section] = data[:, -1]
+
+        np.copyto(block, data.T, casting="unsafe")
+
+
+class Limiter:
+    """前视限幅器，输出延迟 lookahead 秒
+
+    每个采样所需的增益先取未来 lookahead 窗口内的最小值，再在同样长度上做滑动平均，
+    增益在峰值到达之前平滑下降且在峰值处不超过所需值；恢复按 release 线性进行。
+    """
+
+    def __init__(self, frames, channels, rate, ceiling=-1.0, lookahead=0.0015, release=0.05):
+        self.ceiling = db_to_gain(ceiling) * FULL_SCALE
+        self.length = length = max(1, round(lookahead * rate))
+        self.recovery = 1.0 / (release * rate)
+        self.gain = 1.0
+
+        self.input = np.zeros((frames + length, channels), dtype=np.float32)
+        self.magnitude = np.zeros((frames, channels), dtype=np.float32)
+        self.peak = np.zeros(frames, dtype=np.float32)
+        self.required = np.ones(frames + length)
+        self.minimum = np.ones(frames + length)
+
+        # 滑动最小值（van Herk/Gil-Werman）：按窗口长度分段，段内前缀最小和后缀最小
+        window = length + 1
+        padded = -(-(frames + length) // window) * window
+        self.padded = np.ones(padded)
+        self.prefix = np.ones(padded)
+        self.suffix = np.ones(padded)
+        self.cumulative = np.zeros(frames + length + 1)
+        self.smoothed = np.zeros(frames)
+        self.steps = np.arange(frames, dtype=np.float64) * self.recovery
+
+    def process(self, block):
+        frames = len(block)
+        length = self.length
+        required = self.required
+        minimum = self.minimum
+        cumulative = self.cumulative
+        smoothed = self.smoothed
+
+        # 新块接在上一块末尾的 length 个采样之后，输出的是延迟 length 个采样的信号
+        self.input[length:] = block
+        # 逐声道取最大值，比在只有几个元素的轴上做归约快得多
+        magnitude = np.abs(block, out=self.magnitude)
+        np.maximum(magnitude[:, 0], self.ceiling, out=self.peak)
+        for channel in range(1, magnitude.shape[1]):
+            np.maximum(self.peak, magnitude[:, channel], out=self.peak)
+        np.divide(self.ceiling, self.peak, out=required[length:])
+
+        # minimum[length + j] 为第 j 个输出采样起未来窗口内的最小所需增益，
+        # 前 length 个是上一块留下的
+        window = length + 1
+        self.padded[: frames + length] = required
+        segments = self.padded.reshape(-1, window)
+        np.minimum.accumulate(segments, axis=1, out=self.prefix.reshape(-1, window))
+        np.minimum.accumulate(segments[:, ::-1], axis=1, out=self.suffix.reshape(-1, window)[:, ::-1])
+        np.minimum(self.suffix[:frames], self.prefix[length : length + frames], out=minimum[length:])
+
+        # 对覆盖当前采样的 length + 1 个窗口取平均，增益平滑下降且在峰值处不超过所需值
+        np.cumsum(minimum, out=cumulative[1:])
+        np.subtract(cumulative[length + 1 :], cumulative[:frames], out=smoothed)
+        smoothed /= length + 1
+
+        # 线性恢复：g[i] = min(s[i], g[i-1] + r)
+        smoothed -= self.steps
+        np.minimum.accumulate(smoothed, out=smoothed)
+        np.minimum(smoothed, self.gain + self.recovery, out=smoothed)
+        smoothed += self.steps
+        np.minimum(smoothed, 1.0, out=smoothed)
+        self.gain = float(smoothed[-1])
+
+        np.multiply(self.input[:frames], smoothed[:, None], out=block, casting="unsafe")
+
+        self.input[:length] = self.input[frames:]
+        required[:length] = required[frames:]
+        minimum[:length] = minimum[frames:]
+
+
+STAGES = {
+    "gain": Gain,
+    "gate": NoiseGate,
+    "highpass": HighPass,
+    "limiter": Limiter,
+}
+
+
+def build_stages(config, frames, channels, rate):
+    """由配置列表创建处理级，例如 [{"type": "highpass", "cutoff": 80}, {"type": "limiter"}]"""
+    stages = []
+    for entry in config or ():
+        options = dict(entry)
+        kind = options.pop("type", None)
+        if kind not in STAGES:
+            raise ValueError(f"未知的处理级: {kind}")
+        stages.append(STAGES[kind](frames, channels, rate, **options))
+    return tuple(stages)
+
+
+class DSPChain:
+    """采集和发送之间的处理链，每个20ms块在预分配的浮点缓冲区上就地处理
+
+    configure() 整体替换处理级，读取线程下一帧起使用新的处理链，不需要重新打开设备。
+    """
+
+    def __init__(self, config=None, frames=960, channels=2, rate=48000):
+        self.frames = frames
+        self.channels = channels
+        self.rate = rate
+        self.buffer = np.zeros((frames, channels), dtype=np.float32)
+        self.stages = ()
+        self.configure(config)
+
+    def configure(self, config):
+        self.config = config
+        self.stages = build_stages(config, self.frames, self.channels, self.rate)
+
+    def process(self, frame):
+        """frame 为 int16 的 (frames, channels) 数组，就地处理"""
+        stages = self.stages
+        if not stages:
+            return
+
+        buffer = self.buffer
+        np.copyto(buffer, frame, casting="unsafe")
+        for stage in stages:
+            stage.process(buffer)
+
+        np.rint(buffer, out=buffer)
+        np.clip(buffer, -32768, 32767, out=buffer)
+        np.copyto(frame, buffer, casting="unsafe")
+
+
+class Concealer:
+    """采集欠载时的丢帧掩盖，代替直接补静音造成的咔嗒声
+
+    欠载时交替反向、正向重复最后一帧（反向重复使帧边界处的采样连续），
+    在 fade 帧内线性淡出到静音；数据恢复后的第一帧从掩盖信号交叉淡入。
+    正常帧不做任何处理，只有欠载和恢复的那一帧有开销。
+    """
+
+    def __init__(self, frames=960, channels=2, fade=3):
+        self.fade_frames = fade
+        self.last = np.zeros((frames, channels), dtype=np.float32)
+        self.work = np.zeros((frames, channels), dtype=np.float32)
+        self.live = np.zeros((frames, channels), dtype=np.float32)
+
+        gains = np.linspace(1.0, 0.0, fade * frames + 1, dtype=np.float32)[1:]
+        self.fade = gains.reshape(fade, frames, 1)
+        self.ramp = np.linspace(0.0, 1.0, frames + 1, dtype=np.float32)[1:, None]
+
+        # 连续掩盖的帧数
+        self.missing = 0
+
+    def render(self, index, out):
+        if index >= self.fade_frames:
+            out.fill(0)
+            return
+
+        source = self.last[::-1] if index % 2 == 0 else self.last
+        np.multiply(source, self.fade[index], out=out)
+
+    def conceal(self, frame):
+        """frame 中仍是上一次输出的 int16 帧，就地替换为掩盖帧"""
+        if self.missing == 0:
+            np.copyto(self.last, frame, casting="unsafe")
+
+        self.render(self.missing, self.work)
+        self.missing += 1
+
+        np.rint(self.work, out=self.work)
+        np.copyto(frame, self.work, casting="unsafe")
+
+    def resume(self, frame):
+        """欠载之后的第一帧正常数据，就地从掩盖信号交叉淡入"""
+        self.render(self.missing, self.work)
+        self.missing = 0
+
+        live = self.live
+        np.copyto(live, frame, casting="unsafe")
+        live -= self.work
+        live *= self.ramp
+        live += self.work
+
+        np.rint(live, out=live)
+        np.copyto(frame, live, casting="unsafe")
+
+
+class Crossfader:
+    """在一帧内从旧信号线性交叉淡化到新信号，热切换设备时使用"""
+
+    def __init__(self, frames=960, channels=2):
+        self.old = np.zeros((frames, channels), dtype=np.float32)
+        self.new = np.zeros((frames, channels), dtype=np.float32)
+        self.ramp = np.linspace(0.0, 1.0, frames + 1, dtype=np.float32)[1:, None]
+
+    def mix(self, old, new):
+        """old、new 为 int16 帧，结果就地写入 new"""
+        np.copyto(self.old, old, casting="unsafe")
+        np.copyto(self.new, new, casting="unsafe")
+
+        mixed = self.new
+        mixed -= self.old
+        mixed *= self.ramp
+        mixed += self.old
+
+        np.rint(mixed, out=mixed)
+        np.copyto(new, mixed, casting="unsafe")
@@ -1,12 +1,14 @@
 import os
 import sys
+import math
 import sound
+import metrics
 import asyncio
 import logging
 import discord
 from PyQt5.QtSvg import QSvgWidget
-from PyQt5.QtGui import QFontDatabase, QFontMetrics, QIcon
-from PyQt5.QtCore import Qt, QCoreApplication, QEventLoop, QDir, pyqtSignal
+from PyQt5.QtGui import QColor, QFontDatabase, QFontMetrics, QIcon, QPainter
+from PyQt5.QtCore import Qt, QDir, QTimer, pyqtSignal
 from PyQt5.QtWidgets import (
     QMainWindow,
     QPushButton,
@@ -27,6 +29,9 @@ if getattr(sys, "frozen", False):
 else:
     bundle_dir = os.path.dirname(os.path.abspath(__file__))
 
+# 电平表刷新频率（Hz）
+METER_RATE = 30
+
 
 class Dropdown(QComboBox):
     changed = pyqtSignal(object, object)
@@ -67,10 +72,64 @@ class SVGButton(QPushButton):
         self.svg.setVisible(not enabled)
 
 
+class VUMeter(QWidget):
+    """峰值/RMS电平条：RMS为实心条，峰值为缓慢回落的竖线，刻度为 -60dB 到 0dB"""
+
+    # 每次刷新时显示值回落的比例
+    DECAY = 0.85
+    FLOOR_DB = -60.0
+
+    def __init__(self):
+        super(VUMeter, self).__init__()
+        self.setObjectName("meter")
+        self.setFixedHeight(10)
+        self.setMinimumWidth(80)
+        self.peak = 0.0
+        self.rms = 0.0
+
+    @classmethod
+    def scale(cls, level):
+        if level <= 0:
+            return 0.0
+        return min(1.0, max(0.0, 1.0 - 20 * math.log10(level) / cls.FLOOR_DB))
+
+    def set_level(self, peak, rms):
+        peak = self.scale(peak)
+        rms = self.scale(rms)
+        peak = max(peak, self.peak * self.DECAY)
+        rms = max(rms, self.rms * self.DECAY)
+
+        # 变化不到一个像素时不重绘
+        width = self.width()
+        if int(peak * width) != int(self.peak * width) or int(rms * width) != int(self.rms * width):
+            self.update()
+        self.peak = peak
+        self.rms = rms
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        width = self.width()
+        height = self.height()
+
+        painter.fillRect(0, 0, width, height, QColor("#202225"))
+
+        # 接近满幅时变为黄色，削波时变为红色
+        color = QColor("#43B581")
+        if self.peak >= 1.0:
+            color = QColor("#F04747")
+        elif self.peak >= self.scale(10 ** (-6 / 20)):
+            color = QColor("#FAA61A")
+
+        painter.fillRect(0, 0, int(self.rms * width), height, color)
+        if self.peak > 0:
+            painter.fillRect(max(0, int(self.peak * width) - 2), 0, 2, height, color)
+
+
 class Connection:
     def __init__(self, layer, parent):
         logger.info(f"初始化连接层 {layer}")
-        self.stream = sound.PCMStream()
+        self.stream = sound.OpusStream()
+        metrics.registry.track(f"connection-{layer - 1}", self.stream)
         self.parent = parent
         self.voice = None
 
@@ -79,10 +138,14 @@ class Connection:
         self.servers = Dropdown()
         self.channels = Dropdown()
 
+        # 保存稳定标识而不是索引，设备热插拔后索引可能变化
         for device, idx in parent.devices.items():
-            self.devices.addItem(device + "   ", idx)
+            self.devices.addItem(device + "   ", str(sound.device_registry.identity(idx)))
             logger.debug(f"添加音频设备: {device} (ID: {idx})")
 
+        # level meter
+        self.meter = VUMeter()
+
         # mute
         self.mute = SVGButton("Mute")
         self.mute.setObjectName("mute")
@@ -91,7 +154,8 @@ class Connection:
         parent.layout.addWidget(self.devices, layer, 0)
         parent.layout.addWidget(self.servers, layer, 1)
         parent.layout.addWidget(self.channels, layer, 2)
-        parent.layout.addWidget(self.mute, layer, 3)
+        parent.layout.addWidget(self.meter, layer, 3, Qt.AlignVCenter)
+        parent.layout.addWidget(self.mute, layer, 4)
 
         # events
         self.devices.changed.connect(self.change_device)
@@ -124,7 +188,15 @@ class Connection:
         self.servers.setEnabled(enabled)
         self.channels.setEnabled(enabled)
         self.mute.setEnabled(enabled)
-        self.mute.setText("Mute" if enabled else "")
+        self.mute.setText(("Resume" if self.stream.muted else "Mute") if enabled else "")
+
+    def update_meter(self):
+        """在界面线程中读取音频线程发布的电平，不会阻塞音频线程"""
+        meter = self.stream.meter
+        if meter is None:
+            self.meter.set_level(0.0, 0.0)
+        else:
+            self.meter.set_level(*meter.sample())
 
     def set_servers(self, guilds):
         logger.info(f"设置服务器列表，共 {len(guilds)} 个服务器")
@@ -136,21 +208,27 @@ class Connection:
         try:
             selection = self.devices.currentData()
             logger.info(f"切换音频设备到: {selection}")
-            self.mute.setText("Mute")
 
-            if self.voice is not None:
+            if self.voice is not None and self.voice.is_playing():
+                # 新设备在后台打开，播放不中断，切换在帧边界交叉淡入
+                logger.info("播放中热切换设备")
+                self.stream.switch_device(selection)
+
+            elif self.voice is not None:
                 logger.info("停止当前音频播放并切换设备")
                 self.voice.stop()
                 self.stream.change_device(selection)
 
                 if self.voice.is_connected():
                     logger.info("重新开始播放音频流")
-                    self.voice.play(self.stream)
+                    self.voice.play(self.stream, **self.stream.play_options())
 
             else:
                 logger.info("语音连接未建立，仅切换设备")
                 self.stream.change_device(selection)
 
+            self.parent.start_meters()
+
         except Exception as e:
             logger.error(f"切换音频设备时发生错误: {e}")
             logging.exception("Error on change_device")
@@ -181,7 +259,6 @@ class Connection:
         try:
             selection = self.channels.currentData()
             logger.info(f"切换语音频道: {selection.name if selection else 'None'}")
-            self.mute.setText("Mute")
             self.setEnabled(False)
 
             if selection is not None:
@@ -206,7 +283,7 @@ class Connection:
 
                 if not_playing:
                     logger.info(f"开始播放音频流到频道: {selection.name}")
-                    self.voice.play(self.stream)
+                    self.voice.play(self.stream, **self.stream.play_options())
                 else:
                     logger.info(f"音频流已在播放中，频道: {selection.name}")
 
@@ -228,14 +305,15 @@ class Connection:
 
     def toggle_mute(self):
         try:
+            # 静音由音频源处理：停止发包但播放线程和采集不停，恢复时不需要重新对时
             if self.voice is not None:
-                if self.voice.is_playing():
-                    logger.info("暂停音频播放")
-                    self.voice.pause()
+                if not self.stream.muted:
+                    logger.info("静音：停止发包，采集保持运行")
+                    self.stream.set_muted(True)
                     self.mute.setText("Resume")
                 else:
-                    logger.info("恢复音频播放")
-                    self.voice.resume()
+                    logger.info("取消静音")
+                    self.stream.set_muted(False)
                     self.mute.setText("Mute")
 
         except Exception as e:
@@ -342,7 +420,12 @@ class GUI(QMainWindow):
         self.layout.addWidget(device_lb, 1, 0)
         self.layout.addWidget(server_lb, 1, 1)
         self.layout.addWidget(channel_lb, 1, 2)
-        self.layout.addWidget(self.connection_btn, 2, 4)
+        self.layout.addWidget(self.connection_btn, 2, 5)
+
+        # level meters, sampled only after a device has been selected
+        self.meter_timer = QTimer(self)
+        self.meter_timer.setInterval(int(1000 / METER_RATE))
+        self.meter_timer.timeout.connect(self.update_meters)
 
         # events
         self.connection_btn.clicked.connect(self.add_connection)
@@ -391,10 +474,22 @@ class GUI(QMainWindow):
                 new_connection.servers.setRowHidden(idx, True)
 
         self.layout.removeWidget(self.connection_btn)
-        self.layout.addWidget(self.connection_btn, layer, 4)
+        self.layout.addWidget(self.connection_btn, layer, 5)
 
         self.connections.append(new_connection)
 
+    def start_meters(self):
+        if not self.meter_timer.isActive():
+            self.meter_timer.start()
+
+    def update_meters(self):
+        # 最小化时不重绘
+        if self.isMinimized():
+            return
+
+        for connection in self.connections:
+            connection.update_meter()
+
     def exclude(self, deselected, selected):
         self.connected_servers.add(selected)
         
@@ -407,11 +502,6 @@ class GUI(QMainWindow):
             if deselected is not None:
                 connection.servers.setRowHidden(deselected, False)
 
-    async def run_Qt(self, interval=0.01):
-        while True:
-            QCoreApplication.processEvents(QEventLoop.AllEvents, int(interval * 1000))
-            await asyncio.sleep(interval)
-
     async def ready(self):
         await self.bot.wait_until_ready()
 
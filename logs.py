@@ -0,0 +1,120 @@
+import time
+import queue
+import logging
+import threading
+import logging.handlers
+
+# 日志队列容量（条），写入线程卡住时新日志被丢弃而不是阻塞调用方
+LOG_QUEUE = 10000
+
+# 相同的日志在该时间窗口（秒）内只输出一次，其余计数后在下一次输出时附上
+DEDUP_INTERVAL = 1.0
+
+# 限速去重的logger：只有音频热路径，其他模块的每一条警告和错误都要保留
+RATE_LIMITED = ("sound",)
+
+# 去重表的上限，超过后清空，防止格式化好的消息把表撑大
+DEDUP_LIMIT = 1000
+
+# 当前安装在根logger上的入队handler、后台写入线程和热路径logger上的去重过滤器
+queue_handler = None
+listener = None
+rate_limit = None
+limited_loggers = []
+
+
+class RateLimitFilter(logging.Filter):
+    """按 (logger, 级别, 格式化后的消息) 限速去重
+
+    参数不同（例如不同设备、不同服务器）的消息各自计数，不会互相吞掉。
+    """
+
+    def __init__(self, interval=DEDUP_INTERVAL):
+        super().__init__()
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.seen = {}
+        self.suppressed = 0
+
+    def filter(self, record):
+        try:
+            message = record.getMessage()
+        except Exception:
+            message = record.msg
+        key = (record.name, record.levelno, message)
+        now = time.monotonic()
+
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry is not None and now - entry[0] < self.interval:
+                entry[1] += 1
+                self.suppressed += 1
+                return False
+
+            if len(self.seen) >= DEDUP_LIMIT:
+                self.seen.clear()
+            self.seen[key] = [now, 0]
+
+        if entry is not None and entry[1]:
+            record.msg = f"{record.msg} (另有 {entry[1]} 条相同日志被省略)"
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """只做一次不阻塞的入队，队列满时丢弃日志并计数"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogListener(logging.handlers.QueueListener):
+    """后台写入线程；停止时队列可能是满的，结束标记要等写入线程腾出位置再放入"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+def install(handlers, interval=DEDUP_INTERVAL, size=LOG_QUEUE, limited=RATE_LIMITED):
+    """把根logger的输出改为入队，由后台线程调用 handlers 完成实际的文件和控制台I/O
+
+    调用日志的线程（包括音频线程）只做格式化和入队，控制台或磁盘变慢不会阻塞它们。
+    limited 中的logger（音频热路径）另外按消息限速去重，防止每帧一条的错误刷满队列。
+    """
+    global queue_handler, listener, rate_limit, limited_loggers
+    stop()
+
+    queue_handler = DroppingQueueHandler(queue.Queue(size))
+    rate_limit = RateLimitFilter(interval)
+    limited_loggers = [logging.getLogger(name) for name in limited]
+    for logger in limited_loggers:
+        logger.addFilter(rate_limit)
+
+    root = logging.getLogger()
+    for existing in handlers:
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+
+    listener = LogListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return queue_handler
+
+
+def stop():
+    """取出队列中剩余的日志并停止后台线程"""
+    global queue_handler, listener, rate_limit, limited_loggers
+    if listener is None:
+        return
+
+    logging.getLogger().removeHandler(queue_handler)
+    for logger in limited_loggers:
+        logger.removeFilter(rate_limit)
+    listener.stop()
+    queue_handler = listener = rate_limit = None
+    limited_loggers = []
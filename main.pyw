@@ -1,37 +1,7 @@
 import logging
+import multiprocessing
 import sys
 import os
-
-# Windows编码兼容性修复
-if sys.platform.startswith('win'):
-    # 设置标准输出编码为UTF-8
-    if hasattr(sys.stdout, 'reconfigure'):
-        sys.stdout.reconfigure(encoding='utf-8')
-    elif hasattr(sys.stdout, 'buffer'):
-        import io
-        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-    
-    # 设置环境变量
-    os.environ['PYTHONIOENCODING'] = 'utf-8'
-
-# error logging
-error_formatter = logging.Formatter(
-    fmt="%(asctime)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
-)
-
-error_handler = logging.FileHandler("DAP_errors.log", delay=True)
-error_handler.setLevel(logging.INFO)
-error_handler.setFormatter(error_formatter)
-
-base_logger = logging.getLogger()
-base_logger.addHandler(error_handler)
-
-import cli
-import sound
-from cli import try_reconnect
-import asyncio
-import discord
-from discord.ext import commands, tasks
 import argparse
 
 # commandline args
@@ -50,6 +20,24 @@ parser.add_argument(
     help="The token for the bot",
 )
 
+parser.add_argument(
+    "--metrics-port",
+    dest="metrics_port",
+    action="store",
+    type=int,
+    default=None,
+    help="Serve Prometheus metrics on this local port",
+)
+
+parser.add_argument(
+    "--latency-profile",
+    dest="latency_profile",
+    action="store",
+    choices=["ultra-low", "balanced", "robust"],
+    default="balanced",
+    help="Capture block size, PortAudio latency and buffer depth: ultra-low, balanced or robust",
+)
+
 parser.add_argument(
     "-v",
     "--verbose",
@@ -72,8 +60,126 @@ connect.add_argument(
     "--device",
     dest="device",
     action="store",
+    help="The device to listen from as an index, hostapi/name/channels or auto",
+)
+
+connect.add_argument(
+    "-r",
+    "--routes",
+    dest="routes",
+    action="store",
+    help="A JSON routing table mapping devices to channels, run in one process",
+)
+
+connect.add_argument(
+    "--device-policy",
+    dest="device_policy",
+    action="store",
+    choices=["latency", "reported", "default"],
+    default="latency",
+    help="How -d auto picks a device: probed latency, reported latency or the default host API",
+)
+
+connect.add_argument(
+    "--bitrate",
+    dest="bitrate",
+    action="store",
     type=int,
-    help="The device to listen from as an index",
+    default=128,
+    help="Opus encoder bitrate in kbps",
+)
+
+connect.add_argument(
+    "--complexity",
+    dest="complexity",
+    action="store",
+    type=int,
+    default=10,
+    help="Opus encoder complexity (0-10)",
+)
+
+connect.add_argument(
+    "--no-fec",
+    dest="fec",
+    action="store_false",
+    help="Disable Opus in-band forward error correction",
+)
+
+connect.add_argument(
+    "--packet-loss",
+    dest="packet_loss",
+    action="store",
+    type=float,
+    default=0.15,
+    help="Expected packet loss for the Opus encoder (0-1)",
+)
+
+connect.add_argument(
+    "--silence-threshold",
+    dest="silence_threshold",
+    action="store",
+    type=float,
+    default=None,
+    help="Stop sending audio while the RMS level stays below this value",
+)
+
+connect.add_argument(
+    "--silence-hang",
+    dest="silence_hang",
+    action="store",
+    type=float,
+    default=0.5,
+    help="Seconds to keep sending after the level drops below the threshold",
+)
+
+connect.add_argument(
+    "--silence-attack",
+    dest="silence_attack",
+    action="store",
+    type=float,
+    default=0.0,
+    help="Seconds the level must stay above the threshold to resume sending",
+)
+
+connect.add_argument(
+    "--record",
+    dest="record",
+    action="store",
+    default=None,
+    help="Record what is sent to each channel as Ogg/Opus files in this directory",
+)
+
+connect.add_argument(
+    "--record-rotate",
+    dest="record_rotate",
+    action="store",
+    type=float,
+    default=3600,
+    help="Start a new recording file after this many seconds",
+)
+
+connect.add_argument(
+    "--record-max-mb",
+    dest="record_max_mb",
+    action="store",
+    type=float,
+    default=None,
+    help="Start a new recording file once it reaches this size in MB",
+)
+
+connect.add_argument(
+    "--dsp",
+    dest="dsp",
+    action="store",
+    default=None,
+    help='Processing stages applied before encoding, as JSON, e.g. \'[{"type": "highpass", "cutoff": 80}, {"type": "limiter"}]\'',
+)
+
+connect.add_argument(
+    "--isolate",
+    dest="isolate",
+    action="store_true",
+    help="Capture and encode each device in a separate worker process",
 )
 
 query.add_argument(
@@ -84,6 +190,14 @@ query.add_argument(
     help="Query compatible audio devices",
 )
 
+query.add_argument(
+    "-P",
+    "--probe",
+    dest="probe",
+    action="store_true",
+    help="Measure the input latency of every audio device",
+)
+
 query.add_argument(
     "-C",
     "--channels",
@@ -92,6 +206,15 @@ query.add_argument(
     help="Query servers and channels (requires token)",
 )
 
+query.add_argument(
+    "--cache-ttl",
+    dest="cache_ttl",
+    action="store",
+    type=float,
+    default=3600,
+    help="Seconds a cached -C result stays valid, 0 to always fetch",
+)
+
 connect.add_argument(
     "-dev",
     "--dev",
@@ -100,167 +223,294 @@ connect.add_argument(
     help="dev mode",
 )
 
-args = parser.parse_args()
-is_gui = not any([args.channel, args.device, args.query, args.online])
 
-# CLI模式下的日志配置
-if not is_gui:
-    # 为CLI模式配置控制台日志
-    cli_formatter = logging.Formatter(
-        fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
-    
-    cli_handler = logging.StreamHandler()
-    cli_handler.setLevel(logging.INFO)
-    cli_handler.setFormatter(cli_formatter)
-    
-    # 获取根logger并添加CLI handler
-    root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
-    root_logger.addHandler(cli_handler)
-    
-    # 确保sound和cli模块的logger级别正确
-    logging.getLogger('sound').setLevel(logging.INFO)
-    logging.getLogger('cli').setLevel(logging.INFO)
-
-# verbose logs
-if args.verbose:
-    debug_formatter = logging.Formatter(
-        fmt="%(asctime)s:%(levelname)s:%(name)s: %(message)s"
-    )
+def run():
+    """解析命令行，启动命令行模式或图形界面
 
-    debug_handler = logging.FileHandler(
-        filename="discord.log", encoding="utf-8", mode="w"
-    )
-    debug_handler.setFormatter(debug_formatter)
+    spawn 出的工作进程以 __mp_main__ 重新导入本文件，只会执行到这里的定义，
+    不会解析参数、加载 discord 和Qt，也不会再创建一个机器人。
+    """
+    # Windows编码兼容性修复
+    if sys.platform.startswith('win'):
+        # 设置标准输出编码为UTF-8
+        if hasattr(sys.stdout, 'reconfigure'):
+            sys.stdout.reconfigure(encoding='utf-8')
+        elif hasattr(sys.stdout, 'buffer'):
+            import io
+            sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
-    debug_logger = logging.getLogger("discord")
-    debug_logger.setLevel(logging.DEBUG)
-    debug_logger.addHandler(debug_handler)
+        # 设置环境变量
+        os.environ['PYTHONIOENCODING'] = 'utf-8'
 
-# don't import qt stuff if not using gui
-if is_gui:
-    import gui
-    from PyQt5.QtWidgets import QApplication, QMessageBox
-
-    app = QApplication(sys.argv)
-    msg = QMessageBox()
-    msg.setIcon(QMessageBox.Information)
-
-
-# main
-async def main(bot):
-    try:
-        # query devices
-        if args.query:
-            for device, index in sound.query_devices().items():
-                print(index, device)
-
-            return
-
-        # check for token
-        token = args.token
-        if token is None:
-            token = open("token.txt", "r").read()
-
-        # query servers and channels
-        if args.online:
-            await cli.query(bot, token)
+    # error logging
+    error_formatter = logging.Formatter(
+        fmt="%(asctime)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+    )
 
+    error_handler = logging.FileHandler("DAP_errors.log", delay=True)
+    error_handler.setLevel(logging.INFO)
+    error_handler.setFormatter(error_formatter)
+
+    base_logger = logging.getLogger()
+    base_logger.addHandler(error_handler)
+
+    args = parser.parse_args()
+    is_gui = not any([args.channel, args.device, args.routes, args.query, args.probe, args.online])
+
+    # 查询设备只需要 sounddevice，不加载 discord、numpy 和Qt，也不创建机器人
+    if args.query:
+        import devices
+
+        infos = devices.device_registry.query()
+        for device, index in devices.query_devices().items():
+            latency = devices.reported_latency(infos[index])
+            print(index, devices.device_registry.identity(index), f"{latency * 1000:.1f} ms")
+
+        sys.exit(0)
+
+    # 其它模式才加载音频、网络和界面模块
+    import cli
+    import json
+    import logs
+    import sound
+    import metrics
+    from cli import try_reconnect
+    import asyncio
+    import discord
+    from discord.ext import commands
+
+    sound.set_latency_profile(args.latency_profile)
+
+    # CLI模式下的日志配置
+    if not is_gui:
+        # 为CLI模式配置控制台日志
+        cli_formatter = logging.Formatter(
+            fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+        )
+
+        cli_handler = logging.StreamHandler()
+        cli_handler.setLevel(logging.INFO)
+        cli_handler.setFormatter(cli_formatter)
+
+        # 获取根logger并添加CLI handler
+        root_logger = logging.getLogger()
+        root_logger.setLevel(logging.INFO)
+        root_logger.addHandler(cli_handler)
+
+        # 确保sound和cli模块的logger级别正确
+        logging.getLogger('sound').setLevel(logging.INFO)
+        logging.getLogger('cli').setLevel(logging.INFO)
+
+    # verbose logs
+    if args.verbose:
+        debug_formatter = logging.Formatter(
+            fmt="%(asctime)s:%(levelname)s:%(name)s: %(message)s"
+        )
+
+        debug_handler = logging.FileHandler(
+            filename="discord.log", encoding="utf-8", mode="w"
+        )
+        debug_handler.setFormatter(debug_formatter)
+        debug_handler.addFilter(logging.Filter("discord"))
+
+        debug_logger = logging.getLogger("discord")
+        debug_logger.setLevel(logging.DEBUG)
+
+    # 文件和控制台的写入放到后台线程，音频线程和事件循环只把日志放入队列
+    log_handlers = [error_handler]
+    if not is_gui:
+        log_handlers.append(cli_handler)
+    if args.verbose:
+        log_handlers.append(debug_handler)
+    logs.install(log_handlers)
+
+    # don't import qt stuff if not using gui
+    if is_gui:
+        import gui
+        import qasync
+        from PyQt5.QtWidgets import QApplication, QMessageBox
+
+        app = QApplication(sys.argv)
+
+        # 窗口关闭时由 run_bot() 结束循环，而不是让Qt直接停止事件循环
+        app.setQuitOnLastWindowClosed(False)
+        msg = QMessageBox()
+        msg.setIcon(QMessageBox.Information)
+
+
+    # main
+    async def main(bot):
+        try:
+            # probe device latency
+            if args.probe:
+                for result in sound.probe_devices():
+                    jitter = "-" if result.jitter is None else f"{result.jitter * 1000:.2f} ms"
+                    print(
+                        result.index,
+                        result.identity,
+                        f"{result.latency * 1000:.1f} ms",
+                        f"jitter {jitter}",
+                        f"blocksizes {list(result.blocksizes)}",
+                    )
+
+                return
+
+            # check for token
+            token = args.token
+            if token is None:
+                token = open("token.txt", "r").read()
+
+            # query servers and channels
+            if args.online:
+                await cli.query(bot, token, args.cache_ttl)
+
+                return
+
+            # metrics
+            if args.metrics_port:
+                metrics.serve(args.metrics_port)
+                metrics.registry.gauge(
+                    "dap_gateway_latency_seconds", "Discord gateway heartbeat latency", lambda: bot.latency
+                )
+
+            # GUI
+            if is_gui:
+                bot_ui = gui.GUI(app, bot)
+                asyncio.ensure_future(bot_ui.ready())
+
+            # CLI
+            else:
+                stream_options = {
+                    "bitrate": args.bitrate,
+                    "complexity": args.complexity,
+                    "fec": args.fec,
+                    "expected_packet_loss": args.packet_loss,
+                    "isolated": args.isolate,
+                }
+
+                if args.silence_threshold is not None:
+                    stream_options["silence"] = {
+                        "threshold": args.silence_threshold,
+                        "hang": args.silence_hang,
+                        "attack": args.silence_attack,
+                    }
+
+                if args.dsp:
+                    stream_options["stages"] = json.loads(args.dsp)
+
+                if args.record:
+                    stream_options["record"] = {
+                        "directory": args.record,
+                        "rotate_seconds": args.record_rotate,
+                        "rotate_bytes": int(args.record_max_mb * 1024 * 1024) if args.record_max_mb else None,
+                    }
+
+                if args.routes:
+                    routes = cli.load_routes(args.routes, stream_options)
+                    asyncio.ensure_future(cli.run_routes(bot, routes, args.routes, stream_options))
+
+                else:
+                    device = args.device
+                    if device == "auto":
+                        device = str(sound.device_registry.identity(sound.select_device(args.device_policy)))
+                        print(f"🎤 自动选择设备: {device}")
+
+                    asyncio.ensure_future(cli.connect(bot, device, args.channel, stream_options))
+                print("cli over")
+
+
+
+            await bot.start(token)
+            print("over")
+
+        except FileNotFoundError:
+            if is_gui:
+                msg.setWindowTitle("Token Error")
+                msg.setText("No Token Provided")
+                msg.exec()
+
+            else:
+                print("No Token Provided")
+
+        except discord.errors.LoginFailure:
+            if is_gui:
+                msg.setWindowTitle("Login Failed")
+                msg.setText("Please check if the token is correct")
+                msg.exec()
+
+            else:
+                print("Login Failed: Please check if the token is correct")
+
+        except Exception:
+            logging.exception("Error on main")
+
+
+    http_proxy = None
+    if args.dev:
+        http_proxy = "http://127.0.0.1:7890"
+
+    # 配置机器人意图
+    intents = discord.Intents.default()
+    intents.voice_states = True      # 启用语音状态监听
+    intents.members = True           # 启用成员监听（需要获取成员信息）
+    intents.message_content = True   # 启用消息内容意图（用于命令功能）
+
+    # 创建机器人实例
+    bot = commands.Bot(command_prefix='!', intents=intents, proxy=http_proxy,  reconnect=True )
+
+    @bot.event
+    async def on_voice_state_update(member, before, after):
+        if member.id != bot.user.id:
             return
-
-        # GUI
-        if is_gui:
-            bot_ui = gui.GUI(app, bot)
-            asyncio.ensure_future(bot_ui.ready())
-            asyncio.ensure_future(bot_ui.run_Qt())
-
-        # CLI
-        else:
-            asyncio.ensure_future(cli.connect(bot, args.device, args.channel))
-            print("cli over")
-
-        
-
-        await bot.start(token)
-        print("over")
-
-    except FileNotFoundError:
-        if is_gui:
-            msg.setWindowTitle("Token Error")
-            msg.setText("No Token Provided")
-            msg.exec()
-
-        else:
-            print("No Token Provided")
-
-    except discord.errors.LoginFailure:
+        # 检查是否断开连接
+        if before.channel and not after.channel:
+            print(f"bot have been disconnected")
+            await try_reconnect(bot, before.channel.id)
+
+    @bot.event
+    async def on_connect():
+        logging.info('bot have been connected')
+
+    @bot.event
+    async def on_disconnect():
+        logging.info('bot have been disconnected    ')
+
+    @bot.event
+    async def on_resumed():
+        logging.info('bot have been resumed')
+
+    async def run_bot():
+        try:
+            await main(bot)
+            print("main over")
+        except KeyboardInterrupt:
+            print("Exiting...")
+            await bot.close()
+            # this sleep prevents a bugged exception on Windows
+            await asyncio.sleep(1)
+        except Exception as e:
+            print(e)
+
+    # 使用现代的asyncio.run()方法启动机器人
+    try:
         if is_gui:
-            msg.setWindowTitle("Login Failed")
-            msg.setText("Please check if the token is correct")
-            msg.exec()
-
+            # asyncio运行在Qt的事件分发器之上，两边的事件都按需处理，空闲时不轮询
+            loop = qasync.QEventLoop(app)
+            asyncio.set_event_loop(loop)
+            with loop:
+                loop.run_until_complete(run_bot())
         else:
-            print("Login Failed: Please check if the token is correct")
-
-    except Exception:
-        logging.exception("Error on main")
-
-
-http_proxy = None
-if args.dev:
-    http_proxy = "http://127.0.0.1:7890"
-
-# 配置机器人意图
-import discord
-from discord.ext import commands
-
-intents = discord.Intents.default()
-intents.voice_states = True      # 启用语音状态监听
-intents.members = True           # 启用成员监听（需要获取成员信息）
-intents.message_content = True   # 启用消息内容意图（用于命令功能）
-
-# 创建机器人实例
-bot = commands.Bot(command_prefix='!', intents=intents, proxy=http_proxy,  reconnect=True )
-
-@bot.event
-async def on_voice_state_update(member, before, after):
-    if member.id != bot.user.id:
-        return
-    # 检查是否断开连接
-    if before.channel and not after.channel:
-        print(f"bot have been disconnected")
-        await asyncio.sleep(2)
-        await try_reconnect(bot, args.channel) 
-
-@bot.event
-async def on_connect():
-    logging.info('bot have been connected')
-
-@bot.event
-async def on_disconnect():
-    logging.info('bot have been disconnected    ')
-
-@bot.event
-async def on_resumed():
-    logging.info('bot have been resumed')
-    
-async def run_bot():
-    try:
-        await main(bot)
-        print("main over")
-    except KeyboardInterrupt:
-        print("Exiting...")
-        await bot.close()
-        # this sleep prevents a bugged exception on Windows
-        await asyncio.sleep(1)
-    except Exception as e:
-        print(e)
-
-# 使用现代的asyncio.run()方法启动机器人
-if __name__ == "__main__":
-    try:
-        asyncio.run(run_bot())
+            asyncio.run(run_bot())
     except KeyboardInterrupt:
         print("程序被用户中断")
+    finally:
+        # 录音的写入线程是守护线程，退出前要等它写完最后一页
+        cli.close_audio_streams()
+        logs.stop()
+
 
+if __name__ == "__main__":
+    # 打包后的程序启动工作进程时，子进程在 freeze_support() 里接管，不再往下执行；
+    # 直接用 Python 运行时，子进程以 __mp_main__ 导入本文件，不满足这里的条件
+    multiprocessing.freeze_support()
+    run()
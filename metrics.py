@@ -0,0 +1,274 @@
+import bisect
+import logging
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# 帧处理耗时的分桶（秒），20ms为一帧的预算
+READ_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1)
+
+# 采集到发送的延迟分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.02, 0.04, 0.06, 0.08, 0.1, 0.15, 0.2, 0.5, 1.0)
+
+# 语音断开到重新发出音频的时间分桶（秒）
+RECOVERY_BUCKETS = (0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 30.0, 60.0)
+
+# 采集中断时长和从发现中断到设备重新出数据的时间分桶（秒）
+OUTAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+# 两次读取的间隔超过该值视为迟到帧
+LATE_INTERVAL = 0.03
+
+
+def format_value(value):
+    if value is None:
+        return "NaN"
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+class Histogram:
+    """固定分桶的直方图，observe() 只做计数，不分配缓冲区"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {format_value(self.sum)}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class RouteMetrics:
+    """单条线路的热路径指标，由播放线程写入，抓取时读取"""
+
+    def __init__(self, route):
+        self.route = route
+        self.read_seconds = Histogram(READ_BUCKETS)
+        self.capture_to_send_seconds = Histogram(LATENCY_BUCKETS)
+        self.time_to_audio_seconds = Histogram(RECOVERY_BUCKETS)
+        self.late_frames = 0
+        self.reconnects = 0
+        self.last_read = 0.0
+
+        # 被监控的音频源，抓取时读取它的缓冲水位和丢帧计数
+        self.source = None
+
+        # 之前挂在这条线路上的音频源的计数，线路重建音频源后计数器不归零
+        self.retired_overruns = 0
+        self.retired_underruns = 0
+
+    @property
+    def dropped_frames(self):
+        source = self.source
+        return self.retired_overruns + (source.overruns if source is not None else 0)
+
+    @property
+    def underruns(self):
+        source = self.source
+        return self.retired_underruns + (source.underruns if source is not None else 0)
+
+    def retire(self, source):
+        self.retired_overruns += source.overruns
+        self.retired_underruns += source.underruns
+
+    def observe(self, start, end, latency, parked=False):
+        # 静音抑制挂起的读取不计入耗时和迟到统计
+        if parked:
+            self.last_read = 0.0
+            return
+
+        if self.last_read and start - self.last_read > LATE_INTERVAL:
+            self.late_frames += 1
+        self.last_read = start
+
+        self.read_seconds.observe(end - start)
+        if latency is not None:
+            self.capture_to_send_seconds.observe(latency)
+
+
+class DeviceMetrics:
+    """单个采集设备的中断统计，由 sound 的采集看门狗写入"""
+
+    def __init__(self, device):
+        self.device = device
+        self.outage_seconds = Histogram(OUTAGE_BUCKETS)
+        self.recovery_seconds = Histogram(OUTAGE_BUCKETS)
+        self.outages = 0
+        self.stalled = False
+
+
+class Registry:
+    """进程内的指标汇总，按线路聚合"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.devices = {}
+        self.gauges = {}
+
+    def route(self, name):
+        name = str(name)
+        with self.lock:
+            metrics = self.routes.get(name)
+            if metrics is None:
+                metrics = self.routes[name] = RouteMetrics(name)
+            return metrics
+
+    def device(self, name):
+        name = str(name)
+        with self.lock:
+            metrics = self.devices.get(name)
+            if metrics is None:
+                metrics = self.devices[name] = DeviceMetrics(name)
+            return metrics
+
+    def track(self, name, source):
+        """为音频源挂上线路指标"""
+        metrics = self.route(name)
+        if metrics.source is not None and metrics.source is not source:
+            metrics.retire(metrics.source)
+        metrics.source = source
+        source.metrics = metrics
+        return metrics
+
+    def gauge(self, name, help_text, getter):
+        """注册一个在抓取时求值的全局指标"""
+        with self.lock:
+            self.gauges[name] = (help_text, getter)
+
+    def render(self):
+        with self.lock:
+            routes = list(self.routes.values())
+            devices = list(self.devices.values())
+            gauges = list(self.gauges.items())
+
+        lines = []
+
+        for name, (help_text, getter) in gauges:
+            try:
+                value = getter()
+            except Exception:
+                value = None
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {format_value(value)}")
+
+        def header(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        header("dap_read_seconds", "histogram", "Time spent in read() per frame")
+        for metrics in routes:
+            lines.extend(metrics.read_seconds.render("dap_read_seconds", f'route="{metrics.route}"'))
+
+        header("dap_capture_to_send_seconds", "histogram", "Age of the audio handed to the player")
+        for metrics in routes:
+            lines.extend(
+                metrics.capture_to_send_seconds.render("dap_capture_to_send_seconds", f'route="{metrics.route}"')
+            )
+
+        header("dap_time_to_audio_seconds", "histogram", "Time from a voice drop until audio is playing again")
+        for metrics in routes:
+            lines.extend(
+                metrics.time_to_audio_seconds.render("dap_time_to_audio_seconds", f'route="{metrics.route}"')
+            )
+
+        header("dap_late_frames_total", "counter", "Frames read later than the 20 ms cadence")
+        for metrics in routes:
+            lines.append(f'dap_late_frames_total{{route="{metrics.route}"}} {metrics.late_frames}')
+
+        header("dap_reconnects_total", "counter", "Voice reconnects")
+        for metrics in routes:
+            lines.append(f'dap_reconnects_total{{route="{metrics.route}"}} {metrics.reconnects}')
+
+        header("dap_ring_fill_ratio", "gauge", "Buffered audio as a fraction of the buffer depth")
+        for metrics in routes:
+            source = metrics.source
+            value = source.fill() if source is not None else None
+            lines.append(f'dap_ring_fill_ratio{{route="{metrics.route}"}} {format_value(value)}')
+
+        header("dap_dropped_frames_total", "counter", "Frames dropped because the buffer overran")
+        for metrics in routes:
+            lines.append(f'dap_dropped_frames_total{{route="{metrics.route}"}} {metrics.dropped_frames}')
+
+        header("dap_underruns_total", "counter", "Frames replaced with silence because capture fell behind")
+        for metrics in routes:
+            lines.append(f'dap_underruns_total{{route="{metrics.route}"}} {metrics.underruns}')
+
+        header("dap_recording_dropped_frames_total", "counter", "Frames left out of the recording because the writer fell behind")
+        for metrics in routes:
+            tap = getattr(metrics.source, "tap", None)
+            value = tap.dropped if tap is not None else 0
+            lines.append(f'dap_recording_dropped_frames_total{{route="{metrics.route}"}} {value}')
+
+        header("dap_capture_outages_total", "counter", "Times a capture device stalled or failed and was reopened")
+        for metrics in devices:
+            lines.append(f'dap_capture_outages_total{{device="{metrics.device}"}} {metrics.outages}')
+
+        header("dap_capture_stalled", "gauge", "1 while a capture device is stalled and being reopened")
+        for metrics in devices:
+            lines.append(f'dap_capture_stalled{{device="{metrics.device}"}} {int(metrics.stalled)}')
+
+        header("dap_capture_outage_seconds", "histogram", "Time from the last captured block to the first block after recovery")
+        for metrics in devices:
+            lines.extend(metrics.outage_seconds.render("dap_capture_outage_seconds", f'device="{metrics.device}"'))
+
+        header("dap_capture_recovery_seconds", "histogram", "Time from detecting a stall until the reopened device delivers audio")
+        for metrics in devices:
+            lines.extend(metrics.recovery_seconds.render("dap_capture_recovery_seconds", f'device="{metrics.device}"'))
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def serve(port, host="127.0.0.1"):
+    """在后台线程中通过HTTP提供Prometheus文本格式的指标"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+
+    logger.info(f"指标服务已启动: http://{host}:{port}/metrics")
+    return server
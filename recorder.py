@@ -0,0 +1,218 @@
+import os
+import time
+import queue
+import struct
+import logging
+import threading
+from datetime import datetime
+
+import sound
+
+logger = logging.getLogger(__name__)
+
+# 录音队列的容量（帧），约10秒；写入线程跟不上时丢弃录音帧，不影响直播
+RECORD_QUEUE = 500
+
+# 写入线程取出队列的间隔（秒）
+BATCH_INTERVAL = 0.25
+
+# 每页最多容纳的包数（约1秒），攒够一页再写盘
+PAGE_PACKETS = 50
+
+# 文件缓冲区大小（字节）
+WRITE_BUFFER = 1 << 16
+
+# Opus解码器在开头丢弃的采样数，对应libopus默认的编码延迟
+PRE_SKIP = 312
+
+# 两个包的间隔超过该值（秒）时用静音包补齐，例如静音抑制挂起期间
+GAP_THRESHOLD = sound.FRAME_LENGTH * 2
+
+# 单次最多补齐的静音包数，防止时钟跳变时写出大量数据
+GAP_LIMIT = 3000
+
+
+def _crc_table():
+    table = []
+    for index in range(256):
+        crc = index << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+CRC_TABLE = _crc_table()
+
+
+def ogg_crc(data):
+    """Ogg页使用的CRC32（多项式 0x04C11DB7，不反转，初值为0）"""
+    crc = 0
+    table = CRC_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ table[(crc >> 24) ^ byte]
+    return crc
+
+
+class OggOpusWriter:
+    """把20ms的Opus包封装为Ogg/Opus文件，每 PAGE_PACKETS 个包写一页"""
+
+    def __init__(self, path, channels=2, vendor=b"discord-audio-pipe"):
+        self.path = path
+        self.file = open(path, "wb", buffering=WRITE_BUFFER)
+        self.serial = int.from_bytes(os.urandom(4), "little")
+        self.sequence = 0
+        self.granule = 0
+        self.packets = []
+
+        head = b"OpusHead" + struct.pack("<BBHIhB", 1, channels, PRE_SKIP, 48000, 0, 0)
+        tags = b"OpusTags" + struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", 0)
+        self.write_page([head], 0, 0x02)
+        self.write_page([tags], 0, 0x00)
+
+    @property
+    def size(self):
+        return self.file.tell()
+
+    def write_page(self, packets, granule, flags):
+        lacing = bytearray()
+        for packet in packets:
+            lacing.extend(b"\xff" * (len(packet) // 255))
+            lacing.append(len(packet) % 255)
+
+        header = b"OggS" + struct.pack("<BBqIII", 0, flags, granule, self.serial, self.sequence, 0)
+        page = bytearray(header + bytes([len(lacing)]) + lacing + b"".join(packets))
+        page[22:26] = struct.pack("<I", ogg_crc(page))
+
+        self.file.write(page)
+        self.sequence += 1
+
+    def write(self, packet):
+        # 一页最多255个分段
+        segments = sum(len(p) // 255 + 1 for p in self.packets) + len(packet) // 255 + 1
+        if segments > 255:
+            self.flush_page()
+
+        self.packets.append(packet)
+        self.granule += sound.FRAME_SAMPLES
+
+        if len(self.packets) >= PAGE_PACKETS:
+            self.flush_page()
+
+    def flush_page(self, flags=0x00):
+        if self.packets or flags:
+            self.write_page(self.packets, self.granule, flags)
+            self.packets = []
+
+    def close(self):
+        self.flush_page(0x04)
+        self.file.close()
+
+
+class Recorder:
+    """线路的录音分接：播放线程把发出的帧放入有界队列，写入线程封装并写盘
+
+    feed() 只做一次不阻塞的入队，队列满时丢弃录音帧并计数，直播不受影响。
+    PCM线路的帧在写入线程中编码，Opus线路直接复用已编码的包。
+    文件按时长或大小轮换，文件名为 "<线路>-<开始时间>.opus"。
+    """
+
+    def __init__(self, directory, route, opus=True, rotate_seconds=3600, rotate_bytes=None, queue_size=RECORD_QUEUE):
+        self.directory = directory
+        self.route = route
+        self.opus = opus
+        self.rotate_seconds = rotate_seconds
+        self.rotate_bytes = rotate_bytes
+
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0
+        self.recorded = 0
+        self.writer = None
+        self.opened = 0.0
+        self.last_time = None
+        self.encoder = None
+
+        os.makedirs(directory, exist_ok=True)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._write_loop, name=f"recorder:{route}", daemon=True)
+        self.thread.start()
+
+    def feed(self, data):
+        """在播放线程中调用，不阻塞"""
+        try:
+            self.queue.put_nowait((time.perf_counter(), data))
+        except queue.Full:
+            self.dropped += 1
+
+    def open(self):
+        stem = os.path.join(self.directory, f"{self.route}-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+        path = f"{stem}.opus"
+        index = 1
+        while os.path.exists(path):
+            path = f"{stem}-{index}.opus"
+            index += 1
+
+        self.writer = OggOpusWriter(path)
+        self.opened = time.monotonic()
+        logger.info(f"开始录音: {self.writer.path}")
+
+    def rotate_due(self):
+        writer = self.writer
+        if self.rotate_seconds and time.monotonic() - self.opened >= self.rotate_seconds:
+            return True
+        return bool(self.rotate_bytes) and writer.size >= self.rotate_bytes
+
+    def encode(self, data):
+        if self.opus:
+            return data or sound.OPUS_SILENCE
+
+        if self.encoder is None:
+            self.encoder = sound.OpusEncoder()
+        return self.encoder.encode(data, sound.FRAME_SAMPLES)
+
+    def write(self, timestamp, data):
+        if self.writer is None:
+            self.open()
+
+        # 静音抑制等原因没有发包的时间段用静音包补齐，保持录音的时间轴
+        if self.last_time is not None and timestamp - self.last_time > GAP_THRESHOLD:
+            missing = round((timestamp - self.last_time) / sound.FRAME_LENGTH) - 1
+            for _ in range(min(GAP_LIMIT, missing)):
+                self.writer.write(sound.OPUS_SILENCE)
+        self.last_time = timestamp
+
+        self.writer.write(self.encode(data))
+        self.recorded += 1
+
+        if self.rotate_due():
+            self.writer.close()
+            self.writer = None
+
+    def _write_loop(self):
+        while True:
+            # 定时成批取出队列中的帧，播放线程入队时不需要唤醒写入线程
+            stopping = self.stopping.wait(BATCH_INTERVAL)
+
+            batch = []
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                for timestamp, data in batch:
+                    self.write(timestamp, data)
+
+                if stopping and self.writer is not None:
+                    self.writer.close()
+                    self.writer = None
+            except Exception:
+                logger.exception(f"线路 {self.route} 录音写入失败")
+
+            if stopping:
+                break
+
+    def close(self):
+        self.stopping.set()
+        self.thread.join()
@@ -29,7 +29,7 @@ def setup_crash_protection():
         # 尝试优雅地关闭
         try:
             import cli
-            if hasattr(cli, 'audio_stream') and cli.audio_stream:
+            if getattr(cli, 'audio_streams', None):
                 print("🔊 正在停止音频流...")
                 # 不直接操作音频流，避免段错误
         except:
@@ -1,106 +1,1634 @@
 import discord
+import discord.opus
 import sounddevice as sd
-from pprint import pformat
+import asyncio
+import dsp
+import logging
+import metrics
+from devices import (
+    DEFAULT,
+    DeviceIdentity,
+    DeviceRegistry,
+    DeviceNotFoundError,
+    device_registry,
+    query_devices,
+    reported_latency,
+)
+import ctypes
+import json
+import weakref
+import contextlib
+from collections import namedtuple
 import numpy as np
+import math
+import threading
 import time
-from datetime import datetime
 
-DEFAULT = 0
-sd.default.channels = 2
+CHANNELS = 2
+sd.default.channels = CHANNELS
 sd.default.dtype = "int16"
 sd.default.latency = "low"
 sd.default.samplerate = 48000
 
+# Discord reads 20 ms worth of audio at a time (20 ms * 50 == 1000 ms == 1 sec)
+FRAME_LENGTH = 0.02
+FRAME_SAMPLES = int(sd.default.samplerate / 50)
+
+# 环形缓冲区默认深度（以20ms帧为单位）
+DEFAULT_DEPTH = 8
+
+# 延迟配置：PortAudio 回调的块长（秒）、建议延迟和缓冲区深度（20ms帧）
+# 块长超过20ms时回调整块写入环形缓冲区，读取方仍按20ms帧切分读取
+LatencyProfile = namedtuple("LatencyProfile", "name block latency depth")
+LATENCY_PROFILES = {
+    "ultra-low": LatencyProfile("ultra-low", 0.005, "low", 4),
+    "balanced": LatencyProfile("balanced", FRAME_LENGTH, "low", DEFAULT_DEPTH),
+    "robust": LatencyProfile("robust", 0.06, "high", 16),
+}
+latency_profile = LATENCY_PROFILES["balanced"]
+
+# 采集看门狗的检查间隔，以及多久没有新数据视为设备卡住（秒，至少为4个采集块）
+WATCHDOG_INTERVAL = 0.05
+STALL_TIMEOUT = 0.25
+
+# 刚打开的设备送来第一块数据之前的宽限时间（秒），部分驱动打开较慢
+STALL_STARTUP = 2.0
+
+# 重新打开卡住的设备失败时的退避（秒）
+REOPEN_BASE = 0.5
+REOPEN_MAX = 10.0
+
+# 延迟探测：尝试的块大小（采样数）和每种块大小的采集时长（秒）
+PROBE_BLOCKSIZES = (128, 256, 480, 960)
+PROBE_DURATION = 0.25
+
+# Opus
+CTL_SET_COMPLEXITY = 4010
+MAX_PACKET_SIZE = 4000
+OPUS_SILENCE = b"\xF8\xFF\xFE"
+
+# 静音抑制：门限关闭后先发送的静音帧数（与discord一致），之后停止发包，
+# 每隔 PARK_LIMIT 秒发送一个保活静音包
+SILENCE_FRAMES = 5
+PARK_LIMIT = 5.0
+
+# 手动静音时，停住的播放线程和空闲的编码线程检查状态的间隔（秒）
+MUTE_POLL = 0.1
+
+# 采集欠载时掩盖的帧数，之后为静音
+CONCEAL_FRAMES = 3
+
+# 热切换设备：等待新设备送来第一帧、以及等待读取线程在帧边界完成切换的最长时间（秒）
+SWITCH_TIMEOUT = 2.0
+
+# 编码链路中表示"静音被抑制，未编码"的占位包
+GATED = b""
+
+logger = logging.getLogger(__name__)
+
+
+def set_latency_profile(name):
+    """切换延迟配置，只影响之后打开的采集流和音频源"""
+    global latency_profile
+    latency_profile = LATENCY_PROFILES[name]
+    sd.default.latency = latency_profile.latency
+    return latency_profile
+
+
+def read_timeout():
+    """读取方等待下一帧的最长时间：大块采集时数据成批到达，至少要等一个块长"""
+    return max(FRAME_LENGTH, latency_profile.block)
+
+
+def player_active():
+    """当前线程是discord播放线程时，判断它是否仍在播放"""
+    is_playing = getattr(threading.current_thread(), "is_playing", None)
+    return is_playing is None or is_playing()
+
+
+def resync_player():
+    """停住的 read() 返回后重新对齐discord播放线程的发送节奏
+
+    播放线程按 _start + DELAY * loops 排下一帧，停住的时间会让它以为落后了，
+    随后连续不间隔地发包追赶。和 AudioPlayer.resume() 一样把计时清零，
+    起点往前挪一帧，让下一帧正好在20ms后发出。
+    """
+    player = threading.current_thread()
+    if hasattr(player, "loops") and hasattr(player, "_start"):
+        player.loops = 0
+        player._start = time.perf_counter() - FRAME_LENGTH
+
+
+def set_speaking(speaking):
+    """在播放线程中切换当前语音连接的说话状态"""
+    client = getattr(threading.current_thread(), "client", None)
+    if client is None:
+        return
+
+    state = discord.SpeakingState.voice if speaking else discord.SpeakingState.none
+    try:
+        asyncio.run_coroutine_threadsafe(client.ws.speak(state), client.client.loop)
+    except Exception:
+        pass
+
+
+class SilenceGate:
+    """基于RMS电平的静音门限
+
+    threshold: 电平低于该值视为静音
+    hang: 电平回落后门限保持打开的时间（秒）
+    attack: 电平需要持续超过阈值多久才重新打开（秒），0 表示立即打开
+    """
+
+    def __init__(self, threshold=100, hang=0.5, attack=0.0):
+        self.threshold = threshold
+        self.hang_frames = round(hang / FRAME_LENGTH)
+        self.attack_frames = round(attack / FRAME_LENGTH)
+        self.open = True
+        self.above = 0
+        self.below = 0
+
+    def update(self, rms):
+        if rms >= self.threshold:
+            self.above += 1
+            self.below = 0
+            if not self.open and self.above > self.attack_frames:
+                self.open = True
+        else:
+            self.below += 1
+            self.above = 0
+            if self.open and self.below > self.hang_frames:
+                self.open = False
+
+        return self.open
+
+
+class RingBuffer:
+    """预分配的环形缓冲区，单写多读，数据路径无锁
+
+    写入方是PortAudio回调线程，读取方各自持有一个 RingReader 游标。
+    位置是单调递增的采样帧计数，写入方在数据拷贝完成之后才推进 written，
+    读取方据此判断数据是否可用、是否已被覆盖。
+    """
+
+    def __init__(self, capacity, channels):
+        self.capacity = capacity
+        self.channels = channels
+        self.buffer = np.zeros((capacity, channels), dtype=np.int16)
+        self.written = 0
+        self.write_time = time.perf_counter()
+
+        # 仅用于唤醒等待数据的读取方，不保护缓冲区本身
+        self.ready = threading.Condition()
+
+    def write(self, block):
+        count = len(block)
+        if count > self.capacity:
+            block = block[-self.capacity:]
+            count = self.capacity
+
+        start = self.written % self.capacity
+        end = start + count
+
+        if end <= self.capacity:
+            self.buffer[start:end] = block
+        else:
+            split = self.capacity - start
+            self.buffer[start:] = block[:split]
+            self.buffer[: end - self.capacity] = block[split:]
+
+        self.written += count
+        self.write_time = time.perf_counter()
+
+        with self.ready:
+            self.ready.notify_all()
+
+    def reader(self):
+        return RingReader(self)
+
+
+class RingReader:
+    """环形缓冲区上的独立读取游标"""
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.position = ring.written
+        self.overruns = 0
+
+    def available(self):
+        return self.ring.written - self.position
+
+    def skip(self):
+        """丢弃所有已缓冲的数据，跳到最新位置"""
+        self.position = self.ring.written
+
+    def latency(self):
+        """刚读出的最后一个采样距离采集的时间（秒）"""
+        ring = self.ring
+        return (ring.written - self.position) / sd.default.samplerate + time.perf_counter() - ring.write_time
+
+    def wait(self, count, timeout):
+        """等待至少 count 帧可读，超时返回 False"""
+        if self.available() >= count:
+            return True
+
+        deadline = time.perf_counter() + timeout
+        with self.ring.ready:
+            while self.available() < count:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return False
+                self.ring.ready.wait(remaining)
+
+        return True
+
+    def read_into(self, out):
+        """把下一段数据拷贝到预分配的 out 中，数据不足时返回 False"""
+        ring = self.ring
+        capacity = ring.capacity
+        count = len(out)
+
+        while True:
+            written = ring.written
+            if written - self.position > capacity - count:
+                # 读取方落后太多，旧数据已被覆盖，直接跳到最新的一帧
+                self.overruns += 1
+                self.position = written - count
+
+            if written - self.position < count:
+                return False
+
+            start = self.position % capacity
+            end = start + count
+
+            if end <= capacity:
+                out[:] = ring.buffer[start:end]
+            else:
+                split = capacity - start
+                out[:split] = ring.buffer[start:]
+                out[split:] = ring.buffer[: end - capacity]
+
+            # 拷贝期间写入方可能已经覆盖了这段数据
+            if ring.written - self.position > capacity:
+                continue
+
+            self.position += count
+            return True
+
+
+def native_format(device):
+    """设备的原生采样率和采集声道数（最多 CHANNELS 个）"""
+    try:
+        info = device_registry.query()[device]
+        samplerate = int(info.get("default_samplerate") or sd.default.samplerate)
+        channels = min(max(1, int(info.get("max_input_channels") or CHANNELS)), CHANNELS)
+    except Exception:
+        samplerate, channels = int(sd.default.samplerate), CHANNELS
+
+    return samplerate, channels
+
+
+class Capture:
+    """单个输入设备的回调式采集，数据写入预分配的环形缓冲区
+
+    设备以原生采样率和声道数打开，与 Discord 的 48kHz 立体声不一致时，
+    在回调中经过 dsp.FormatConverter 转换后再写入缓冲区。
+    设备卡住或出错时由 CaptureWatchdog 在后台线程中 recover()，新的流继续写入
+    同一个环形缓冲区，读取方的游标不变，期间读取方拿到的是静音帧。
+    重新打开失败时按稳定标识重新查找设备，热插拔后索引变化也能找回同一个设备。
+    """
+
+    def __init__(self, device, depth=None, profile=None):
+        self.profile = profile or latency_profile
+        self.device = device
+        self.identity = device_registry.identity(device)
+
+        # 缓冲区至少要容纳一个采集块和正在读取的一帧
+        self.depth = max(depth or self.profile.depth, math.ceil(self.profile.block / FRAME_LENGTH) + 2)
+        self.ring = RingBuffer(self.depth * FRAME_SAMPLES, CHANNELS)
+        self.overruns = 0
+
+        self.samplerate, self.channels = native_format(device)
+        native = self.samplerate == int(sd.default.samplerate) and self.channels == CHANNELS
+        self.converter = None if native else dsp.FormatConverter(
+            self.samplerate, self.channels, int(sd.default.samplerate), CHANNELS
+        )
+
+        self.stall_timeout = max(STALL_TIMEOUT, 4 * self.profile.block)
+        self.closing = threading.Event()
+        self.recovering = False
+        self.lock = threading.Lock()
+
+        self.stream = self.open_stream()
+        # 重新打开期间旧的流已关闭，此时允许重新初始化PortAudio
+        self.stream_open = True
+        self.metrics = metrics.registry.device(self.identity)
+
+    def open_stream(self):
+        return sd.RawInputStream(
+            device=self.device,
+            samplerate=self.samplerate,
+            channels=self.channels,
+            blocksize=round(self.samplerate * self.profile.block),
+            latency=self.profile.latency,
+            callback=self._callback,
+        )
+
+    def stalled(self, now):
+        """超过 stall_timeout 没有新数据，或者流因为回调出错已经停止"""
+        timeout = self.stall_timeout if self.ring.written else STALL_STARTUP
+        return now - self.ring.write_time > timeout or not self.stream.active
+
+    def recover(self, detected):
+        """在后台线程中重新打开设备，直到新的流开始出数据或采集被关闭"""
+        last_data = self.ring.write_time
+        self.metrics.stalled = True
+        logger.warning("采集设备 %s 已 %.2f 秒没有数据，正在重新打开", self.metrics.device, detected - last_data)
+
+        attempt = 0
+        while not self.closing.is_set():
+            try:
+                # 与 close() 互斥，采集关闭之后不会再打开新的流
+                with self.lock:
+                    if self.closing.is_set():
+                        break
+
+                    try:
+                        self.stream.abort()
+                        self.stream.close()
+                    except Exception:
+                        pass
+                    self.stream_open = False
+
+                    self.stream = self.open_stream()
+                    self.stream.start()
+                    self.stream_open = True
+            except Exception as e:
+                logger.warning("重新打开采集设备 %s 失败: %s", self.metrics.device, e)
+                self.relocate()
+            else:
+                # 新的流送来第一块数据才算恢复
+                deadline = time.perf_counter() + self.stall_timeout
+                while time.perf_counter() < deadline and self.ring.write_time <= last_data:
+                    if self.closing.wait(FRAME_LENGTH):
+                        break
+                if self.ring.write_time > last_data:
+                    break
+
+            attempt += 1
+            if self.closing.wait(min(REOPEN_MAX, REOPEN_BASE * 2 ** (attempt - 1))):
+                break
+
+        if not self.closing.is_set():
+            resumed = self.ring.write_time
+            self.metrics.outages += 1
+            self.metrics.outage_seconds.observe(resumed - last_data)
+            self.metrics.recovery_seconds.observe(resumed - detected)
+            logger.warning("采集设备 %s 已恢复，中断 %.2f 秒", self.metrics.device, resumed - last_data)
+
+        self.metrics.stalled = False
+        self.recovering = False
+
+    def relocate(self):
+        """按稳定标识重新查找设备索引，找不到时尝试重新初始化PortAudio发现新插入的设备"""
+        device_registry.invalidate()
+        try:
+            index = device_registry.resolve(self.identity)
+        except ValueError:
+            index = None
+
+        if index is not None and index != self.device:
+            hub.move_capture(self, index)
+            return
+
+        # 找不到或者仍是打不开的同一个索引：PortAudio 的设备列表可能已过时，
+        # 重新扫描后 hub 会为所有采集重新查找索引
+        hub.rescan()
+
+    def _callback(self, indata, frames, time_info, status):
+        if status.input_overflow:
+            self.overruns += 1
+
+        block = np.frombuffer(indata, dtype=np.int16).reshape(frames, self.channels)
+        if self.converter is not None:
+            block = self.converter.process(block)
+
+        self.ring.write(block)
+
+    def start(self):
+        self.stream.start()
+
+    def close(self):
+        self.closing.set()
+        with self.lock:
+            self.stream_open = False
+            try:
+                self.stream.stop()
+            finally:
+                self.stream.close()
+
+
+class CaptureWatchdog:
+    """检查所有采集流，设备卡住或出错时在单独的线程中重新打开它
+
+    读取方等待一帧没有数据时已经用静音补位，播放线程不会停下；看门狗负责让设备恢复出数据。
+    """
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.thread = threading.Thread(target=self._watch_loop, name="capture-watchdog", daemon=True)
+        self.thread.start()
+
+    def _watch_loop(self):
+        while True:
+            time.sleep(WATCHDOG_INTERVAL)
+            with self.hub.lock:
+                captures = [entry[0] for entry in self.hub.captures.values()]
+
+            now = time.perf_counter()
+            for capture in captures:
+                if capture.recovering or capture.closing.is_set() or not capture.stalled(now):
+                    continue
+
+                capture.recovering = True
+                threading.Thread(
+                    target=capture.recover, args=(now,), name=f"capture-recover:{capture.device}", daemon=True
+                ).start()
+
+
+class StreamSource(discord.AudioSource):
+    """PCMStream 和 OpusStream 的公共部分：静音时的说话状态和热路径指标"""
 
-class PCMStream(discord.AudioSource):
     def __init__(self):
         discord.AudioSource.__init__(self)
-        self.stream = None
+        self.underruns = 0
+        self.silent = 0
+        self.speaking = True
+        self.parked = False
+
+        # metrics.RouteMetrics，由 metrics.registry.track() 挂上
+        self.metrics = None
+
+        # 录音分接（recorder.Recorder），收到每一帧发出的数据
+        self.tap = None
+
+        # 换下的设备、链路和游标上的丢帧数，以及当前链路换上时已有的计数；
+        # overruns 在此之上累加，切换设备或处理链时不会归零
+        self.dropped = 0
+        self.overrun_base = 0
+
+        # 手动静音：不发包，采集保持运行
+        self.muted = False
+        self.unmuted = threading.Event()
+        self.unmuted.set()
+
+    def read_frame(self):
+        raise NotImplementedError
+
+    def skip(self):
+        """丢弃积压的数据，下一次读取从最新的一帧开始"""
+
+    def keepalive(self):
+        """停住太久时返回的一帧静音"""
+        raise NotImplementedError
+
+    def latency(self):
+        """刚交给播放线程的音频距离采集的时间（秒）"""
+        return None
+
+    def play_options(self):
+        """传给 VoiceClient.play() 的编码参数；Opus音频源已经编码好，不需要"""
+        return {}
+
+    def fill(self):
+        """缓冲水位，占缓冲深度的比例"""
+        return 0.0
+
+    def read(self):
+        self.parked = False
+        if self.metrics is None:
+            data = self.read_frame()
+        else:
+            start = time.perf_counter()
+            data = self.read_frame()
+            self.metrics.observe(start, time.perf_counter(), self.latency(), self.parked)
+
+        if self.tap is not None and data:
+            self.tap.feed(data)
+        return data
+
+    def resume_speaking(self):
+        self.silent = 0
+        if not self.speaking:
+            self.speaking = True
+            set_speaking(True)
+
+    def pause_speaking(self):
+        self.parked = True
+        if self.speaking:
+            self.speaking = False
+            set_speaking(False)
+
+    def set_muted(self, muted):
+        """静音时不再发包，取消静音后立即从最新的数据继续，不会放出静音期间积压的音频
+
+        与 VoiceClient.pause() 不同，播放线程不停止，只在 read() 返回前重置它的发送计时。
+        """
+        self.muted = muted
+        if muted:
+            self.unmuted.clear()
+        else:
+            self.unmuted.set()
+
+    def wait_for_unmute(self):
+        """静音期间停在这里不返回（即不发包）
+
+        返回 None 表示已取消静音；播放线程需要退出或者静音太久时返回保活数据。
+        """
+        self.pause_speaking()
+
+        deadline = time.perf_counter() + PARK_LIMIT
+        while self.muted:
+            if not player_active() or time.perf_counter() >= deadline:
+                resync_player()
+                return self.keepalive()
+            self.unmuted.wait(MUTE_POLL)
+
+        self.skip()
+        self.resume_speaking()
+        resync_player()
+        return None
+
+
+class LevelMeter:
+    """音频线程写入、界面线程读取的峰值/RMS电平槽位，无锁且不分配内存
+
+    写入方唯一，用序号实现 seqlock：写入前后各递增一次，读取方看到奇数序号
+    或读取前后序号不一致时重读。sample() 返回相对满幅的 0-1 值。
+    """
+
+    FULL_SCALE = 32768.0
+
+    def __init__(self, slot=None, sequence=None):
+        # 槽位可以放在共享内存中，供其它进程读取
+        self.slot = np.zeros(2, dtype=np.float32) if slot is None else slot
+        self.peak = self.slot[0:1].reshape(())
+        self.sequence = np.zeros(1, dtype=np.uint64) if sequence is None else sequence
+
+    def publish(self, levels, rms):
+        """levels 为帧的浮点副本，会被就地取绝对值"""
+        self.sequence += 1
+        np.abs(levels, out=levels)
+        np.max(levels, out=self.peak)
+        self.slot[1] = rms
+        self.sequence += 1
+
+    def clear(self):
+        self.sequence += 1
+        self.slot.fill(0)
+        self.sequence += 1
+
+    def sample(self):
+        for _ in range(4):
+            before = int(self.sequence[0])
+            if before & 1:
+                continue
+            peak, rms = float(self.slot[0]), float(self.slot[1])
+            if int(self.sequence[0]) == before:
+                break
+        else:
+            peak, rms = float(self.slot[0]), float(self.slot[1])
+
+        return peak / self.FULL_SCALE, rms / self.FULL_SCALE
+
+
+class PCMStream(StreamSource):
+    """由discord的播放线程编码的PCM音频源
+
+    bitrate、fec、expected_packet_loss 通过 play_options() 交给 VoiceClient.play()，
+    开启带内FEC后，接收端丢包时可以从下一个包中恢复出丢失的帧。
+    """
+
+    def __init__(self, depth=None, silence=None, stages=None, bitrate=128, fec=True, expected_packet_loss=0.15):
+        StreamSource.__init__(self)
+        self.encoder_options = {
+            "bitrate": bitrate,
+            "fec": fec,
+            "expected_packet_loss": expected_packet_loss,
+        }
+        self.capture = None
+        self.reader = None
+        self.depth = depth or latency_profile.depth
+        self.timeout = read_timeout()
         self.frame_count = 0
         self.last_audio_output = 0
         self.start_time = time.time()
 
-        # Discord reads 20 ms worth of audio at a time (20 ms * 50 == 1000 ms == 1 sec)
-        self.frames = int(sd.default.samplerate / 50)
+        # 静音抑制，silence 为 SilenceGate 的参数字典，None 表示关闭
+        self.gate = SilenceGate(**silence) if silence else None
+        self.gated = False
+        self.level = 0.0
+        self.meter = LevelMeter()
+
+        self.frames = FRAME_SAMPLES
+        self.frame = np.zeros((self.frames, CHANNELS), dtype=np.int16)
+
+        # 采集和发送之间的处理链（增益、噪声门、高通、限幅等），stages 为各处理级的配置列表
+        self.chain = dsp.DSPChain(stages, self.frames, CHANNELS, int(sd.default.samplerate))
+
+        # 采集欠载时重复并淡出最后一帧，而不是直接补静音
+        self.concealer = dsp.Concealer(self.frames, CHANNELS, CONCEAL_FRAMES)
+
+        # 热切换：后台线程预热好的 (采集, 游标)，由读取线程在帧边界换上
+        self.pending = None
+        self.switch_lock = threading.Lock()
+        self.switched = threading.Event()
+        self.incoming = np.zeros((self.frames, CHANNELS), dtype=np.int16)
+        self.crossfader = dsp.Crossfader(self.frames, CHANNELS)
+        self.switches = 0
+
+        # 热路径复用的预分配缓冲区：帧数据的字节视图和电平计算用的浮点缓冲
+        self.view = memoryview(self.frame).cast("B")
+        self.levels = np.zeros(self.frame.size, dtype=np.float32)
+
+    @property
+    def stream(self):
+        return self.capture.stream if self.capture is not None else None
+
+    @property
+    def overruns(self):
+        """设备溢出次数加上读取方落后导致的丢帧次数，包括换下的设备上的"""
+        capture = self.capture
+        if capture is None:
+            return self.dropped
+        return self.dropped + capture.overruns - self.overrun_base + self.reader.overruns
+
+    def attach(self, capture, reader):
+        """换上新设备的采集和游标，旧设备上的丢帧数计入累计值"""
+        self.dropped = self.overruns
+        self.overrun_base = capture.overruns
+        self.reader = reader
+        self.capture = capture
 
     def detect_audio_level(self, data):
         """检测音频数据的音量级别"""
         try:
             # 将字节数据转换为numpy数组
             audio_array = np.frombuffer(data, dtype=np.int16)
-            
-            # 计算RMS音量
-            rms = np.sqrt(np.mean(audio_array.astype(np.float32)**2))
+            levels = self.levels[: audio_array.size]
+
+            # 在预分配的缓冲区中转换为浮点，计算RMS音量时不产生临时数组
+            np.copyto(levels, audio_array)
+            rms = math.sqrt(np.dot(levels, levels) / audio_array.size)
             
             return rms
         except Exception:
             return 0
 
-    def read(self):
-        if self.stream is None:
+    def read_view(self):
+        """零拷贝读取下一帧，返回的 memoryview 在下一次读取之前有效"""
+        if self.capture is None:
             return
 
         try:
-            data = self.stream.read(self.frames)[0]
+            # 有预热好的新设备时在这一帧切换；
+            # 否则最多等待一帧（大块采集时一个块长）的时间，采集跟不上时用掩盖帧补位而不是阻塞播放线程
+            ready = self.pending is not None and self.take_switch()
+            if not ready:
+                ready = self.reader.wait(self.frames, self.timeout) and self.reader.read_into(self.frame)
+            if not ready:
+                self.underruns += 1
+                self.concealer.conceal(self.frame)
+                self.meter.clear()
+                return self.view
+
             self.frame_count += 1
+            self.chain.process(self.frame)
+            if self.concealer.missing:
+                self.concealer.resume(self.frame)
             
             # 检测音频级别
-            rms = self.detect_audio_level(data)
+            rms = self.detect_audio_level(self.view)
+            self.level = rms
+            self.meter.publish(self.levels, rms)
+            if self.gate is not None:
+                self.gated = not self.gate.update(rms)
             
             # 只有当有声音且距离上次输出超过50帧（约1秒）时才输出
             if rms > 100 and (self.frame_count - self.last_audio_output) > 50:
-                current_time = datetime.now().strftime("%H:%M:%S")
-                elapsed_time = time.time() - self.start_time
-                print(f"[{current_time}] 检测到声音 - 音量: {rms:.0f} (运行时间: {elapsed_time:.1f}s)")
+                # 在音频线程中只入队，用 %-格式参数以便按模板限速去重
+                logger.info("检测到声音 - 音量: %.0f (运行时间: %.1fs)", rms, time.time() - self.start_time)
                 self.last_audio_output = self.frame_count
-            
-            # 转换到PCM格式
-            pcm_data = bytes(data)
-            return pcm_data
+
+            return self.view
             
         except Exception:
+            # 返回 None 会让discord结束播放线程；采集出错时用掩盖帧补位，由看门狗恢复设备
+            logger.exception("读取采集数据失败")
+            self.underruns += 1
+            self.concealer.conceal(self.frame)
+            self.meter.clear()
+            return self.view
+
+    def latency(self):
+        reader = self.reader
+        return reader.latency() if reader is not None else None
+
+    def play_options(self):
+        return dict(self.encoder_options)
+
+    def fill(self):
+        reader = self.reader
+        return reader.available() / reader.ring.capacity if reader is not None else 0.0
+
+    def skip(self):
+        reader = self.reader
+        if reader is not None:
+            reader.position = max(0, reader.ring.written - self.frames)
+
+    def drain(self):
+        """编码链路的读取方都静音时代替 read_view()：只等下一帧并跳过，不拷贝、不处理、不算电平"""
+        reader = self.reader
+        if reader is not None and reader.wait(self.frames, MUTE_POLL):
+            reader.skip()
+        self.meter.clear()
+
+    def keepalive(self):
+        self.frame.fill(0)
+        return bytes(self.view)
+
+    def read_frame(self):
+        if self.muted:
+            data = self.wait_for_unmute()
+            if data is not None:
+                return data
+
+        view = self.read_view()
+        if view is None:
             return None
 
+        if self.gated:
+            self.silent += 1
+            if self.silent > SILENCE_FRAMES:
+                view = self.wait_for_signal()
+            else:
+                self.frame.fill(0)
+        elif self.silent:
+            self.resume_speaking()
+
+        # discord的编码器只接受bytes，这是整条路径上唯一的一次拷贝
+        return bytes(view)
+
+    def wait_for_signal(self):
+        """静音期间持续消耗采集数据但不返回（即不发包），直到门限重新打开"""
+        self.pause_speaking()
+
+        deadline = time.perf_counter() + PARK_LIMIT
+        while player_active() and time.perf_counter() < deadline:
+            view = self.read_view()
+            if view is None:
+                break
+            if not self.gated:
+                self.resume_speaking()
+                resync_player()
+                return view
+
+        # 保活：播放线程需要退出或者静音太久时返回一帧静音
+        resync_player()
+        self.frame.fill(0)
+        return self.view
+
+    def take_switch(self):
+        """在帧边界换上预热好的新设备，旧设备的下一帧和新设备的第一帧交叉淡化
+
+        返回 False 表示新设备还没有数据，这一帧按欠载处理。
+        """
+        with self.switch_lock:
+            pending = self.pending
+            if pending is None:
+                return False
+            self.pending = None
+
+        capture, reader = pending
+        # 预热期间积压的数据只保留最新的一帧，切换不增加延迟
+        reader.position = max(reader.position, capture.ring.written - self.frames)
+
+        ready = reader.read_into(self.incoming)
+        if ready:
+            # 旧设备没有新数据时直接换上新设备，欠载掩盖的恢复帧会处理衔接
+            if self.reader.read_into(self.frame):
+                self.crossfader.mix(self.frame, self.incoming)
+            np.copyto(self.frame, self.incoming)
+
+        self.attach(capture, reader)
+        self.switches += 1
+        self.switched.set()
+        return ready
+
+    def switch_device(self, num):
+        """热切换设备：在调用线程中打开并预热新设备，旧设备一直供数据到切换的那一帧
+
+        读取线程（播放线程或编码线程）在下一帧边界完成切换，之后在调用线程中释放旧设备。
+        会阻塞到切换完成，播放中应在后台线程调用。
+        """
+        num = device_registry.resolve(num)
+        previous = self.capture
+        if previous is None:
+            return self.change_device(num)
+        if previous.device == num:
+            return
+
+        capture = hub.acquire_capture(num, self.depth)
+        reader = capture.ring.reader()
+        if not reader.wait(self.frames, SWITCH_TIMEOUT):
+            logger.warning("设备 %s 打开后 %.1f 秒内没有数据，仍然切换", num, SWITCH_TIMEOUT)
+
+        self.switched.clear()
+        self.pending = (capture, reader)
+        if not self.switched.wait(SWITCH_TIMEOUT):
+            # 没有线程在读取，直接换上
+            with self.switch_lock:
+                if self.pending is not None:
+                    self.pending = None
+                    self.attach(capture, reader)
+                    self.switches += 1
+
+        hub.release_capture(previous)
+
+    def close(self):
+        if self.capture is not None:
+            capture = self.capture
+            self.dropped = self.overruns
+            self.capture = None
+            self.reader = None
+            hub.release_capture(capture)
+
     def change_device(self, num):
-        if self.stream is not None:
-            self.stream.stop()
-            self.stream.close()
-        
-        print("change_device", num)
+        logger.debug("change_device %s", num)
+        num = device_registry.resolve(num)
+
+        # 先打开新设备再释放旧设备，播放线程任何时候都能读到有效的游标
+        capture = hub.acquire_capture(num, self.depth)
+        previous = self.capture
+
+        self.attach(capture, capture.ring.reader())
+        self.frame_count = 0
+        self.last_audio_output = 0
+        self.start_time = time.time()  # 重置开始时间
+
+        if previous is not None:
+            hub.release_capture(previous)
+
+
+class OpusEncoder(discord.opus.Encoder):
+    """直接从预分配的PCM帧编码，输出写入复用的缓冲区"""
+
+    def __init__(self, complexity=10, **kwargs):
+        super().__init__(**kwargs)
+        self.set_complexity(complexity)
+        self.output = ctypes.create_string_buffer(MAX_PACKET_SIZE)
+
+    def set_complexity(self, complexity):
+        complexity = min(10, max(0, int(complexity)))
+        discord.opus._lib.opus_encoder_ctl(self._state, CTL_SET_COMPLEXITY, complexity)
+        return complexity
+
+    def encode_frame(self, pcm_ptr):
+        size = discord.opus._lib.opus_encode(
+            self._state, pcm_ptr, self.SAMPLES_PER_FRAME, self.output, MAX_PACKET_SIZE
+        )
+        return ctypes.string_at(self.output, size)
+
+
+class PacketRing:
+    """编码后Opus包的环形缓冲区，单写多读，每个读取方持有自己的游标"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.written = 0
+        self.write_time = time.perf_counter()
+        self.ready = threading.Condition()
+
+        # 弱引用，连接释放游标后自动移除；其他线程会加入新游标，遍历前在锁内取快照
+        self.readers = weakref.WeakSet()
+        self.readers_lock = threading.Lock()
+
+    def idle(self):
+        """所有读取方都已静音，编码链路不必再编码"""
+        with self.readers_lock:
+            readers = list(self.readers)
+        return bool(readers) and all(reader.muted for reader in readers)
+
+    def write(self, packet):
+        self.slots[self.written % self.capacity] = packet
+        self.written += 1
+        self.write_time = time.perf_counter()
+
+        with self.ready:
+            self.ready.notify_all()
+
+    def reader(self):
+        reader = PacketReader(self)
+        with self.readers_lock:
+            self.readers.add(reader)
+        return reader
+
+
+class PacketReader:
+    """PacketRing 上的独立读取游标"""
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.position = ring.written
+        self.overruns = 0
+        self.muted = False
+
+    def set_muted(self, muted):
+        self.muted = muted
+
+    def skip(self):
+        self.position = self.ring.written
+
+    def available(self):
+        return self.ring.written - self.position
+
+    def latency(self):
+        """刚读出的包距离编码完成的时间（秒）"""
+        ring = self.ring
+        return (ring.written - self.position) * FRAME_LENGTH + time.perf_counter() - ring.write_time
+
+    def read(self, timeout):
+        """取出下一个包，超时返回 None"""
+        ring = self.ring
+
+        if ring.written == self.position:
+            with ring.ready:
+                ring.ready.wait_for(lambda: ring.written != self.position, timeout)
+
+        while ring.written != self.position:
+            if ring.written - self.position > ring.capacity - 1:
+                # 落后超过缓冲深度，丢弃旧包，从最新的包继续
+                self.overruns += 1
+                self.position = ring.written - 1
+
+            packet = ring.slots[self.position % ring.capacity]
+
+            # 读取期间该槽位可能已被新包覆盖
+            if ring.written - self.position > ring.capacity:
+                continue
+
+            self.position += 1
+            return packet
+
+        return None
+
+
+class OpusBroadcast:
+    """一条采集+编码链路，编码一次，供多个连接读取"""
+
+    isolated = False
+
+    def __init__(self, device, depth, options, silence=None, stages=None):
+        self.device = device
+        self.options = options
+        self.silence = silence
+        self.stages = stages
+        self.pcm = PCMStream(depth, silence, stages)
+        self.packets = PacketRing(self.pcm.depth)
+
+        # 在调用线程中创建编码器，这样Opus库加载失败会直接抛给调用方
+        self.encoder = OpusEncoder(**options)
+        self.pcm_ptr = self.pcm.frame.ctypes.data_as(ctypes.POINTER(ctypes.c_int16))
+
+        # 编码耗时统计，与播放线程的发送时间分开计量
+        self.encoded = 0
+        self.encode_time = 0.0
+
+        # 最近一帧在编码时距离采集的时间（秒）
+        self.capture_lag = 0.0
+
+        # 所有连接都静音、只跳过采集数据的状态
+        self.draining = False
+
+        self.pcm.change_device(device)
+        self.running = True
+        self.worker = threading.Thread(target=self._encode_loop, name=f"opus-encoder:{device}", daemon=True)
+        self.worker.start()
 
+    @property
+    def encode_cost(self):
+        """平均每帧编码耗时（毫秒）"""
+        if not self.encoded:
+            return 0.0
+        return self.encode_time / self.encoded * 1000
+
+    @property
+    def capture(self):
+        return self.pcm.capture
+
+    @property
+    def overruns(self):
+        return self.pcm.overruns
+
+    @property
+    def meter(self):
+        return self.pcm.meter
+
+    def _encode_loop(self):
+        while self.running:
+            try:
+                self.encode_next()
+            except Exception:
+                # 编码线程退出后这个设备上的所有连接都只剩静音，出错时只丢掉这一帧
+                logger.exception("编码链路处理失败")
+                time.sleep(FRAME_LENGTH)
+
+    def encode_next(self):
+        # 所有连接都静音：采集继续写入环形缓冲区，这里只跳过数据，不算电平、不编码、不产出包
+        if self.packets.idle():
+            self.pcm.drain()
+            self.draining = True
+            return
+
+        if self.draining:
+            # 取消静音后从最新的一帧开始编码
+            self.draining = False
+            self.pcm.skip()
+
+        view = self.pcm.read_view()
+        if view is None:
+            time.sleep(FRAME_LENGTH)
+            return
+
+        # 静音被抑制时跳过编码
+        if self.pcm.gated:
+            self.packets.write(GATED)
+            return
+
+        self.capture_lag = self.pcm.latency()
+        start = time.perf_counter()
         try:
-            self.stream = sd.RawInputStream(device=num)
-            self.stream.start()
-            self.frame_count = 0
-            self.last_audio_output = 0
-            self.start_time = time.time()  # 重置开始时间
-        except Exception as e:
-            raise
+            packet = self.encoder.encode_frame(self.pcm_ptr)
+        except Exception:
+            logger.exception("Opus编码失败")
+            packet = OPUS_SILENCE
+        self.encode_time += time.perf_counter() - start
+        self.encoded += 1
+
+        self.packets.write(packet)
+
+    def close(self):
+        self.running = False
+        self.worker.join()
+        self.pcm.close()
+
 
+class CaptureHub:
+    """按设备共享采集流和编码链路
+
+    同一设备只打开一个PortAudio流；相同设备和编码参数的连接共享同一个编码线程，
+    每个连接只持有自己的读取游标。缓冲深度以第一个打开者为准。
+    """
 
-class DeviceNotFoundError(Exception):
     def __init__(self):
-        self.devices = sd.query_devices()
-        self.host_apis = sd.query_hostapis()
-        super().__init__("No Devices Found")
+        self.lock = threading.Lock()
+        self.captures = {}
+        self.broadcasts = {}
+        self.watchdog = None
+
+    def acquire_capture(self, device, depth=None):
+        with self.lock:
+            if self.watchdog is None:
+                self.watchdog = CaptureWatchdog(self)
+
+            entry = self.captures.get(device)
+            if entry is None:
+                try:
+                    capture = Capture(device, depth)
+                    capture.start()
+                except Exception:
+                    # 打开失败通常意味着设备被拔出或索引已变化
+                    device_registry.invalidate()
+                    raise
+                entry = self.captures[device] = [capture, 0]
+
+            entry[1] += 1
+            return entry[0]
+
+    def release_capture(self, capture):
+        with self.lock:
+            entry = self.captures.get(capture.device)
+            if entry is None or entry[0] is not capture:
+                return
 
-    def __str__(self):
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self.captures[capture.device]
+                capture.close()
+
+    def move_capture(self, capture, device):
+        """设备索引变化后把采集登记到新的索引下，之后重新打开时使用新索引"""
+        with self.lock:
+            entry = self.captures.get(capture.device)
+            if entry is None or entry[0] is not capture or device in self.captures:
+                return False
+
+            logger.warning("采集设备 %s 的索引从 %s 变为 %s", capture.identity, capture.device, device)
+            del self.captures[capture.device]
+            self.captures[device] = entry
+            capture.device = device
+            return True
+
+    def rescan(self):
+        """所有采集流都已关闭（都在重新打开）时重新初始化PortAudio，发现重新插入的设备
+
+        PortAudio 重新初始化会关闭所有打开的流，所以只要还有采集在出数据就不扫描。
+        扫描后所有设备索引都可能变化，每个采集都按稳定标识重新查找。
+        """
+        with self.lock, contextlib.ExitStack() as stack:
+            # 持有所有采集的锁，扫描期间不会有采集重新打开设备
+            entries = list(self.captures.values())
+            for capture, count in entries:
+                stack.enter_context(capture.lock)
+            if any(capture.stream_open for capture, count in entries):
+                return False
+
+            logger.warning("所有采集设备都已断开，重新扫描音频设备")
+            device_registry.refresh(rescan=True)
+
+            # 找到的采集先登记，仍然找不到的保留旧索引，等下次失败时再查找
+            missing = []
+            self.captures = {}
+            for entry in entries:
+                try:
+                    entry[0].device = device_registry.resolve(entry[0].identity)
+                except ValueError:
+                    missing.append(entry)
+                    continue
+                self.captures[entry[0].device] = entry
+            for entry in missing:
+                self.captures.setdefault(entry[0].device, entry)
+            return True
+
+    @staticmethod
+    def broadcast_key(device, options, silence, isolated=False, stages=None):
         return (
-            f"Devices \n"
-            f"{self.devices} \n "
-            f"Host APIs \n"
-            f"{pformat(self.host_apis)}"
+            device,
+            tuple(sorted(options.items())),
+            tuple(sorted(silence.items())) if silence else None,
+            isolated,
+            json.dumps(stages, sort_keys=True) if stages else None,
         )
 
+    def acquire_broadcast(self, device, depth=None, silence=None, isolated=False, stages=None, **options):
+        """isolated=True 时采集和编码在独立的工作进程中运行，见 worker.ProcessBroadcast"""
+        key = self.broadcast_key(device, options, silence, isolated, stages)
+        depth = depth or latency_profile.depth
+
+        with self.lock:
+            entry = self.broadcasts.get(key)
+
+        # 创建链路时会获取采集锁，所以放在锁外面
+        if entry is None:
+            if isolated:
+                import worker
+
+                broadcast = worker.ProcessBroadcast(device, depth, options, silence, stages)
+            else:
+                broadcast = OpusBroadcast(device, depth, options, silence, stages)
+
+            with self.lock:
+                entry = self.broadcasts.get(key)
+                if entry is None:
+                    entry = self.broadcasts[key] = [broadcast, 0]
+                    broadcast = None
+
+            if broadcast is not None:
+                broadcast.close()
+
+        with self.lock:
+            entry[1] += 1
+            return entry[0]
+
+    def move_broadcast(self, broadcast, device):
+        """把只有一个连接在用的编码链路原地换到新设备，处理链在帧边界交叉淡入
+
+        链路被共享、在工作进程中，或者新设备上已有相同参数的链路时返回 False，由调用方换链路。
+        切换期间链路已登记在新设备下，同时加入的连接会从切换完成那一帧起听到新设备。
+        """
+        if broadcast.isolated:
+            return False
+
+        previous = broadcast.device
+        key = self.broadcast_key(previous, broadcast.options, broadcast.silence, False, broadcast.stages)
+        moved = self.broadcast_key(device, broadcast.options, broadcast.silence, False, broadcast.stages)
+
+        with self.lock:
+            entry = self.broadcasts.get(key)
+            if entry is None or entry[0] is not broadcast or entry[1] != 1 or moved in self.broadcasts:
+                return False
+            del self.broadcasts[key]
+            self.broadcasts[moved] = entry
+            broadcast.device = device
+
+        try:
+            broadcast.pcm.switch_device(device)
+        except Exception:
+            # 新设备打不开，链路仍在旧设备上
+            with self.lock:
+                if self.broadcasts.get(moved) is entry and key not in self.broadcasts:
+                    del self.broadcasts[moved]
+                    self.broadcasts[key] = entry
+                    broadcast.device = previous
+            raise
 
-def query_devices():
-    options = {
-        device.get("name"): index
-        for index, device in enumerate(sd.query_devices())
-        if (device.get("max_input_channels") > 0 and device.get("hostapi") == DEFAULT)
-    }
+        return True
 
-    if not options:
+    def restage_broadcast(self, broadcast, stages):
+        """只有一个连接在用的编码链路原地换上新的处理链，编码线程下一帧起使用
+
+        链路被共享、在工作进程中，或者同一设备上已有相同参数的链路时返回 False，由调用方换链路。
+        """
+        if broadcast.isolated:
+            return False
+
+        key = self.broadcast_key(broadcast.device, broadcast.options, broadcast.silence, False, broadcast.stages)
+        restaged = self.broadcast_key(broadcast.device, broadcast.options, broadcast.silence, False, stages)
+
+        with self.lock:
+            entry = self.broadcasts.get(key)
+            if entry is None or entry[0] is not broadcast or entry[1] != 1 or restaged in self.broadcasts:
+                return False
+            # 先构建新的处理链，配置有误时抛出，链路保持原样
+            broadcast.pcm.chain.configure(stages)
+            del self.broadcasts[key]
+            self.broadcasts[restaged] = entry
+            broadcast.stages = stages
+
+        return True
+
+    def release_broadcast(self, broadcast):
+        key = self.broadcast_key(
+            broadcast.device, broadcast.options, broadcast.silence, broadcast.isolated, broadcast.stages
+        )
+
+        with self.lock:
+            entry = self.broadcasts.get(key)
+            if entry is None or entry[0] is not broadcast:
+                return
+
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+
+            del self.broadcasts[key]
+
+        broadcast.close()
+
+
+hub = CaptureHub()
+
+
+class OpusStream(StreamSource):
+    """读取共享编码链路的Opus音频源，播放线程只取走编码好的包"""
+
+    def __init__(
+        self,
+        depth=None,
+        bitrate=128,
+        complexity=10,
+        fec=True,
+        expected_packet_loss=0.15,
+        silence=None,
+        isolated=False,
+        stages=None,
+    ):
+        StreamSource.__init__(self)
+        self.depth = depth or latency_profile.depth
+        self.timeout = read_timeout()
+        self.silence = silence
+        self.isolated = isolated
+        self.stages = stages
+        self.encoder_options = {
+            "bitrate": bitrate,
+            "complexity": complexity,
+            "fec": fec,
+            "expected_packet_loss": expected_packet_loss,
+        }
+
+        self.broadcast = None
+        self.reader = None
+
+        # 热切换：后台线程预热好的 (链路, 游标)，由播放线程在包边界换上
+        self.pending = None
+        self.switch_lock = threading.Lock()
+        self.switching = threading.Lock()
+        self.switched = threading.Event()
+        self.switcher = None
+
+    def is_opus(self):
+        return True
+
+    @property
+    def capture(self):
+        return self.broadcast.capture if self.broadcast is not None else None
+
+    @property
+    def overruns(self):
+        """链路的丢帧次数加上游标落后导致的丢包次数，包括换下的链路上的"""
+        broadcast = self.broadcast
+        if broadcast is None:
+            return self.dropped
+        return self.dropped + broadcast.overruns - self.overrun_base + self.reader.overruns
+
+    def attach(self, broadcast, reader):
+        """换上新的编码链路和游标，旧链路上的丢帧数计入累计值"""
+        self.dropped = self.overruns
+        self.overrun_base = broadcast.overruns
+        self.reader = reader
+        self.broadcast = broadcast
+
+    @property
+    def encode_cost(self):
+        return self.broadcast.encode_cost if self.broadcast is not None else 0.0
+
+    @property
+    def meter(self):
+        return self.broadcast.meter if self.broadcast is not None else None
+
+    def change_device(self, num):
+        num = device_registry.resolve(num)
+        broadcast = hub.acquire_broadcast(
+            num, self.depth, self.silence, self.isolated, self.stages, **self.encoder_options
+        )
+        previous = self.broadcast
+
+        reader = broadcast.packets.reader()
+        reader.set_muted(self.muted)
+        self.attach(broadcast, reader)
+
+        if previous is not None:
+            hub.release_broadcast(previous)
+
+    def switch_device(self, num):
+        """播放中热切换设备，不停止播放：在后台线程打开并预热新设备，返回该线程"""
+        thread = threading.Thread(target=self._switch, args=(num,), name=f"device-switch:{num}", daemon=True)
+        self.switcher = thread
+        thread.start()
+        return thread
+
+    def _switch(self, num):
+        try:
+            with self.switching:
+                num = device_registry.resolve(num)
+                broadcast = self.broadcast
+                if broadcast is None:
+                    self.change_device(num)
+                elif broadcast.device != num and not hub.move_broadcast(broadcast, num):
+                    self.swap_broadcast(num)
+        except Exception:
+            logger.exception("热切换到设备 %s 失败", num)
+
+    def swap_broadcast(self, num):
+        """链路被共享或在工作进程中时换到新设备的链路，等它产出第一个包后在包边界切换
+
+        两条链路的编码器状态不同，包边界处不做交叉淡化。
+        """
+        broadcast = hub.acquire_broadcast(
+            num, self.depth, self.silence, self.isolated, self.stages, **self.encoder_options
+        )
+        reader = broadcast.packets.reader()
+        reader.set_muted(self.muted)
+        deadline = time.perf_counter() + SWITCH_TIMEOUT
+        while not reader.available() and time.perf_counter() < deadline:
+            time.sleep(FRAME_LENGTH / 4)
+
+        previous = self.broadcast
+        self.switched.clear()
+        self.pending = (broadcast, reader)
+        if not self.switched.wait(SWITCH_TIMEOUT):
+            # 没有播放线程在读取，直接换上
+            self.take_switch()
+
+        hub.release_broadcast(previous)
+
+    def take_switch(self):
+        with self.switch_lock:
+            pending = self.pending
+            if pending is None:
+                return
+            self.pending = None
+
+        broadcast, reader = pending
+        # 预热期间积压的包只保留最新的一个
+        reader.position = max(reader.position, reader.ring.written - 1)
+        self.attach(broadcast, reader)
+        self.switched.set()
+
+    def set_stages(self, stages):
+        """替换处理链，设备的采集流保持打开
+
+        链路只有这个连接在用时原地换上新的处理链；否则换到对应配置的链路，
+        等它产出第一个包后在包边界切换。会阻塞到切换完成，播放中应在后台线程调用。
+        """
+        with self.switching:
+            broadcast = self.broadcast
+            restaged = broadcast is None or hub.restage_broadcast(broadcast, stages)
+            self.stages = stages
+            if not restaged:
+                self.swap_broadcast(broadcast.device)
+
+    def latency(self):
+        broadcast = self.broadcast
+        if broadcast is None:
+            return None
+        return self.reader.latency() + broadcast.capture_lag
+
+    def fill(self):
+        reader = self.reader
+        return reader.available() / reader.ring.capacity if reader is not None else 0.0
+
+    def read_frame(self):
+        if self.broadcast is None:
+            return
+
+        if self.pending is not None:
+            self.take_switch()
+
+        timeout = self.timeout
+        if self.muted:
+            packet = self.wait_for_unmute()
+            if packet is not None:
+                return packet
+            # 编码线程可能正在跳过一帧，多等它一帧
+            timeout += FRAME_LENGTH
+
+        packet = self.reader.read(timeout)
+        if packet is None:
+            self.underruns += 1
+            return OPUS_SILENCE
+
+        if packet is GATED:
+            self.silent += 1
+            if self.silent > SILENCE_FRAMES:
+                return self.wait_for_signal()
+            return OPUS_SILENCE
+
+        if self.silent:
+            self.resume_speaking()
+
+        return packet
+
+    def set_muted(self, muted):
+        """静音时读取游标也标记为静音，链路的所有连接都静音后编码线程停止编码"""
+        reader = self.reader
+        if reader is not None:
+            reader.set_muted(muted)
+        StreamSource.set_muted(self, muted)
+
+    def skip(self):
+        self.reader.skip()
+
+    def keepalive(self):
+        return OPUS_SILENCE
+
+    def wait_for_signal(self):
+        """静音期间不返回数据（即不发包），直到编码链路产出新的包"""
+        self.pause_speaking()
+
+        deadline = time.perf_counter() + PARK_LIMIT
+        while player_active() and time.perf_counter() < deadline:
+            packet = self.reader.read(FRAME_LENGTH)
+            if packet:
+                self.resume_speaking()
+                resync_player()
+                return packet
+
+        # 保活：播放线程需要退出或者静音太久时返回一个静音包
+        resync_player()
+        return OPUS_SILENCE
+
+    def close(self):
+        # 等正在进行的热切换结束，否则它会在关闭之后再换上新链路
+        with self.switching:
+            if self.broadcast is not None:
+                broadcast = self.broadcast
+                self.dropped = self.overruns
+                self.broadcast = None
+                self.reader = None
+                hub.release_broadcast(broadcast)
+
+
+ProbeResult = namedtuple("ProbeResult", "index identity latency jitter blocksizes")
+
+
+def probe_device(index, blocksizes=PROBE_BLOCKSIZES, duration=PROBE_DURATION):
+    """短暂打开设备，测量实际输入延迟、回调抖动和可用的块大小
+
+    输入延迟取回调时刻与缓冲区首个采样的ADC时刻之差，驱动不提供时间戳时
+    退回 PortAudio 报告的流延迟加一个块的时长。返回各块大小中延迟最低的一组。
+    """
+    samplerate, channels = native_format(index)
+    supported = {}
+
+    for blocksize in blocksizes:
+        arrivals = []
+        delays = []
+
+        def callback(indata, frames, time_info, status):
+            arrivals.append(time.perf_counter())
+            try:
+                delay = time_info.currentTime - time_info.inputBufferAdcTime
+            except AttributeError:
+                delay = 0.0
+            delays.append(delay)
+
+        try:
+            stream = sd.RawInputStream(
+                device=index,
+                samplerate=samplerate,
+                channels=channels,
+                blocksize=blocksize,
+                callback=callback,
+            )
+            stream.start()
+            time.sleep(duration)
+            stream.stop()
+            stream.close()
+        except Exception:
+            continue
+
+        # 第一个回调通常包含打开流时的启动延迟，不计入统计
+        if len(arrivals) < 3:
+            continue
+
+        intervals = np.diff(arrivals[1:])
+        measured = float(np.median(delays[1:]))
+        if measured <= 0:
+            measured = float(getattr(stream, "latency", 0.0) or 0.0) + blocksize / samplerate
+        supported[blocksize] = (measured, float(np.std(intervals)))
+
+    if not supported:
+        return None
+
+    latency, jitter = min(supported.values())
+    return ProbeResult(index, device_registry.identity(index), latency, jitter, tuple(supported))
+
+
+def probe_devices(indices=None, **options):
+    """探测所有主机API上的输入设备，按测得的延迟从低到高排序
+
+    已经在采集中的设备不会再次打开，使用 PortAudio 报告的延迟代替。
+    """
+    devices = device_registry.query()
+    if indices is None:
+        indices = [index for index, device in enumerate(devices) if device.get("max_input_channels") > 0]
+
+    results = []
+    for index in indices:
+        if index in hub.captures:
+            result = ProbeResult(
+                index, device_registry.identity(index), reported_latency(devices[index]), None, ()
+            )
+        else:
+            result = probe_device(index, **options)
+
+        if result is not None:
+            results.append(result)
+
+    results.sort(key=lambda result: result.latency)
+    return results
+
+
+def select_device(policy="latency", name=None):
+    """按策略选择输入设备，返回设备索引
+
+    latency: 逐个探测，选实际延迟最低的设备
+    reported: 不打开设备，选 PortAudio 报告的低延迟最小的设备
+    default: 默认主机API上的第一个输入设备（原来的行为）
+    name 不为空时只在设备名包含该字符串的设备中选择，用于为同一设备挑选最快的主机API。
+    """
+    devices = device_registry.query()
+    candidates = [
+        index
+        for index, device in enumerate(devices)
+        if device.get("max_input_channels") > 0 and (name is None or name in device.get("name"))
+    ]
+    if not candidates:
         raise DeviceNotFoundError()
 
-    return options
+    if policy == "latency":
+        results = probe_devices(candidates)
+        if results:
+            return results[0].index
+        policy = "reported"
+
+    if policy == "reported":
+        return min(candidates, key=lambda index: reported_latency(devices[index]))
+
+    if policy == "default":
+        preferred = [index for index in candidates if devices[index].get("hostapi") == DEFAULT]
+        return (preferred or candidates)[0]
+
+    raise ValueError(f"未知的设备选择策略: {policy}")
@@ -0,0 +1,335 @@
+import time
+import logging
+import weakref
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import sound
+
+logger = logging.getLogger(__name__)
+
+# 工作进程用 spawn 启动，不继承父进程的PortAudio、discord和Qt状态
+START_METHOD = "spawn"
+
+# 读取方等待新包时的轮询间隔（秒），跨进程没有可以廉价唤醒的条件变量
+POLL_INTERVAL = 0.001
+
+# 监控线程的检查间隔、心跳超时和刚启动时等待导入完成的宽限时间（秒）
+MONITOR_INTERVAL = 0.5
+HEARTBEAT_TIMEOUT = 3.0
+STARTUP_GRACE = 20.0
+
+# 连续重启失败时的退避（秒）
+RESPAWN_BASE = 0.5
+RESPAWN_MAX = 30.0
+
+# 头部的整数字段
+WRITTEN, ENCODED, OVERRUNS, IDLE = range(4)
+# 头部的浮点字段
+WRITE_TIME, HEARTBEAT, CAPTURE_LAG, ENCODE_TIME = range(4)
+
+
+class SharedPacketRing:
+    """放在 multiprocessing.shared_memory 中的Opus包环形缓冲区
+
+    工作进程是唯一的写入方，机器人进程中的每个连接持有自己的读取游标。
+    布局依次为：整数头部、浮点头部、电平槽位、每个槽位的序号和包长度、包数据。
+    IDLE 由机器人进程写入：所有读取游标都静音时为1，工作进程据此停止编码。
+    写入时先把槽位序号置为 -1，写完数据后再写入包的位置，读取方拷贝完成后
+    再核对一次序号，不一致说明读取期间被覆盖。
+    """
+
+    def __init__(self, capacity, name=None):
+        self.capacity = capacity
+
+        sizes = (4 * 8, 4 * 8, 8, 2 * 4, capacity * 8, capacity * 8, capacity * sound.MAX_PACKET_SIZE)
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=sum(sizes))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+
+        offsets = np.cumsum((0,) + sizes)
+        buffer = self.shm.buf
+        self.counters = np.ndarray(4, dtype=np.int64, buffer=buffer, offset=offsets[0])
+        self.times = np.ndarray(4, dtype=np.float64, buffer=buffer, offset=offsets[1])
+        meter_sequence = np.ndarray(1, dtype=np.uint64, buffer=buffer, offset=offsets[2])
+        meter_slot = np.ndarray(2, dtype=np.float32, buffer=buffer, offset=offsets[3])
+        self.sequence = np.ndarray(capacity, dtype=np.int64, buffer=buffer, offset=offsets[4])
+        self.lengths = np.ndarray(capacity, dtype=np.int64, buffer=buffer, offset=offsets[5])
+        self.data = np.ndarray(
+            (capacity, sound.MAX_PACKET_SIZE), dtype=np.uint8, buffer=buffer, offset=offsets[6]
+        )
+
+        self.meter = sound.LevelMeter(meter_slot, meter_sequence)
+        self.readers = weakref.WeakSet()
+        self.readers_lock = threading.Lock()
+
+        if self.owner:
+            self.counters.fill(0)
+            self.times.fill(0)
+            self.sequence.fill(-1)
+            self.times[WRITE_TIME] = time.perf_counter()
+
+    @property
+    def written(self):
+        return int(self.counters[WRITTEN])
+
+    @property
+    def write_time(self):
+        return float(self.times[WRITE_TIME])
+
+    def write(self, packet):
+        position = int(self.counters[WRITTEN])
+        slot = position % self.capacity
+        size = len(packet)
+
+        self.sequence[slot] = -1
+        self.data[slot, :size] = np.frombuffer(packet, dtype=np.uint8)
+        self.lengths[slot] = size
+        self.sequence[slot] = position
+
+        self.counters[WRITTEN] = position + 1
+        self.times[WRITE_TIME] = time.perf_counter()
+
+    def beat(self):
+        self.times[HEARTBEAT] = time.perf_counter()
+
+    @property
+    def idle(self):
+        return bool(self.counters[IDLE])
+
+    def publish_idle(self):
+        """在机器人进程中调用：把读取游标是否都已静音写入头部"""
+        # 连接线程和监控线程都会调用，在锁内取快照再遍历
+        with self.readers_lock:
+            readers = list(self.readers)
+        self.counters[IDLE] = int(bool(readers) and all(reader.muted for reader in readers))
+
+    def reader(self):
+        reader = SharedPacketReader(self)
+        with self.readers_lock:
+            self.readers.add(reader)
+        self.publish_idle()
+        return reader
+
+    def close(self):
+        # 先释放指向共享内存的数组，否则 SharedMemory.close() 会因缓冲区仍被引用而失败
+        self.counters = self.times = self.sequence = self.lengths = self.data = None
+        self.meter = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedPacketReader:
+    """SharedPacketRing 上的独立读取游标，接口与 sound.PacketReader 相同"""
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.position = ring.written
+        self.overruns = 0
+        self.muted = False
+
+    def set_muted(self, muted):
+        self.muted = muted
+        self.ring.publish_idle()
+
+    def skip(self):
+        self.position = self.ring.written
+
+    def available(self):
+        return self.ring.written - self.position
+
+    def latency(self):
+        """刚读出的包距离编码完成的时间（秒）"""
+        ring = self.ring
+        return (ring.written - self.position) * sound.FRAME_LENGTH + time.perf_counter() - ring.write_time
+
+    def read(self, timeout):
+        """取出下一个包，超时返回 None"""
+        ring = self.ring
+
+        if ring.written == self.position:
+            deadline = time.perf_counter() + timeout
+            while ring.written == self.position:
+                if time.perf_counter() >= deadline:
+                    return None
+                time.sleep(POLL_INTERVAL)
+
+        while True:
+            written = ring.written
+            if written - self.position > ring.capacity - 1:
+                # 落后超过缓冲深度，丢弃旧包，从最新的包继续
+                self.overruns += 1
+                self.position = written - 1
+
+            slot = self.position % ring.capacity
+            size = int(ring.lengths[slot])
+            packet = ring.data[slot, :size].tobytes()
+
+            # 读取期间该槽位可能已被新包覆盖
+            if int(ring.sequence[slot]) != self.position:
+                continue
+
+            self.position += 1
+            return packet if size else sound.GATED
+
+
+def worker_main(device, depth, options, silence, stages, profile, name, capacity, stop):
+    """工作进程入口：打开设备、编码，把包写入共享内存"""
+    # spawn 出的进程重新导入 sound，延迟配置需要从父进程带过来
+    sound.set_latency_profile(profile)
+    ring = SharedPacketRing(capacity, name=name)
+    broadcast = sound.OpusBroadcast(device, depth, options, silence, stages)
+    broadcast.pcm.meter = ring.meter
+    reader = broadcast.packets.reader()
+    parent = multiprocessing.parent_process()
+
+    try:
+        while not stop.is_set() and (parent is None or parent.is_alive()):
+            ring.beat()
+            # 机器人进程中的连接都静音时，编码线程只跳过采集数据
+            reader.set_muted(ring.idle)
+            packet = reader.read(sound.FRAME_LENGTH)
+            if packet is None:
+                continue
+
+            ring.write(packet)
+            ring.counters[ENCODED] = broadcast.encoded
+            ring.counters[OVERRUNS] = broadcast.overruns
+            ring.times[CAPTURE_LAG] = broadcast.capture_lag
+            ring.times[ENCODE_TIME] = broadcast.encode_time
+    finally:
+        broadcast.close()
+        broadcast.pcm.meter = sound.LevelMeter()
+        ring.close()
+
+
+class ProcessBroadcast:
+    """在独立工作进程中运行的采集+编码链路，接口与 sound.OpusBroadcast 相同
+
+    包通过共享内存传回机器人进程，播放线程不再和采集、编码争用同一个GIL，
+    PortAudio的崩溃也只会结束工作进程。监控线程发现进程退出或心跳停止后重启它，
+    共享内存和读取游标保持不变，重启期间读取方拿到的是静音包，语音连接不受影响。
+    """
+
+    isolated = True
+
+    def __init__(self, device, depth, options, silence=None, stages=None):
+        self.device = device
+        self.depth = depth
+        self.options = options
+        self.silence = silence
+        self.stages = stages
+        self.profile = sound.latency_profile.name
+        self.packets = SharedPacketRing(depth)
+        self.context = multiprocessing.get_context(START_METHOD)
+        self.stop = self.context.Event()
+        self.process = None
+        self.restarts = 0
+        self.failures = 0
+        self.dropped = 0
+
+        self.spawn()
+        self.closing = threading.Event()
+        self.monitor = threading.Thread(target=self._monitor_loop, name=f"worker-monitor:{device}", daemon=True)
+        self.monitor.start()
+
+    @property
+    def capture(self):
+        # 采集流在工作进程中
+        return None
+
+    @property
+    def overruns(self):
+        # 重启的工作进程从零开始计数，之前进程的计数累计在 dropped 中
+        return self.dropped + int(self.packets.counters[OVERRUNS])
+
+    @property
+    def meter(self):
+        return self.packets.meter
+
+    @property
+    def capture_lag(self):
+        return float(self.packets.times[CAPTURE_LAG])
+
+    @property
+    def encode_cost(self):
+        """平均每帧编码耗时（毫秒）"""
+        encoded = int(self.packets.counters[ENCODED])
+        if not encoded:
+            return 0.0
+        return float(self.packets.times[ENCODE_TIME]) / encoded * 1000
+
+    def spawn(self):
+        # 新进程导入模块需要时间，在宽限期内不检查心跳
+        self.packets.times[HEARTBEAT] = time.perf_counter() + STARTUP_GRACE
+        self.process = self.context.Process(
+            target=worker_main,
+            args=(
+                self.device,
+                self.depth,
+                self.options,
+                self.silence,
+                self.stages,
+                self.profile,
+                self.packets.name,
+                self.packets.capacity,
+                self.stop,
+            ),
+            name=f"dap-worker:{self.device}",
+            daemon=True,
+        )
+        self.process.start()
+
+    def _monitor_loop(self):
+        while not self.closing.wait(MONITOR_INTERVAL):
+            # 连接释放游标时不会通知，这里定期重新计算
+            self.packets.publish_idle()
+
+            process = self.process
+            heartbeat = float(self.packets.times[HEARTBEAT])
+            now = time.perf_counter()
+            if process.is_alive() and now - heartbeat <= HEARTBEAT_TIMEOUT:
+                # 工作进程已经开始心跳才算启动成功
+                if heartbeat <= now:
+                    self.failures = 0
+                continue
+
+            if process.is_alive():
+                logger.warning("设备 %s 的工作进程 %s 无响应，正在重启", self.device, process.pid)
+                process.kill()
+            else:
+                logger.warning(
+                    "设备 %s 的工作进程 %s 已退出 (退出码 %s)，正在重启", self.device, process.pid, process.exitcode
+                )
+            process.join()
+
+            # 旧进程已经退出，不会再写计数
+            self.dropped += int(self.packets.counters[OVERRUNS])
+            self.packets.counters[OVERRUNS] = 0
+
+            delay = min(RESPAWN_MAX, RESPAWN_BASE * 2 ** self.failures)
+            self.failures += 1
+            if self.closing.wait(delay):
+                break
+
+            self.restarts += 1
+            self.spawn()
+
+    def close(self):
+        self.closing.set()
+        self.stop.set()
+        self.monitor.join()
+
+        self.process.join(1.0)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+        self.packets.close()